@@ -1,10 +1,82 @@
 import streamlit as st
 import pandas as pd
-from memory import load_schema_memory, save_schema_memory, load_global_memory, save_global_memory
-from llm import process_query_with_llama
-from db import query_db
+from memory import load_schema_memory, save_schema_memory, load_global_memory, save_global_memory, load_schema_memory_raw, iter_schema_tables, split_table_name
+from llm import process_query_with_llama, llm_flight
+from prompt_cache import prompt_prefix_cache
+from answer_cache import answer_cache
+from result_cache import result_cache
+from schema_sync import schema_sync
+from db import query_db, query_timeout_for_role
 from schema import extract_table_schema, extract_drops_from_sql
 from utils.vector import ingest_file
+from bulkload import BULK_EXTENSIONS, iter_file_chunks, peek_file, table_columns, guess_table, suggest_mapping, bulk_insert
+
+def run_bulk_load(uploaded_file):
+    """Load the rows of an uploaded CSV/Excel file straight into a table; the LLM only suggests the column mapping."""
+    databases = sorted({db for db, _, _ in iter_schema_tables(load_schema_memory_raw())})
+    if not databases:
+        st.warning("⚠️ No databases in schema memory yet.")
+        return
+    current = st.session_state.get("db_name")
+    database = st.selectbox("Target database", databases, index=databases.index(current) if current in databases else 0)
+
+    sample = peek_file(uploaded_file, uploaded_file.name)
+    if sample.empty:
+        st.warning("⚠️ The file has no rows.")
+        return
+    st.dataframe(sample)
+
+    state_key = (uploaded_file.name, uploaded_file.size, database)
+    if st.session_state.get("bulk_mapping_key") != state_key:
+        st.session_state.bulk_mapping_key = state_key
+        st.session_state.bulk_mapping = guess_table(list(sample.columns), database)
+
+    tables = table_columns(database)
+    guessed, mapping = st.session_state.bulk_mapping
+    table_names = sorted(tables)
+    table = st.selectbox("Target table", table_names, index=table_names.index(guessed) if guessed in table_names else 0)
+    if table != guessed:
+        mapping = {}
+
+    if st.button("🤖 Suggest column mapping"):
+        try:
+            st.session_state.bulk_mapping = suggest_mapping(sample, database, table)
+            st.rerun()
+        except Exception as e:
+            st.error(f"Mapping suggestion failed: {e}")
+
+    edited = st.data_editor(
+        pd.DataFrame({"file column": list(sample.columns), "table column": [mapping.get(c) for c in sample.columns]}),
+        column_config={
+            "file column": st.column_config.TextColumn(disabled=True),
+            "table column": st.column_config.SelectboxColumn(options=tables.get(table, [])),
+        },
+        hide_index=True,
+        # A new suggestion must replace earlier edits, so the key follows the mapping
+        key=f"bulk_mapping_editor_{table}_{hash(frozenset(mapping.items()))}",
+    )
+    final_mapping = {row["file column"]: row["table column"] for _, row in edited.iterrows() if row["table column"]}
+
+    if st.button("⬆️ Bulk load rows", disabled=not final_mapping):
+        progress = st.empty()
+        try:
+            stats = bulk_insert(
+                iter_file_chunks(uploaded_file, uploaded_file.name),
+                database,
+                table,
+                final_mapping,
+                on_progress=lambda rows, seconds: progress.caption(f"⏳ {rows:,} rows ({rows / max(seconds, 1e-6):,.0f} rows/s)"),
+            )
+            # Cached results record the tables they read by bare name
+            result_cache.invalidate_tables({(database, split_table_name(table)[1])})
+            progress.empty()
+            st.success(f"✅ Loaded {stats['rows']:,} rows into {table} in {stats['seconds']:.1f}s "
+                       f"({stats['rows_per_sec']:,.0f} rows/s).")
+        except Exception as e:
+            progress.empty()
+            st.error(f"Bulk load failed, nothing was inserted: {e}")
+        finally:
+            uploaded_file.seek(0)
 
 def run_admin_tools():
     if not st.session_state.is_admin:
@@ -13,7 +85,27 @@ def run_admin_tools():
 
     st.markdown("### 🛠️ Admin Tools")
 
-    uploaded_file = st.file_uploader("Upload PDF/CSV/TXT/JSON/Images/BAK", type=['pdf', 'csv', 'txt', 'json', 'png', 'jpg', 'jpeg','bak'])
+    with st.expander("📈 Cache metrics"):
+        st.json({
+            "prompt_prefix_cache": prompt_prefix_cache.stats(),
+            "answer_cache": answer_cache.stats(),
+            "result_cache": result_cache.stats(),
+            "coalesced_requests": llm_flight.stats(),
+        })
+
+    with st.expander("🔄 Schema sync"):
+        if st.button("Sync schema memory now"):
+            with st.spinner("Comparing catalog signatures..."):
+                schema_sync.refresh_all()
+        st.json(schema_sync.stats())
+
+    uploaded_file = st.file_uploader("Upload PDF/CSV/XLSX/TXT/JSON/Images/BAK", type=['pdf', 'csv', 'xlsx', 'xlsm', 'txt', 'json', 'png', 'jpg', 'jpeg','bak'])
+
+    if uploaded_file and uploaded_file.name.lower().endswith(BULK_EXTENSIONS) and not st.session_state.get("pending_schema_suggestion"):
+        mode = st.radio("Use this file to", ["Bulk-load its rows into a table", "Generate SQL with the model"])
+        if mode.startswith("Bulk"):
+            run_bulk_load(uploaded_file)
+            return
 
     if uploaded_file and not st.session_state.get("pending_schema_suggestion"):
         ingest_file(uploaded_file, st.session_state.user_id)    
@@ -36,7 +128,7 @@ def run_admin_tools():
             "Finally, ask the admin to confirm whether the uploaded content is correct and complete before generating SQL."
         )
 
-        clarification_msg = process_query_with_llama(clarification_prompt, st.session_state.memory, is_admin=True,is_selecteddatabse=False)
+        clarification_msg = process_query_with_llama(clarification_prompt, st.session_state.memory, is_admin=True,is_selecteddatabse=False, call_type="clarification")
 
         st.session_state.pending_schema_suggestion = {
             "filename": uploaded_file.name,
@@ -99,7 +191,7 @@ def run_admin_tools():
                 "9. Only produce the T-SQL code based on the provided content and clarification. Do not assume or fabricate any structure.\n"
             )
 
-            final_sql = process_query_with_llama(final_prompt, st.session_state.memory, is_admin=True,is_selecteddatabse=False)
+            final_sql = process_query_with_llama(final_prompt, st.session_state.memory, is_admin=True,is_selecteddatabse=False, call_type="sql")
             st.session_state.pending_schema_suggestion["final_sql"] = final_sql.strip()
             st.session_state.pending_schema_suggestion["confirmed"] = True
             st.rerun()
@@ -109,9 +201,14 @@ def run_admin_tools():
         st.code(pending["final_sql"], language="sql")
 
         if not pending.get("executed"):
+            # CREATE DATABASE cannot run inside a transaction, so this stays opt-in
+            as_transaction = st.checkbox("Run as a single transaction (roll back everything on failure)")
             if st.button("▶️ Execute SQL"):
                 try:
-                    result = query_db(pending["final_sql"])
+                    outcome = query_db(pending["final_sql"], timeout=query_timeout_for_role(True), transaction=as_transaction)
+                    if outcome["status"] != "ok":
+                        raise RuntimeError(outcome["error"])
+                    result = outcome["result"]
                     if result is not None:
                         if isinstance(result, pd.DataFrame):
                             st.dataframe(result)
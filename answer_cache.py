@@ -0,0 +1,300 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (
+    ANSWER_CACHE_FILE,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_CONTEXT_TURNS,
+    ANSWER_CACHE_SAVE_DELAY,
+)
+from memory import on_schema_change
+from schema_retriever import embed_question, schema_fingerprint
+
+# Only read-only SQL is cached: a near-duplicate match must never replay a write
+WRITE_SQL_RE = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|ALTER|TRUNCATE|EXEC|EXECUTE|GRANT|REVOKE)\b",
+    re.IGNORECASE,
+)
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+# Questions that refine the previous turn ("now only for 2023", "same but by region")
+# rather than stand on their own
+FOLLOW_UP_RE = re.compile(
+    r"^(and|but|now|then|also|instead|what about|how about|same|only|just)\b"
+    r"|\b(same|those|these|them|it|that|previous|above|instead|also|again|too|only|just)\b",
+    re.IGNORECASE,
+)
+MIN_STANDALONE_WORDS = 4
+
+
+def normalize_question(question):
+    question = question.lower().strip()
+    question = re.sub(r"\s+", " ", question)
+    return question.strip(" ?!.;")
+
+
+def conversation_context(question, history, turns=ANSWER_CACHE_CONTEXT_TURNS):
+    """
+    Hash of the last `turns` messages of `history` when `question` looks like a
+    follow-up to them (a continuation or reference word, or too short to stand
+    alone), else "". Follow-ups are only served from entries with the same
+    recent conversation; standalone questions are shared across users.
+    """
+    messages = [
+        f"{msg.get('role')}: {msg.get('content')}"
+        for msg in (history or [])
+        if isinstance(msg, dict) and msg.get("role") in ("user", "assistant")
+    ]
+    if turns <= 0 or not messages:
+        return ""
+    normalized = normalize_question(question)
+    if not FOLLOW_UP_RE.search(normalized) and len(normalized.split()) >= MIN_STANDALONE_WORDS:
+        return ""
+    messages = messages[-turns:]
+    return hashlib.sha256("\n".join(messages).encode("utf-8")).hexdigest()[:16]
+
+
+class _VectorGroup:
+    """Question embeddings of the cache entries for one (role, database), as one preallocated matrix."""
+
+    def __init__(self, dim):
+        self.matrix = np.empty((16, dim), dtype=np.float32)
+        self.keys = []
+        self.rows = {}
+
+    def add(self, key, vector):
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self.matrix):
+                grown = np.empty((2 * row, self.matrix.shape[1]), dtype=np.float32)
+                grown[:row] = self.matrix
+                self.matrix = grown
+            self.keys.append(key)
+            self.rows[key] = row
+        self.matrix[row] = vector
+
+    def remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        # Move the last row into the gap so the matrix stays dense
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self.matrix[row] = self.matrix[last]
+            self.keys[row] = moved
+            self.rows[moved] = row
+        self.keys.pop()
+
+    def scores(self, query_vector):
+        return self.matrix[:len(self.keys)] @ query_vector
+
+
+class AnswerCache:
+    """
+    Persistent cache of generated SQL, keyed by normalized question, database,
+    role and conversation context (see conversation_context), and checked
+    against a fingerprint of the schema memory of the tables it used.
+
+    Lookups first try an exact key, then the most similar cached question for
+    the same database and role (cosine similarity of question embeddings above
+    ANSWER_CACHE_SIMILARITY, with identical numbers in both questions).
+    Entries expire after ANSWER_CACHE_TTL seconds, are evicted least recently
+    used beyond ANSWER_CACHE_MAX_ENTRIES, and are dropped when save_schema_memory
+    changes one of their tables. Questions are embedded outside the lock, and
+    changes are written to the file at most once per save_delay seconds.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_FILE, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 ttl=ANSWER_CACHE_TTL, similarity=ANSWER_CACHE_SIMILARITY, save_delay=ANSWER_CACHE_SAVE_DELAY):
+        self.path = path
+        self.save_delay = save_delay
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.entries = OrderedDict()
+        self.vectors = {}  # (role, database) -> _VectorGroup
+        self.lock = threading.RLock()
+        self._write_lock = threading.Lock()  # one file write at a time
+        self._save_timer = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def make_key(question, database, role, context=""):
+        return f"{role}|{(database or '').lower()}|{context}|{normalize_question(question)}"
+
+    def _add(self, entry):
+        self.entries[entry["key"]] = entry
+        self.entries.move_to_end(entry["key"])
+        if entry["embedding"]:
+            vector = np.asarray(entry["embedding"], dtype=np.float32)
+            group = self.vectors.get((entry["role"], entry["database"]))
+            if group is None:
+                group = self.vectors[(entry["role"], entry["database"])] = _VectorGroup(len(vector))
+            group.add(entry["key"], vector)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        group = self.vectors.get((entry["role"], entry["database"]))
+        if group is not None:
+            group.remove(key)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable answer cache: {e}")
+            return
+        for entry in sorted(stored, key=lambda e: e.get("last_used", 0)):
+            if "context" not in entry:
+                # Written before keys carried conversation context
+                continue
+            self._add(entry)
+
+    def _save(self):
+        # Called with self.lock held: changes arriving before the timer fires share one write
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Write pending changes to the cache file now."""
+        with self._write_lock:
+            with self.lock:
+                if self._save_timer is None:
+                    return
+                self._save_timer.cancel()
+                self._save_timer = None
+                entries = list(self.entries.values())
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=os.path.dirname(os.path.abspath(self.path)),
+                prefix=os.path.basename(self.path) + ".", suffix=".tmp", delete=False,
+            ) as f:
+                json.dump(entries, f, ensure_ascii=False)
+            try:
+                os.replace(f.name, self.path)
+            except OSError:
+                os.remove(f.name)
+                raise
+
+    def _is_valid(self, entry, now):
+        if now - entry["created"] > self.ttl:
+            return False
+        return entry["schema_hash"] == schema_fingerprint(entry["tables"])
+
+    def _find_similar(self, question, query_vector, database, role, context, now):
+        group = self.vectors.get((role, (database or "").lower()))
+        if group is None or not group.keys:
+            return None
+        numbers = _NUMBER_RE.findall(question)
+
+        scores = group.scores(query_vector)
+        rows = np.flatnonzero(scores >= self.similarity)
+        for row in rows[np.argsort(-scores[rows])]:
+            entry = self.entries[group.keys[row]]
+            if entry["context"] != context or _NUMBER_RE.findall(entry["question"]) != numbers:
+                continue
+            if self._is_valid(entry, now):
+                return entry
+        return None
+
+    def get(self, question, database, role, context=""):
+        """Return the cached SQL for `question` asked in `context`, or None."""
+        now = time.time()
+        key = self.make_key(question, database, role, context)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and not self._is_valid(entry, now):
+                self._remove(key)
+                entry = None
+            group = self.vectors.get((role, (database or "").lower()))
+            searchable = group is not None and bool(group.keys)
+
+        if entry is None and searchable:
+            # Embedding takes far longer than the lookup, so other sessions are not kept waiting on it
+            query_vector = embed_question(normalize_question(question))
+            if query_vector is not None:
+                with self.lock:
+                    entry = self._find_similar(question, query_vector, database, role, context, now)
+
+        with self.lock:
+            if entry is None or entry["key"] not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry["last_used"] = now
+            self.entries.move_to_end(entry["key"])
+            return entry["sql"]
+
+    def put(self, question, database, role, tables, sql, context=""):
+        """Cache `sql` generated for `question` in `context` from the (database, table) pairs in `tables`."""
+        if not tables or not sql or WRITE_SQL_RE.search(sql):
+            return
+
+        now = time.time()
+        normalized = normalize_question(question)
+        query_vector = embed_question(normalized)
+        key = self.make_key(question, database, role, context)
+        entry = {
+            "key": key,
+            "question": normalized,
+            "database": (database or "").lower(),
+            "role": role,
+            "context": context,
+            "tables": [[db.lower(), table.lower()] for db, table in tables],
+            "schema_hash": schema_fingerprint(tables),
+            "sql": sql,
+            "embedding": query_vector.tolist() if query_vector is not None else [],
+            "created": now,
+            "last_used": now,
+        }
+        with self.lock:
+            self._add(entry)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+            self._save()
+
+    def invalidate_tables(self, changed):
+        """Drop every entry that used one of the (database, table) pairs in `changed`."""
+        with self.lock:
+            stale = [
+                key for key, entry in self.entries.items()
+                if any(tuple(t) in changed for t in entry["tables"])
+            ]
+            for key in stale:
+                self._remove(key)
+            if stale:
+                self._save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.vectors.clear()
+            self._save()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+answer_cache = AnswerCache()
+on_schema_change(answer_cache.invalidate_tables)
+atexit.register(answer_cache.flush)
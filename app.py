@@ -20,6 +20,10 @@ if not st.session_state.get("user_id"):
     st.warning("⚠️ Please log in or register from the sidebar to continue.")
     st.stop()
 
+# Keep schema memory in step with the server in the background (started once per process)
+from schema_sync import start_schema_sync
+start_schema_sync()
+
 # CSS for the header and animated underline
 st.markdown(
     """
@@ -0,0 +1,540 @@
+import sqlite3
+import threading
+import zlib
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+from config import DB_BACKEND, DB_SERVER, USE_WINDOWS_AUTH, SQLITE_SEED_ROWS
+from memory import load_schema_memory_raw, iter_schema_tables, split_table_name
+from tsql_lexer import NAME_KINDS, iter_tokens, unquote_identifier
+
+SYSTEM_DATABASES = ("master", "tempdb", "model", "msdb")
+
+
+def _quote(name):
+    return "[" + name.replace("]", "]]") + "]"
+
+
+class SqlServerBackend:
+    """
+    SQL Server through pyodbc. Runs whole GO-batches, reads every result set
+    with nextset() and can estimate plans with SHOWPLAN_XML.
+    """
+
+    name = "sqlserver"
+    batches = True
+    estimates_cost = True
+
+    def __init__(self):
+        self.errors = (pyodbc.Error,) if pyodbc is not None else ()
+
+    def connect(self):
+        conn_str = (
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+            f"SERVER={DB_SERVER};"
+            f"{'Trusted_Connection=yes;' if USE_WINDOWS_AUTH else ''}"
+        )
+        return pyodbc.connect(conn_str, autocommit=True)
+
+    def current_database(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT DB_NAME()")
+        name = cursor.fetchone()[0]
+        cursor.close()
+        return name
+
+    def use_database(self, conn, database):
+        cursor = conn.cursor()
+        cursor.execute(f"USE {_quote(database)}")
+        cursor.close()
+
+    def session_state(self, conn):
+        """SET options and other session settings that a pooled connection must get back unchanged."""
+        cursor = conn.cursor()
+        cursor.execute(SESSION_STATE_QUERY)
+        state = tuple(cursor.fetchone())
+        cursor.close()
+        return state
+
+    def reset_session(self, conn, database):
+        """
+        Roll back any transaction the caller left open, switch back to
+        `database` and return session_state(), in one round trip.
+        """
+        cursor = conn.cursor()
+        cursor.execute(f"IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION; USE {_quote(database)}; {SESSION_STATE_QUERY}")
+        while cursor.description is None and cursor.nextset():
+            pass
+        row = cursor.fetchone() if cursor.description else None
+        cursor.close()
+        return tuple(row) if row else None
+
+    def ping(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except self.errors:
+            return False
+
+    def list_databases(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT name FROM sys.databases
+            WHERE name NOT IN ({", ".join("?" for _ in SYSTEM_DATABASES)})
+        """, SYSTEM_DATABASES)
+        return [row[0] for row in cursor.fetchall()]
+
+    def reflect_schema(self, conn, database, tables=None):
+        """
+        Return schema memory entries for the base tables of `database`, or only
+        those named in `tables` (qualified_table_name() form):
+        {"database", "schema", "table", "columns": [[name, type, nullable, is_pk, is_fk], ...]}.
+        The catalog is read with set-based queries over sys.* views.
+        """
+        cursor = conn.cursor()
+        cursor.execute(f"USE {_quote(database)}")
+        if tables is None:
+            batches = [(CATALOG_QUERY + CATALOG_ORDER, [])]
+        else:
+            names = [".".join(split_table_name(name)) for name in tables]
+            batches = [
+                (CATALOG_QUERY + f"WHERE CONCAT(SCHEMA_NAME(t.schema_id), '.', t.name) IN "
+                 f"({', '.join('?' for _ in chunk)})" + CATALOG_ORDER, chunk)
+                for chunk in (names[i:i + 1000] for i in range(0, len(names), 1000))
+            ]
+
+        found = {}
+        for sql, params in batches:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                for schema, table, column, data_type, nullable, is_pk, is_fk in rows:
+                    found.setdefault((schema, table), []).append(
+                        [column, data_type, nullable, bool(is_pk), bool(is_fk)]
+                    )
+        return [
+            {"database": database, "schema": schema, "table": table, "columns": columns}
+            for (schema, table), columns in found.items()
+        ]
+
+    def table_signatures(self, conn, database):
+        """
+        Return {(schema, table): (modify_date, column checksum)} for every table
+        of `database` in one query.
+        """
+        cursor = conn.cursor()
+        cursor.execute(f"USE {_quote(database)}")
+        cursor.execute(SIGNATURE_QUERY)
+        return {
+            (schema, table): (modified, checksum)
+            for schema, table, modified, checksum in cursor.fetchall()
+        }
+
+
+# A session can always read its own row of sys.dm_exec_sessions
+SESSION_STATE_QUERY = """
+    SELECT @@TRANCOUNT, @@OPTIONS, text_size, language, date_format, date_first, lock_timeout,
+           deadlock_priority, transaction_isolation_level, CONTEXT_INFO()
+    FROM sys.dm_exec_sessions
+    WHERE session_id = @@SPID
+"""
+
+# Every column of every user table with INFORMATION_SCHEMA-style type names (alias types
+# resolve to their base type) and primary/foreign key membership
+CATALOG_QUERY = """
+    SELECT
+        SCHEMA_NAME(t.schema_id),
+        t.name,
+        c.name,
+        COALESCE(base.name, ty.name),
+        CASE WHEN c.is_nullable = 1 THEN 'YES' ELSE 'NO' END,
+        CASE WHEN pk.column_id IS NOT NULL THEN 1 ELSE 0 END,
+        CASE WHEN fk.parent_column_id IS NOT NULL THEN 1 ELSE 0 END
+    FROM sys.tables t
+    JOIN sys.columns c ON c.object_id = t.object_id
+    JOIN sys.types ty ON ty.user_type_id = c.user_type_id
+    LEFT JOIN sys.types base
+      ON ty.is_user_defined = 1 AND ty.is_assembly_type = 0 AND base.user_type_id = ty.system_type_id
+    LEFT JOIN (
+        SELECT ic.object_id, ic.column_id
+        FROM sys.indexes i
+        JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+        WHERE i.is_primary_key = 1
+    ) pk ON pk.object_id = c.object_id AND pk.column_id = c.column_id
+    LEFT JOIN (
+        SELECT DISTINCT parent_object_id, parent_column_id
+        FROM sys.foreign_key_columns
+    ) fk ON fk.parent_object_id = c.object_id AND fk.parent_column_id = c.column_id
+"""
+CATALOG_ORDER = "\n    ORDER BY SCHEMA_NAME(t.schema_id), t.name, c.column_id"
+
+# ALTER TABLE (columns, keys, constraints) bumps modify_date; the checksum also catches
+# column changes that do not, such as sp_rename
+SIGNATURE_QUERY = """
+    SELECT
+        SCHEMA_NAME(t.schema_id),
+        t.name,
+        CONVERT(varchar(27), t.modify_date, 126),
+        CHECKSUM_AGG(CHECKSUM(c.column_id, c.name, c.user_type_id, c.max_length, c.precision, c.scale, c.is_nullable))
+    FROM sys.tables t
+    JOIN sys.columns c ON c.object_id = t.object_id
+    GROUP BY t.object_id, t.schema_id, t.name, t.modify_date
+"""
+
+
+# T-SQL functions with a direct SQLite equivalent
+_FUNCTIONS = {"ISNULL": "IFNULL", "LEN": "LENGTH", "GETDATE": "DATETIME", "SYSDATETIME": "DATETIME"}
+
+
+def _is_dbo(tokens, i):
+    return (i + 1 < len(tokens) and tokens[i][1].lower() in ("dbo", "[dbo]", '"dbo"')
+            and tokens[i + 1][1] == ".")
+
+
+def translate_tsql(sql):
+    """
+    Best-effort rewrite of one T-SQL statement for SQLite. Returns (sql, order)
+    where `order` lists the original positions of the ? parameters in their
+    new order, since TOP and OFFSET/FETCH move to a trailing LIMIT clause.
+    Handles TOP (n), OFFSET ... FETCH, N'' literals, dbo. prefixes and a few
+    functions; anything else is passed through as written.
+    """
+    tokens = list(iter_tokens(sql))
+    frames = [[[], None]]  # per parenthesis depth: [pieces, LIMIT pieces]
+    params = 0
+    i = 0
+    prev = None
+    while i < len(tokens):
+        kind, text, _ = tokens[i]
+        word = text.upper() if kind == "word" else text
+        pieces = frames[-1][0]
+
+        def operand(j):
+            # TOP/OFFSET/FETCH take a number, variable or ? optionally in parentheses
+            nonlocal params
+            parenthesized = tokens[j][1] == "("
+            j += parenthesized
+            value = tokens[j][1]
+            if value == "?":
+                value = ("?", params)
+                params += 1
+            return value, j + 1 + parenthesized
+
+        if word == "TOP" and prev in ("SELECT", "DISTINCT"):
+            value, i = operand(i + 1)
+            if i < len(tokens) and tokens[i][1].upper() == "PERCENT":
+                i += 1
+            frames[-1][1] = ["LIMIT", value]
+            prev = "TOP"
+            continue
+        if word == "OFFSET" and i + 2 < len(tokens):
+            offset, j = operand(i + 1)
+            if j < len(tokens) and tokens[j][1].upper() in ("ROWS", "ROW"):
+                j += 1
+            limit = -1
+            if j + 1 < len(tokens) and tokens[j][1].upper() == "FETCH":
+                limit, j = operand(j + 2)
+                while j < len(tokens) and tokens[j][1].upper() in ("ROWS", "ROW", "ONLY"):
+                    j += 1
+            pieces.extend(["LIMIT", limit, "OFFSET", offset])
+            i = j
+            prev = "ONLY"
+            continue
+
+        # SQLite has no schemas and each database is its own connection: db.dbo.t and dbo.t become t
+        if _is_dbo(tokens, i + 2) and tokens[i + 1][1] == "." and kind in NAME_KINDS:
+            i += 2
+            continue
+        if _is_dbo(tokens, i):
+            i += 2
+            continue
+
+        i += 1
+        if kind == "string" and text[:1] in "Nn":
+            text = text[1:]
+        elif kind == "word" and word in _FUNCTIONS and i < len(tokens) and tokens[i][1] == "(":
+            text = _FUNCTIONS[word]
+        elif text == "?":
+            text = ("?", params)
+            params += 1
+
+        if text == "(":
+            pieces.append(text)
+            frames.append([[], None])
+        elif text == ")" and len(frames) > 1:
+            inner, limit = frames.pop()
+            frames[-1][0].extend(inner + (limit or []) + [")"])
+        elif text != ";":
+            pieces.append(text)
+        prev = word
+
+    while len(frames) > 1:
+        inner, limit = frames.pop()
+        frames[-1][0].extend(inner + (limit or []))
+    pieces = frames[0][0] + (frames[0][1] or [])
+
+    order = [p[1] for p in pieces if isinstance(p, tuple)]
+    return " ".join("?" if isinstance(p, tuple) else str(p) for p in pieces), order
+
+
+class _SQLiteCursor:
+    """The subset of a pyodbc cursor that db.py, paging.py and bulkload.py use."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = None
+        self.fast_executemany = False
+
+    @property
+    def description(self):
+        return self.cursor.description if self.cursor else None
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount if self.cursor else -1
+
+    def _use(self, sql):
+        tokens = list(iter_tokens(sql))
+        if len(tokens) >= 2 and tokens[0][1].upper() == "USE":
+            self.conn.switch(unquote_identifier(tokens[1][0], tokens[1][1]))
+            self.cursor = None
+            return True
+        return False
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        if not self._use(sql):
+            sql, order = translate_tsql(sql)
+            self.cursor = self.conn.raw.cursor()
+            self.cursor.execute(sql, [params[i] for i in order])
+        return self
+
+    def executemany(self, sql, seq):
+        sql, order = translate_tsql(sql)
+        self.cursor = self.conn.raw.cursor()
+        self.cursor.executemany(sql, ([row[i] for i in order] for row in seq))
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def nextset(self):
+        # One statement per execute(), so there is never another result set
+        return False
+
+    def cancel(self):
+        self.conn.raw.interrupt()
+
+    def close(self):
+        if self.cursor:
+            self.cursor.close()
+
+
+class _SQLiteConnection:
+    """
+    A pyodbc-like connection over the stand-in's databases. USE switches to
+    the database's own in-memory SQLite database.
+    """
+
+    def __init__(self, backend, database):
+        self.backend = backend
+        self.timeout = 0
+        self._autocommit = True
+        self._raw = {}
+        self.switch(database)
+
+    def switch(self, database):
+        database = database.lower()
+        if database not in self.backend.databases:
+            raise sqlite3.OperationalError(f"Database '{database}' does not exist")
+        if database not in self._raw:
+            raw = self.backend.open(database)
+            raw.isolation_level = None if self._autocommit else "DEFERRED"
+            self._raw[database] = raw
+        self.database = database
+        self.raw = self._raw[database]
+
+    @property
+    def autocommit(self):
+        return self._autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self._autocommit = value
+        for raw in self._raw.values():
+            raw.isolation_level = None if value else "DEFERRED"
+
+    def cursor(self):
+        return _SQLiteCursor(self)
+
+    def commit(self):
+        for raw in self._raw.values():
+            raw.commit()
+
+    def rollback(self):
+        for raw in self._raw.values():
+            raw.rollback()
+
+    def close(self):
+        for raw in self._raw.values():
+            raw.close()
+        self._raw.clear()
+
+
+def _sqlite_type(sql_type):
+    sql_type = (sql_type or "").lower()
+    if sql_type in ("int", "bigint", "smallint", "tinyint", "bit"):
+        return "INTEGER"
+    if sql_type in ("decimal", "numeric", "float", "real", "money", "smallmoney"):
+        return "REAL"
+    return "TEXT"
+
+
+def _seed_value(sqlite_type, sql_type, column, i):
+    if sqlite_type == "INTEGER":
+        return i % 2 if sql_type.lower() == "bit" else i + 1
+    if sqlite_type == "REAL":
+        return round(i * 1.5, 2)
+    if "date" in sql_type.lower() or "time" in sql_type.lower():
+        return f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} 00:00:00"
+    return f"{column} {i}"
+
+
+class SQLiteBackend:
+    """
+    In-process stand-in for SQL Server: every database in schema memory
+    becomes a shared in-memory SQLite database with its tables and
+    SQLITE_SEED_ROWS synthetic rows per table, so the whole pipeline can be
+    run and profiled without a server. Statements are sent one at a time and
+    T-SQL is translated on a best-effort basis (translate_tsql).
+    """
+
+    name = "sqlite"
+    batches = False
+    estimates_cost = False
+    errors = (sqlite3.Error,)
+
+    def __init__(self, schema_json=None, seed_rows=SQLITE_SEED_ROWS):
+        self.seed_rows = seed_rows
+        self.databases = {"master": "master"}  # lowercase -> name as written
+        self._keep = {}  # one open connection keeps each in-memory database alive
+        self._lock = threading.Lock()
+        self.seed(load_schema_memory_raw() if schema_json is None else schema_json)
+
+    def open(self, database):
+        uri = f"file:chat2db_{id(self)}_{database.lower()}?mode=memory&cache=shared"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+
+    def seed(self, schema_json):
+        tables = {}
+        for db, table, columns in iter_schema_tables(schema_json):
+            tables.setdefault(db, []).append((table, columns))
+
+        for db, entries in tables.items():
+            with self._lock:
+                self.databases[db.lower()] = db
+                raw = self._keep.setdefault(db.lower(), self.open(db))
+            for table, columns in entries:
+                types = [_sqlite_type(col[1]) for col in columns]
+                keys = [col[0] for col in columns if len(col) > 3 and col[3]]
+                definition = [f"{_quote(col[0])} {t}" for col, t in zip(columns, types)]
+                if keys:
+                    definition.append(f"PRIMARY KEY ({', '.join(_quote(k) for k in keys)})")
+                raw.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+                raw.execute(f"CREATE TABLE {_quote(table)} ({', '.join(definition)})")
+                rows = (
+                    [_seed_value(t, col[1] or "", col[0], i) for col, t in zip(columns, types)]
+                    for i in range(self.seed_rows)
+                )
+                raw.execute("BEGIN")
+                raw.executemany(
+                    f"INSERT INTO {_quote(table)} VALUES ({', '.join('?' for _ in columns)})", rows
+                )
+                raw.execute("COMMIT")
+
+    def connect(self):
+        return _SQLiteConnection(self, "master")
+
+    def current_database(self, conn):
+        return conn.database
+
+    def use_database(self, conn, database):
+        conn.switch(database)
+
+    def session_state(self, conn):
+        return (conn.autocommit,)
+
+    def reset_session(self, conn, database):
+        conn.rollback()
+        conn.switch(database)
+        return self.session_state(conn)
+
+    def ping(self, conn):
+        return True
+
+    def list_databases(self, conn):
+        return [name for key, name in self.databases.items() if key not in SYSTEM_DATABASES]
+
+    def reflect_schema(self, conn, database, tables=None):
+        wanted = {t.lower() for t in tables} if tables is not None else None
+        raw = self.open(database)
+        try:
+            schema = []
+            names = raw.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name").fetchall()
+            for (table,) in names:
+                if wanted is not None and table.lower() not in wanted:
+                    continue
+                foreign = {row[3] for row in raw.execute(f"PRAGMA foreign_key_list({_quote(table)})")}
+                schema_name, table_name = split_table_name(table)
+                schema.append({
+                    "database": self.databases.get(database.lower(), database),
+                    "schema": schema_name,
+                    "table": table_name,
+                    "columns": [
+                        [name, sql_type.lower(), "NO" if notnull else "YES", bool(pk), name in foreign]
+                        for _, name, sql_type, notnull, _, pk in raw.execute(f"PRAGMA table_info({_quote(table)})")
+                    ],
+                })
+            return schema
+        finally:
+            raw.close()
+
+
+    def table_signatures(self, conn, database):
+        raw = self.open(database)
+        try:
+            rows = raw.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall()
+            # SQLite has no schemas; seed() names tables by their qualified_table_name()
+            return {split_table_name(table): (None, zlib.crc32(sql.encode("utf-8"))) for table, sql in rows}
+        finally:
+            raw.close()
+
+
+BACKENDS = {"sqlserver": SqlServerBackend, "sqlite": SQLiteBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process-wide backend selected by DB_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = BACKENDS[DB_BACKEND]()
+    return _backend
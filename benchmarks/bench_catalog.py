@@ -0,0 +1,120 @@
+"""
+Compare the per-table INFORMATION_SCHEMA extraction that livedatabase and
+summary used with the set-based sys.* catalog reader of SqlServerBackend,
+against a live SQL Server (DB_SERVER). With --create, a database with that
+many tables (ten columns each, a primary key and a foreign key to the
+previous table) is created first.
+
+    python benchmarks/bench_catalog.py <database> [--create tables]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import SqlServerBackend  # noqa: E402
+
+
+def legacy_extract(conn, db_name):
+    cursor = conn.cursor()
+    cursor.execute(f"USE [{db_name}]")
+
+    cursor.execute("""
+        SELECT TABLE_SCHEMA, TABLE_NAME
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_TYPE = 'BASE TABLE'
+    """)
+    tables = cursor.fetchall()
+
+    schema = []
+    for schema_name, table_name in tables:
+        cursor.execute(f"""
+            SELECT
+                c.COLUMN_NAME,
+                c.DATA_TYPE,
+                c.IS_NULLABLE,
+                CASE WHEN pk.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END AS IS_PRIMARY_KEY,
+                CASE WHEN fk.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END AS IS_FOREIGN_KEY
+            FROM INFORMATION_SCHEMA.COLUMNS c
+            LEFT JOIN (
+                SELECT COLUMN_NAME
+                FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE kcu
+                JOIN INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
+                  ON kcu.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
+                WHERE
+                    tc.TABLE_NAME = '{table_name}'
+                    AND tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
+                    AND tc.TABLE_SCHEMA = '{schema_name}'
+            ) pk ON c.COLUMN_NAME = pk.COLUMN_NAME
+            LEFT JOIN (
+                SELECT kcu.COLUMN_NAME
+                FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE kcu
+                JOIN INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
+                  ON kcu.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
+                WHERE
+                    tc.TABLE_NAME = '{table_name}'
+                    AND tc.CONSTRAINT_TYPE = 'FOREIGN KEY'
+                    AND tc.TABLE_SCHEMA = '{schema_name}'
+            ) fk ON c.COLUMN_NAME = fk.COLUMN_NAME
+            WHERE c.TABLE_NAME = '{table_name}' AND c.TABLE_SCHEMA = '{schema_name}'
+            ORDER BY c.ORDINAL_POSITION
+        """)
+        columns = cursor.fetchall()
+        schema.append({
+            "database": db_name,
+            "table": table_name,
+            "columns": [[col[0], col[1], col[2], bool(col[3]), bool(col[4])] for col in columns],
+        })
+    return schema
+
+
+def create_database(conn, db_name, tables):
+    cursor = conn.cursor()
+    cursor.execute(f"IF DB_ID(?) IS NULL EXEC('CREATE DATABASE [{db_name}]')", db_name)
+    cursor.execute(f"USE [{db_name}]")
+    for n in range(tables):
+        columns = ", ".join(f"Col{i} NVARCHAR(50) NULL" for i in range(7))
+        parent = f", ParentId INT NULL REFERENCES Bench{n - 1}(Id)" if n else ", ParentId INT NULL"
+        cursor.execute(
+            f"IF OBJECT_ID(N'Bench{n}') IS NULL "
+            f"CREATE TABLE Bench{n} (Id INT NOT NULL PRIMARY KEY, Amount DECIMAL(10, 2) NULL{parent}, {columns})"
+        )
+
+
+def timed(fn, repeat=3):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def normalized(schema):
+    return sorted((entry["table"], [tuple(col) for col in entry["columns"]]) for entry in schema)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database")
+    parser.add_argument("--create", type=int, default=0, metavar="TABLES")
+    args = parser.parse_args()
+
+    backend = SqlServerBackend()
+    conn = backend.connect()
+    if args.create:
+        create_database(conn, args.database, args.create)
+
+    legacy_time, legacy = timed(lambda: legacy_extract(conn, args.database))
+    catalog_time, catalog = timed(lambda: backend.reflect_schema(conn, args.database))
+    columns = sum(len(entry["columns"]) for entry in catalog)
+    print(f"{'tables':>7} {'columns':>8} {'legacy s':>10} {'round trips':>12} {'catalog s':>10} {'round trips':>12} {'same':>5}")
+    print(f"{len(catalog):>7} {columns:>8} {legacy_time:>10.3f} {len(legacy) + 2:>12} {catalog_time:>10.3f} {2:>12} "
+          f"{str(normalized(legacy) == normalized(catalog)):>5}")
+
+
+if __name__ == "__main__":
+    main()
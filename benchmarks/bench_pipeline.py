@@ -0,0 +1,102 @@
+"""
+Measure the SQL side of the question pipeline without a SQL Server: every
+database in schema_memory.json is loaded into the in-process SQLite backend
+with synthetic rows, then generated SELECTs go through query_db (lexing,
+result cache, execution, DataFrame construction) and the pager. The LLM
+stage is not included; it needs a model endpoint.
+
+    python benchmarks/bench_pipeline.py [seed_rows] [rounds]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SEED_ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+ROUNDS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+# Read by config at import time
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_SEED_ROWS"] = str(SEED_ROWS)
+os.environ.setdefault("TRACING_EXPORTER", "none")
+
+from backends import get_backend  # noqa: E402
+from db import query_db, list_databases, reflect_schema, quote_identifier  # noqa: E402
+from memory import load_schema_memory_raw, iter_schema_tables  # noqa: E402
+from paging import Pager, plan_paging  # noqa: E402
+from result_cache import result_cache  # noqa: E402
+
+
+def generate_queries():
+    queries = []
+    for db, table, columns in iter_schema_tables(load_schema_memory_raw()):
+        if not columns:
+            continue
+        name, first = quote_identifier(table), quote_identifier(columns[0][0])
+        use = f"USE {quote_identifier(db)};\n"
+        queries.append((db, use + f"SELECT TOP (100) * FROM {name};"))
+        queries.append((db, use + f"SELECT COUNT(*) AS n FROM {name};"))
+        queries.append((db, use + f"SELECT * FROM {name} WHERE {first} IS NOT NULL ORDER BY {first};"))
+    return queries
+
+
+def run_queries(queries, cache):
+    """`cache`: "off" clears the result cache before every query, "fill" once at the start, "hit" never."""
+    rows, errors = 0, 0
+    if cache == "fill":
+        result_cache.clear()
+    start = time.perf_counter()
+    for _, sql in queries:
+        if cache == "off":
+            result_cache.clear()
+        outcome = query_db(sql)
+        if outcome["status"] != "ok":
+            errors += 1
+            continue
+        result = outcome["result"]
+        for df in result if isinstance(result, list) else [result]:
+            rows += len(df)
+    return time.perf_counter() - start, rows, errors
+
+
+def run_pager(queries, pages=3):
+    fetched = 0
+    start = time.perf_counter()
+    for db, sql in queries:
+        plan = plan_paging(sql, db)
+        if not plan:
+            continue
+        pager = Pager(plan)
+        for _ in range(pages):
+            df, has_more = pager.current()
+            fetched += len(df)
+            if not has_more:
+                break
+            pager.next()
+    return time.perf_counter() - start, fetched
+
+
+def main():
+    start = time.perf_counter()
+    get_backend()
+    print(f"Seeded {SEED_ROWS:,} rows per table in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    tables = sum(len(reflect_schema(db)) for db in list_databases())
+    print(f"Reflected {tables} tables in {time.perf_counter() - start:.3f}s")
+
+    queries = generate_queries()
+    print(f"{'stage':>12} {'round':>6} {'queries':>8} {'s':>8} {'q/s':>9} {'rows/s':>12} {'errors':>7}")
+    for round_no in range(1, ROUNDS + 1):
+        for label, cache in (("no cache", "off"), ("cache fill", "fill"), ("cache hit", "hit")):
+            elapsed, rows, errors = run_queries(queries, cache)
+            print(f"{label:>12} {round_no:>6} {len(queries):>8} {elapsed:>8.3f} "
+                  f"{len(queries) / elapsed:>9.1f} {rows / elapsed:>12,.0f} {errors:>7}")
+        elapsed, rows = run_pager(queries)
+        print(f"{'pager':>12} {round_no:>6} {len(queries):>8} {elapsed:>8.3f} "
+              f"{len(queries) / elapsed:>9.1f} {rows / elapsed:>12,.0f} {'':>7}")
+
+
+if __name__ == "__main__":
+    main()
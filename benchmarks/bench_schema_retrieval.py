@@ -0,0 +1,85 @@
+"""
+Measure per-question table retrieval on a synthetic database with many
+tables: index build time, then lookup latency of the lexical index alone
+and, with --embeddings (needs the sentence-transformers model), of a lookup
+that also encodes the question and re-ranks by embedding similarity.
+
+    python benchmarks/bench_schema_retrieval.py [tables] [--embeddings]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema_retriever import SchemaIndex, embed_question  # noqa: E402
+
+ENTITIES = [
+    "Customer", "Order", "OrderLine", "Invoice", "Payment", "Product", "Supplier", "Shipment",
+    "Warehouse", "Employee", "Department", "Region", "Store", "Promotion", "Return", "Account",
+]
+COLUMNS = ["Id", "Name", "Amount", "Quantity", "CreatedAt", "Status", "Region", "Price", "Total", "Code"]
+QUESTIONS = [
+    "total revenue per region in 2023",
+    "top 10 customers by order amount",
+    "how many shipments are late per warehouse",
+    "list unpaid invoices with their customer name",
+    "average product price by supplier",
+    "employees per department created this year",
+]
+
+
+def synthetic_tables(count):
+    rng = random.Random(0)
+    tables = []
+    for n in range(count):
+        name = f"{rng.choice(ENTITIES)}{rng.choice(ENTITIES)}{n}"
+        columns = [[f"{col}{rng.randint(0, 3) or ''}", "int", "YES", i == 0, False]
+                   for i, col in enumerate(rng.sample(COLUMNS, 8))]
+        tables.append(("Bench", name, columns))
+    return tables
+
+
+def lookups(index, questions, repeat):
+    times = []
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            index.search(question, 15)
+            times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(label, times):
+    times = sorted(times)
+    p95 = times[int(len(times) * 0.95) - 1]
+    print(f"{label:>22} {len(times):>8} {statistics.median(times):>9.3f} {p95:>9.3f} {times[-1]:>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tables", type=int, nargs="?", default=20000)
+    parser.add_argument("--embeddings", action="store_true")
+    args = parser.parse_args()
+
+    tables = synthetic_tables(args.tables)
+    start = time.perf_counter()
+    lexical = SchemaIndex(tables, use_embeddings=False)
+    print(f"Lexical index over {len(tables):,} tables built in {time.perf_counter() - start:.2f}s")
+    print(f"{'lookup':>22} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    report("lexical", lookups(lexical, QUESTIONS, 20))
+
+    if args.embeddings:
+        start = time.perf_counter()
+        reranked = SchemaIndex(tables, use_embeddings=True)
+        print(f"Embedding index built in {time.perf_counter() - start:.2f}s")
+        embed_question.cache_clear()
+        report("embeddings, new", lookups(reranked, QUESTIONS, 1))
+        report("embeddings, repeated", lookups(reranked, QUESTIONS, 20))
+
+
+if __name__ == "__main__":
+    main()
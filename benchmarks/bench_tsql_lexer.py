@@ -0,0 +1,93 @@
+"""
+Compare the regex-based batch splitting that db.py used before tsql_lexer with
+the single-pass lexer, on generated admin scripts shaped like the ones the
+admin tools produce (USE/GO headers, IF NOT EXISTS guards, EXEC'd CREATE TABLE,
+large INSERT ... VALUES blocks).
+
+    python benchmarks/bench_tsql_lexer.py [size_mb ...]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tsql_lexer import iter_statements  # noqa: E402
+
+
+def legacy_split(query):
+    query = re.sub(r'(?<!\n)(?<!\r)\bGO\b', r'\nGO', query, flags=re.IGNORECASE)
+    raw_batches = re.split(r'^\s*GO\s*$', query, flags=re.IGNORECASE | re.MULTILINE)
+
+    final_batches = []
+    crud_pattern = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+    for batch in raw_batches:
+        lines = batch.strip().splitlines()
+        current_stmt = []
+        for line in lines:
+            if crud_pattern.match(line) and current_stmt:
+                final_batches.append('\n'.join(current_stmt).strip())
+                current_stmt = [line]
+            else:
+                current_stmt.append(line)
+        if current_stmt:
+            final_batches.append('\n'.join(current_stmt).strip())
+    return [b.strip() for b in final_batches if b.strip()]
+
+
+def table_block(n, rows):
+    lines = [
+        f"IF NOT EXISTS (SELECT 1 FROM sys.tables WHERE name = N'Table{n}')",
+        f"    EXEC('CREATE TABLE Table{n}(Id INT PRIMARY KEY, Name NVARCHAR(100), Note NVARCHAR(400), Amount DECIMAL(10, 2))');",
+        "GO",
+        f"INSERT INTO Table{n} (Id, Name, Note, Amount) VALUES",
+    ]
+    values = [
+        f"    ({i}, N'Name {i}', N'select; go -- not a comment /* nor this */ [{n}]', {i * 1.5:.2f})"
+        for i in range(rows)
+    ]
+    lines.append(",\n".join(values) + ";")
+    lines.append("GO")
+    return "\n".join(lines)
+
+
+def generate_script(size_mb, rows_per_table=500):
+    parts = ["USE master;", "GO", "IF DB_ID(N'BenchDb') IS NULL", "    EXEC('CREATE DATABASE BenchDb');", "GO",
+             "USE BenchDb;", "GO"]
+    size, n = 0, 0
+    while size < size_mb * 1024 * 1024:
+        block = table_block(n, rows_per_table)
+        parts.append(block)
+        size += len(block) + 1
+        n += 1
+    return "\n".join(parts)
+
+
+def timed(fn, script, repeat=3):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(script)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    sizes = [float(arg) for arg in sys.argv[1:]] or [1, 4, 16]
+    print(f"{'size MB':>8} {'legacy s':>10} {'lexer s':>10} {'legacy stmts':>13} {'lexer stmts':>12} "
+          f"{'legacy altered':>15} {'lexer altered':>14}")
+    for size_mb in sizes:
+        script = generate_script(size_mb)
+        legacy_time, legacy = timed(legacy_split, script)
+        lexer_time, statements = timed(lambda s: list(iter_statements(s)), script)
+        # Statements that are not verbatim slices of the script had their text rewritten
+        legacy_altered = sum(stmt not in script for stmt in legacy)
+        lexer_altered = sum(stmt not in script for stmt in statements)
+        print(f"{len(script) / 1024 / 1024:>8.1f} {legacy_time:>10.3f} {lexer_time:>10.3f} "
+              f"{len(legacy):>13} {len(statements):>12} {legacy_altered:>15} {lexer_altered:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import json
+import re
+import time
+
+import pandas as pd
+
+from config import BULK_CHUNK_ROWS
+from db import get_connection, quote_identifier
+from llm import build_payload, complete_payload
+from memory import load_schema_memory_raw, iter_schema_tables, split_table_name
+
+BULK_EXTENSIONS = (".csv", ".xlsx", ".xlsm")
+_JSON_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _norm(name):
+    return re.sub(r"[^0-9a-z]", "", str(name).lower())
+
+
+def _as_text(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    return str(value)
+
+
+def iter_file_chunks(file, name, chunk_rows=BULK_CHUNK_ROWS):
+    """
+    Stream an uploaded CSV or Excel file as DataFrames of at most `chunk_rows`
+    rows. Values are read as text (None for empty cells) so every chunk binds
+    the same parameter types; SQL Server converts them to the column types.
+    """
+    if name.lower().endswith(".csv"):
+        yield from pd.read_csv(file, chunksize=chunk_rows, dtype=str, encoding_errors="ignore")
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(h) if h is not None else f"column_{i + 1}" for i, h in enumerate(next(rows, []))]
+        chunk = []
+        for row in rows:
+            chunk.append([_as_text(v) for v in row[:len(header)]])
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def peek_file(file, name, rows=5):
+    """First rows of an uploaded file; the file is rewound afterwards."""
+    try:
+        return next(iter_file_chunks(file, name, rows), pd.DataFrame())
+    finally:
+        file.seek(0)
+
+
+def table_columns(database):
+    """
+    Return {table: [column, ...]} for `database` from schema memory, in
+    original case. Tables outside dbo are named "schema.table".
+    """
+    return {
+        table: [col[0] for col in columns]
+        for db, table, columns in iter_schema_tables(load_schema_memory_raw())
+        if db.lower() == (database or "").lower()
+    }
+
+
+def match_columns(file_columns, columns):
+    """Map file columns to table columns whose names match ignoring case, spaces and punctuation."""
+    by_norm = {_norm(c): c for c in columns}
+    return {fc: by_norm[_norm(fc)] for fc in file_columns if _norm(fc) in by_norm}
+
+
+def guess_table(file_columns, database):
+    """Return (table, mapping) for the schema memory table matching most file columns, or (None, {})."""
+    best, best_mapping = None, {}
+    for table, columns in table_columns(database).items():
+        mapping = match_columns(file_columns, columns)
+        if len(mapping) > len(best_mapping):
+            best, best_mapping = table, mapping
+    return best, best_mapping
+
+
+def suggest_mapping(sample, database, table=None):
+    """
+    Ask the LLM to map the columns of `sample` onto a table of `database`.
+    Only the header and a few sample rows are sent. Returns (table, mapping)
+    restricted to tables and columns that exist in schema memory.
+    """
+    tables = table_columns(database)
+    if table:
+        candidates = {table: tables.get(table, [])}
+    else:
+        # The tables sharing the most column names are enough context
+        ranked = sorted(tables, key=lambda t: len(match_columns(sample.columns, tables[t])), reverse=True)
+        candidates = {t: tables[t] for t in ranked[:5]}
+
+    prompt = (
+        "Map the columns of an uploaded file onto one of these SQL Server tables.\n\n"
+        + "\n".join(f"Table {t}: {', '.join(cols)}" for t, cols in candidates.items())
+        + "\n\nFile columns with sample rows:\n"
+        + sample.head(5).to_csv(index=False)
+        + '\nReply with JSON only: {"table": "<table>", "mapping": {"<file column>": "<table column or null>"}}'
+    )
+    reply = complete_payload(build_payload([{"role": "user", "content": prompt}], call_type="mapping"))
+    match = _JSON_RE.search(reply)
+    if not match:
+        raise ValueError(f"No mapping in the model's reply: {reply[:200]}")
+    suggestion = json.loads(match.group(0))
+
+    chosen = suggestion.get("table")
+    if chosen not in candidates:
+        raise ValueError(f"The model chose an unknown table: {chosen}")
+    valid = set(candidates[chosen])
+    mapping = {
+        fc: tc for fc, tc in (suggestion.get("mapping") or {}).items()
+        if fc in sample.columns and tc in valid
+    }
+    return chosen, mapping
+
+
+def bulk_insert(chunks, database, table, mapping, on_progress=None):
+    """
+    Insert every chunk into `table` (a table_columns() name, so qualified with
+    its schema when it is not in dbo) with fast_executemany, sending each chunk
+    as one parameter array, inside a single transaction that is rolled back
+    on failure. `mapping` maps file columns to table columns. Calls
+    on_progress(rows, seconds) after each chunk and returns
+    {"rows", "seconds", "rows_per_sec"}.
+    """
+    file_columns = [fc for fc, tc in mapping.items() if tc]
+    if not file_columns:
+        raise ValueError("No file column is mapped to a table column.")
+    targets = ", ".join(quote_identifier(mapping[fc]) for fc in file_columns)
+    placeholders = ", ".join("?" for _ in file_columns)
+    schema, name = split_table_name(table)
+    sql = f"INSERT INTO {quote_identifier(schema)}.{quote_identifier(name)} ({targets}) VALUES ({placeholders})"
+
+    rows = 0
+    start = time.monotonic()
+    with get_connection(database) as conn:
+        conn.autocommit = False
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        try:
+            for chunk in chunks:
+                values = chunk[file_columns].astype(object)
+                params = values.where(values.notna(), None).values.tolist()
+                if not params:
+                    continue
+                cursor.executemany(sql, params)
+                rows += len(params)
+                if on_progress:
+                    on_progress(rows, time.monotonic() - start)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    seconds = time.monotonic() - start
+    return {"rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds if seconds else 0.0}
@@ -3,20 +3,24 @@ import io
 import pandas as pd
 import altair as alt
 import re
-from llm import process_query_with_llama
+import queue
+import threading
+import time
+import contextvars
+from llm import process_query_with_llama, stream_query_with_llama, classify_reply, prewarm_model, get_last_token_breakdown, clean_reply
+from config import LLM_STREAM, SQL_CANDIDATES, RESULT_PAGING
 from memory import load_user_memory, save_user_memory, load_schema_memory, save_schema_memory
-from db import query_db, get_connection
+from db import (
+    list_databases, query_db, QueryHandle, max_rows_for_role, query_timeout_for_role,
+    cost_limit_for_role, cost_gate,
+)
 from schema import extract_table_schema, extract_drops_from_sql
+from paging import Pager, plan_paging
+from tracing import span
 
 @st.cache_data(ttl=300)
 def get_user_db_names():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT name FROM sys.databases 
-        WHERE name NOT IN ('master', 'tempdb', 'model', 'msdb')
-    """)
-    return [row[0] for row in cursor.fetchall()]
+    return list_databases()
 
 import re
 
@@ -71,6 +75,174 @@ def show_chart(df, key_prefix=""):
     if chart:
         st.altair_chart(chart.interactive(), use_container_width=True)
 
+def render_message(container, role, content):
+    label = "\U0001F9D1 You" if role == "user" else "\U0001F916 Assistant"
+    color = "#d7f0fa" if role == "user" else "#e2f7e1"
+    container.markdown(
+        f"<div style='background-color:{color}; padding:10px; border-radius:10px; margin:5px 0'>"
+        f"<b>{label}:</b> {content}</div>",
+        unsafe_allow_html=True,
+    )
+
+def stream_reply(pieces):
+    """Render a streamed reply as it arrives and return the full text."""
+    status = st.empty()
+    placeholder = st.empty()
+    reply = ""
+    kind = None
+
+    for piece in pieces:
+        reply += piece
+        if kind is None:
+            kind = classify_reply(reply)
+            if kind == "sql":
+                status.caption("\U0001F5DF Generating SQL...")
+        if kind == "sql":
+            placeholder.code(reply, language="sql")
+        else:
+            render_message(placeholder, "assistant", reply + " \u258C")
+
+    status.empty()
+    placeholder.empty()
+    return clean_reply(reply)
+
+def cancel_running_query():
+    handle = st.session_state.pop("query_handle", None)
+    if handle:
+        handle.cancel()
+    st.session_state.sql_result = {"status": "cancelled", "result": None, "error": "Query cancelled.", "elapsed": 0}
+
+def run_query_with_preview(sql, max_rows, timeout, max_cost=None, confirmed=False, database=None):
+    """
+    Run SQL in a worker thread, showing the first rows as soon as they arrive
+    and a Cancel button while it runs. Returns query_db's status dict, whose
+    result holds every row up to `max_rows` for display and export: the row
+    cap, not the chunk size, bounds memory here. Pageable SELECTs avoid this
+    through start_query's Pager.
+
+    Clicking Cancel (or any other widget) interrupts this script run; the
+    finally block then cancels the statement so the worker and its pooled
+    connection are released instead of running on in the background.
+    """
+    handle = QueryHandle()
+    st.session_state.query_handle = handle
+    updates = queue.Queue()
+    outcome = {}
+
+    def worker():
+        outcome.update(query_db(sql, max_rows, timeout, handle, on_chunk=lambda i, chunk: updates.put(chunk),
+                                max_cost=max_cost, confirmed=confirmed, database=database))
+
+    # The worker inherits the caller's context so its spans join the question's trace
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True)
+    status = st.empty()
+    preview = st.empty()
+    cancel_slot = st.empty()
+    cancel_slot.button("⏹️ Cancel query", on_click=cancel_running_query, key="cancel_query")
+    rows = 0
+    shown = False
+    start = time.monotonic()
+    try:
+        thread.start()
+        while thread.is_alive() or not updates.empty():
+            try:
+                chunk = updates.get(timeout=0.25)
+            except queue.Empty:
+                chunk = None
+            if chunk is not None:
+                if not shown:
+                    preview.dataframe(chunk)
+                    shown = True
+                rows += len(chunk)
+            status.caption(f"⏳ {time.monotonic() - start:.0f}s elapsed, {rows:,} rows loaded...")
+        thread.join()
+        return outcome
+    finally:
+        if thread.is_alive():
+            handle.cancel()
+        st.session_state.pop("query_handle", None)
+        status.empty()
+        preview.empty()
+        cancel_slot.empty()
+
+def start_query(sql, confirmed=False):
+    """
+    Run generated SQL, paged when possible and otherwise with a live preview.
+    Read-only SQL whose estimated cost exceeds the role's limit, or cannot be
+    estimated, is stopped with status "over_cost" unless `confirmed`.
+    """
+    is_admin = st.session_state.is_admin
+    max_cost, _ = cost_limit_for_role(is_admin)
+    st.session_state.sql_result = None
+    st.session_state.pager = None
+    st.session_state.query_plan = None
+    st.session_state.pending_sql = sql
+
+    page_plan = plan_paging(sql, st.session_state.db_name) if RESULT_PAGING else None
+    if page_plan:
+        if max_cost and not confirmed:
+            # The whole query, not the first page: a TOP row goal would hide the cost of reading it all
+            estimate, problem = cost_gate(sql, max_cost, page_plan.database)
+            st.session_state.query_plan = estimate
+            if problem:
+                st.session_state.sql_result = {"status": "over_cost", "result": None, "error": problem, "elapsed": 0}
+                return
+        # Only the visible page is fetched; the full result never lands in session state
+        st.session_state.pager = Pager(page_plan, timeout=query_timeout_for_role(is_admin))
+    else:
+        outcome = run_query_with_preview(
+            sql, max_rows_for_role(is_admin), query_timeout_for_role(is_admin), max_cost, confirmed,
+            st.session_state.db_name,
+        )
+        st.session_state.query_plan = outcome.get("plan")
+        st.session_state.sql_result = outcome
+
+def confirm_costly_query():
+    st.session_state.run_confirmed = True
+
+def show_plan_summary(plan):
+    """Estimated cost, rows and largest scans of the query's SHOWPLAN."""
+    st.caption(f"📐 Estimated cost {plan['cost']:,.2f} · about {plan['rows']:,.0f} rows")
+    if plan["scans"]:
+        with st.expander("Largest scans in the estimated plan"):
+            st.table(pd.DataFrame(plan["scans"]))
+
+def show_pager(pager):
+    """Render the current page of a paged result with Previous/Next controls."""
+    try:
+        df, has_more = pager.current()
+    except Exception as e:
+        st.error(f"SQL Execution Error: {e}")
+        return
+
+    first = pager.index * pager.page_size
+    if df.empty:
+        st.info("No rows.")
+    else:
+        st.caption(f"Page {pager.index + 1} · rows {first + 1:,}–{first + len(df):,}"
+                   + (" · more available" if has_more else ""))
+    df = df.copy()
+    df.columns = deduplicate_columns(df.columns)
+    st.dataframe(df)
+
+    col_prev, col_next = st.columns(2)
+    col_prev.button("⬅️ Previous", on_click=pager.prev, disabled=pager.index == 0, key="page_prev")
+    col_next.button("Next ➡️", on_click=pager.next, disabled=not has_more, key="page_next")
+
+    st.download_button("📁 Export page to Excel", data=excel_bytes(df), file_name=f"results_page_{pager.index + 1}.xlsx")
+    with st.expander("📊 Show Chart"):
+        show_chart(df, key_prefix="page")
+
+def excel_bytes(df):
+    with span("chat.excel", rows=len(df)):
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        return buffer.getvalue()
+
+def show_truncation_notice(df):
+    if df.attrs.get("truncated"):
+        st.warning(f"⚠️ Result truncated: showing the first {len(df):,} rows.")
+
 def run_chat_ui():
     all_db_names = get_user_db_names()
     schema_memory = load_schema_memory()
@@ -86,8 +258,12 @@ def run_chat_ui():
     selected_db = st.sidebar.selectbox("Select a database", available_dbs)
 
     if "db_name" not in st.session_state or st.session_state.db_name != selected_db:
+        prewarm_model(st.session_state.is_admin, selected_db)
         st.session_state.db_name = selected_db
         st.session_state.sql_result = None
+        st.session_state.pager = None
+        st.session_state.query_plan = None
+        st.session_state.pending_sql = None
         st.session_state.memory = load_user_memory(st.session_state.user_id) or []
         st.rerun()
 
@@ -99,79 +275,116 @@ def run_chat_ui():
 
     st.markdown(f"### \U0001F9D1 Chat as {'Admin' if st.session_state.is_admin else 'User'}")
     for msg in st.session_state.memory:
-        role = "\U0001F9D1 You" if msg["role"] == "user" else "\U0001F916 Assistant"
-        color = "#d7f0fa" if msg["role"] == "user" else "#e2f7e1"
-        st.markdown(
-            f"<div style='background-color:{color}; padding:10px; border-radius:10px; margin:5px 0'>"
-            f"<b>{role}:</b> {msg['content']}</div>",
-            unsafe_allow_html=True,
-        )
+        render_message(st, msg["role"], msg["content"])
 
     user_input = st.chat_input("Ask something about your database...")
     if user_input:
-        reply = process_query_with_llama(
-            user_input,
-            st.session_state.memory,
-            is_admin=st.session_state.is_admin,
-            is_selecteddatabse=is_selected,
-            selected_database=st.session_state.db_name
-        )
+        with span("chat.question", database=st.session_state.db_name, admin=st.session_state.is_admin):
+            # Candidate mode picks the first valid of several complete replies, so it cannot stream
+            if LLM_STREAM and SQL_CANDIDATES <= 1:
+                render_message(st, "user", user_input)
+                reply = stream_reply(
+                    stream_query_with_llama(
+                        user_input,
+                        st.session_state.memory,
+                        is_admin=st.session_state.is_admin,
+                        is_selecteddatabse=is_selected,
+                        selected_database=st.session_state.db_name
+                    )
+                )
+            else:
+                reply = process_query_with_llama(
+                    user_input,
+                    st.session_state.memory,
+                    is_admin=st.session_state.is_admin,
+                    is_selecteddatabse=is_selected,
+                    selected_database=st.session_state.db_name
+                )
 
-        st.session_state.memory.append({"role": "user", "content": user_input})
-        st.session_state.memory.append({"role": "assistant", "content": reply})
-        st.session_state.memory = st.session_state.memory[-10:]
-        save_user_memory(st.session_state.user_id, st.session_state.memory)
+            st.session_state.token_breakdown = get_last_token_breakdown()
+            st.session_state.memory.append({"role": "user", "content": user_input})
+            st.session_state.memory.append({"role": "assistant", "content": reply})
+            st.session_state.memory = st.session_state.memory[-10:]
+            save_user_memory(st.session_state.user_id, st.session_state.memory)
         
-        if st.session_state.is_admin and any(cmd in reply.lower() for cmd in ["create table", "drop table", "delete"]):
-            schema_updates = extract_table_schema(reply)
-            drops_schema = extract_drops_from_sql(reply)
-            if schema_updates:
-                schema_mem = load_schema_memory()
-                schema_mem.extend(schema_updates)
-                save_schema_memory(schema_mem)
-            elif drops_schema:
-                drop_tables = [entry["table"] for entry in drops_schema.get("tables", [])]
-                drop_dbs = drops_schema.get("databases", [])
-                schema_mem = load_schema_memory()
-                schema_mem = [t for t in schema_mem if t.get("table") not in drop_tables and t.get("database") not in drop_dbs]
-                save_schema_memory(schema_mem)
+            if st.session_state.is_admin and any(cmd in reply.lower() for cmd in ["create table", "drop table", "delete"]):
+                schema_updates = extract_table_schema(reply)
+                drops_schema = extract_drops_from_sql(reply)
+                if schema_updates:
+                    schema_mem = load_schema_memory()
+                    schema_mem.extend(schema_updates)
+                    save_schema_memory(schema_mem)
+                elif drops_schema:
+                    drop_tables = [entry["table"] for entry in drops_schema.get("tables", [])]
+                    drop_dbs = drops_schema.get("databases", [])
+                    schema_mem = load_schema_memory()
+                    schema_mem = [t for t in schema_mem if t.get("table") not in drop_tables and t.get("database") not in drop_dbs]
+                    save_schema_memory(schema_mem)
                 
-        sql_keywords = ["use", "select", "insert", "update", "delete", "create", "drop"]
-        if any(reply.lower().startswith(k) for k in sql_keywords):
-            try:
-                # sql_with_db = f"USE {st.session_state.db_name};\nGO\n{reply}"
-                st.session_state.sql_result = query_db(reply)
-            except Exception as e:
-                st.error(f"SQL Execution Error: {e}")
-                st.session_state.sql_result = None
-        else:
             st.session_state.sql_result = None
+            st.session_state.pager = None
+            st.session_state.query_plan = None
+            if classify_reply(reply, final=True) == "sql":
+                # sql_with_db = f"USE {st.session_state.db_name};\nGO\n{reply}"
+                start_query(reply)
         st.rerun()
+
+    if st.session_state.pop("run_confirmed", False) and st.session_state.get("pending_sql"):
+        with span("chat.question", database=st.session_state.db_name, admin=st.session_state.is_admin, confirmed=True):
+            start_query(st.session_state.pending_sql, confirmed=True)
+        st.rerun()
+    if st.session_state.is_admin and st.session_state.get("token_breakdown"):
+        with st.expander("🧮 Prompt tokens by source"):
+            st.table(pd.DataFrame.from_dict(st.session_state.token_breakdown, orient="index"))
+
+    if st.session_state.get("pager") is not None:
+        st.markdown("### \U0001F5DF SQL Result")
+        if st.session_state.get("query_plan"):
+            show_plan_summary(st.session_state.query_plan)
+        with span("chat.render_page", page=st.session_state.pager.index + 1):
+            show_pager(st.session_state.pager)
+
     if st.session_state.get("sql_result") is not None:
         st.markdown("### \U0001F5DF SQL Result")
-        result = st.session_state.sql_result
-
-        if isinstance(result, pd.DataFrame):
-            df = result.copy()
-            df.columns = deduplicate_columns(df.columns)
-            st.dataframe(df)
-            buffer = io.BytesIO()
-            df.to_excel(buffer, index=False)
-            st.download_button("📁 Export to Excel", data=buffer.getvalue(), file_name="results.xlsx")
-            with st.expander("📊 Show Chart"):
-                show_chart(df, key_prefix="main")
-
-        elif isinstance(result, (list, tuple)):
-            for i, df in enumerate(result):
-                if isinstance(df, pd.DataFrame):
-                    st.markdown(f"#### Table {i+1}")
-                    st.dataframe(df)
-                    buffer = io.BytesIO()
-                    df.to_excel(buffer, index=False)
-                    st.download_button(f"📁 Export Table {i+1}", data=buffer.getvalue(), file_name=f"table_{i+1}.xlsx")
-                    with st.expander("📊 Show Chart"):
-                        show_chart(df, key_prefix=f"table_{i+1}")
+        with span("chat.render_result", status=st.session_state.sql_result["status"]):
+            outcome = st.session_state.sql_result
+            result = outcome["result"]
+
+            if outcome.get("cached"):
+                st.caption("⚡ Served from the result cache")
+            if st.session_state.get("query_plan"):
+                show_plan_summary(st.session_state.query_plan)
+
+            if outcome["status"] == "over_cost":
+                st.warning(f"🚧 {outcome['error']}")
+                _, action = cost_limit_for_role(st.session_state.is_admin)
+                if action == "confirm":
+                    st.button("▶️ Run anyway", on_click=confirm_costly_query, key="run_costly_query")
                 else:
-                    st.write(df)
-        else:
-            st.success(result)
+                    st.caption("Narrow the question (filters, fewer columns, a smaller date range) and try again.")
+            elif outcome["status"] in ("timeout", "cancelled"):
+                st.warning(f"⏹️ {outcome['error']}")
+            elif outcome["status"] == "error":
+                st.error(f"SQL Execution Error: {outcome['error']}")
+            elif isinstance(result, pd.DataFrame):
+                df = result.copy()
+                df.columns = deduplicate_columns(df.columns)
+                show_truncation_notice(result)
+                st.dataframe(df)
+                st.download_button("📁 Export to Excel", data=excel_bytes(df), file_name="results.xlsx")
+                with st.expander("📊 Show Chart"):
+                    show_chart(df, key_prefix="main")
+
+            elif isinstance(result, (list, tuple)):
+                for i, df in enumerate(result):
+                    if isinstance(df, pd.DataFrame):
+                        st.markdown(f"#### Table {i+1}")
+                        show_truncation_notice(df)
+                        st.dataframe(df)
+                        st.download_button(f"📁 Export Table {i+1}", data=excel_bytes(df), file_name=f"table_{i+1}.xlsx")
+                        with st.expander("📊 Show Chart"):
+                            show_chart(df, key_prefix=f"table_{i+1}")
+                    else:
+                        st.write(df)
+            else:
+                st.success(result)
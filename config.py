@@ -13,3 +13,125 @@ SCHEMA_MEMORY_FILE = "schema_memory.json"
 GLOBAL_MEMORY_FILE = "global_memory.json"
 UPLOAD_FOLDER = "uploads"
 VECTOR_DB_FOLDER = "vector_db"
+
+# Schema retrieval (per-question table selection)
+SCHEMA_RETRIEVAL_TOP_K = int(os.getenv("SCHEMA_RETRIEVAL_TOP_K", "15"))
+SCHEMA_RETRIEVAL_MAX_TOKENS = int(os.getenv("SCHEMA_RETRIEVAL_MAX_TOKENS", "1500"))
+# Opt-in embedding re-ranking: the lexical index answers in under a millisecond on 20k+ tables,
+# encoding each new question with the sentence transformer costs far more
+# (benchmarks/bench_schema_retrieval.py --embeddings measures both)
+SCHEMA_RETRIEVAL_USE_EMBEDDINGS = os.getenv("SCHEMA_RETRIEVAL_USE_EMBEDDINGS", "false").lower() == "true"
+
+# Stream LLM replies token by token into the chat UI
+LLM_STREAM = os.getenv("LLM_STREAM", "true").lower() == "true"
+
+# LLM HTTP client
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "300"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+
+# Semantic NL-to-SQL answer cache
+ANSWER_CACHE_FILE = "answer_cache.json"
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.93"))
+# Recent messages a follow-up question is keyed on
+ANSWER_CACHE_CONTEXT_TURNS = int(os.getenv("ANSWER_CACHE_CONTEXT_TURNS", "4"))
+# Seconds changes are collected before the cache file is rewritten once for all of them
+ANSWER_CACHE_SAVE_DELAY = float(os.getenv("ANSWER_CACHE_SAVE_DELAY", "5"))
+
+# In-process cache of SELECT results (result_cache.py); compression is used when pyarrow is installed
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "256"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_COMPRESSION = os.getenv("RESULT_CACHE_COMPRESSION", "zstd").lower()  # zstd, lz4 or none
+
+# How long Ollama keeps the model loaded after a request (e.g. "30m", "-1" = forever, empty = server default)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit():
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)
+# Minimum seconds between prewarm requests for the same role and database
+PREWARM_INTERVAL = int(os.getenv("PREWARM_INTERVAL", "300"))
+
+# Prompt token budget (tokenizer should match OLLAMA_MODEL_NAME)
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "deepseek-ai/DeepSeek-R1-Distill-Llama-8B")
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+# Schema summarization (summary.py)
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_BATCH_TOKENS = int(os.getenv("SUMMARY_BATCH_TOKENS", "2500"))
+SUMMARY_REDUCE_TOKENS = int(os.getenv("SUMMARY_REDUCE_TOKENS", "3000"))
+
+# "ollama" for native /api/chat endpoints, "openai" for OpenAI-compatible ones; "auto" guesses from the URL
+LLM_API_STYLE = os.getenv("LLM_API_STYLE", "auto").lower()
+if LLM_API_STYLE == "auto":
+    LLM_API_STYLE = "ollama" if (OLLAMA_API_URL or "").rstrip("/").endswith(("/api/chat", "/api/generate")) else "openai"
+# Ask reasoning models (DeepSeek R1) not to emit <think> output where the backend supports it
+LLM_DISABLE_THINKING = os.getenv("LLM_DISABLE_THINKING", "true").lower() == "true"
+# A reply cut off at the output limit (often inside <think>) is retried once with this many times the budget
+LLM_CUTOFF_RETRY_FACTOR = int(os.getenv("LLM_CUTOFF_RETRY_FACTOR", "4"))
+
+# Number of SQL candidates sampled concurrently per question (1 = single completion).
+# Ollama needs OLLAMA_NUM_PARALLEL >= this value to actually run them in parallel.
+SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", "1"))
+SQL_CANDIDATE_TEMPERATURE = float(os.getenv("SQL_CANDIDATE_TEMPERATURE", "0.7"))
+
+# SQL Server connection pool (db.py)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "30"))
+# Connections idle for longer than this many seconds are pinged before reuse
+DB_POOL_PRE_PING_AFTER = float(os.getenv("DB_POOL_PRE_PING_AFTER", "5"))
+
+# Result fetching: rows per fetchmany() chunk and hard row caps per role. Chunks bound what is
+# read from the driver at a time; the rows kept for display (and peak memory) are bounded by the cap
+FETCH_CHUNK_SIZE = int(os.getenv("FETCH_CHUNK_SIZE", "5000"))
+USER_MAX_ROWS = int(os.getenv("USER_MAX_ROWS", "10000"))
+ADMIN_MAX_ROWS = int(os.getenv("ADMIN_MAX_ROWS", "100000"))
+
+# Per-role query timeouts in seconds (0 = no timeout); runaway queries are cancelled
+USER_QUERY_TIMEOUT = float(os.getenv("USER_QUERY_TIMEOUT", "30"))
+ADMIN_QUERY_TIMEOUT = float(os.getenv("ADMIN_QUERY_TIMEOUT", "300"))
+
+# "batch" sends each GO-batch in one round trip and reads every result set with nextset();
+# "statements" sends the statements split out by tsql_lexer one at a time
+QUERY_EXECUTION_MODE = os.getenv("QUERY_EXECUTION_MODE", "batch").lower()
+
+# Generated SELECTs are browsed in pages of this many rows (paging.py) instead of loaded whole
+RESULT_PAGING = os.getenv("RESULT_PAGING", "true").lower() == "true"
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "500"))
+
+# Rows per fast_executemany parameter array when bulk-loading uploaded CSV/Excel files
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", "10000"))
+
+# Estimated-cost gate for read-only generated SQL (SHOWPLAN_XML subtree cost; 0 disables).
+# Over the limit, or when no estimate is possible, a query is either rejected or run only
+# after the user confirms.
+USER_MAX_QUERY_COST = float(os.getenv("USER_MAX_QUERY_COST", "100"))
+ADMIN_MAX_QUERY_COST = float(os.getenv("ADMIN_MAX_QUERY_COST", "0"))
+USER_QUERY_COST_ACTION = os.getenv("USER_QUERY_COST_ACTION", "reject").lower()
+ADMIN_QUERY_COST_ACTION = os.getenv("ADMIN_QUERY_COST_ACTION", "confirm").lower()
+
+# OpenTelemetry tracing of each question's pipeline stages (tracing.py):
+# "none", "console", "file" (JSON lines in TRACING_FILE) or "otlp" (gRPC collector)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "chat2db-ai")
+
+# Execution backend (backends.py): "sqlserver", or "sqlite" for an in-process stand-in
+# seeded from schema memory with SQLITE_SEED_ROWS synthetic rows per table
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlserver").lower()
+SQLITE_SEED_ROWS = int(os.getenv("SQLITE_SEED_ROWS", "1000"))
+
+# Background schema sync (schema_sync.py): seconds between refreshes of the databases in
+# schema memory (0 disables) and where the per-table catalog signatures are kept
+SCHEMA_SYNC_INTERVAL = float(os.getenv("SCHEMA_SYNC_INTERVAL", "300"))
+SCHEMA_SYNC_STATE_FILE = os.getenv("SCHEMA_SYNC_STATE_FILE", "schema_sync_state.json")
+
+# Databases crawled at once by the live schema "import all" mode (each holds one pooled connection)
+SCHEMA_IMPORT_CONCURRENCY = int(os.getenv("SCHEMA_IMPORT_CONCURRENCY", "4"))
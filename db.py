@@ -1,68 +1,603 @@
-import pyodbc
-import re
+import threading
+import xml.etree.ElementTree as ET
+import time
+from collections import deque
+from contextlib import contextmanager
 import pandas as pd
-from config import DB_SERVER, USE_WINDOWS_AUTH
+from config import (
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_IDLE_TIMEOUT,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_PRE_PING_AFTER,
+    FETCH_CHUNK_SIZE,
+    USER_MAX_ROWS,
+    ADMIN_MAX_ROWS,
+    USER_QUERY_TIMEOUT,
+    ADMIN_QUERY_TIMEOUT,
+    RESULT_CACHE_ENABLED,
+    QUERY_EXECUTION_MODE,
+    USER_MAX_QUERY_COST,
+    ADMIN_MAX_QUERY_COST,
+    USER_QUERY_COST_ACTION,
+    ADMIN_QUERY_COST_ACTION,
+)
+from backends import get_backend
+from tracing import span
+from tsql_lexer import iter_script, iter_statements, iter_tokens, table_references, unquote_identifier
+from result_cache import result_cache, is_read_only
 
-def get_connection():
-    conn_str = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={DB_SERVER};"
-        f"{'Trusted_Connection=yes;' if USE_WINDOWS_AUTH else ''}"
+def create_connection():
+    return get_backend().connect()
+
+def quote_identifier(name):
+    return "[" + name.replace("]", "]]") + "]"
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    """
+    Thread-safe pool of backend connections shared by every Streamlit session.
+
+    Connections idle for longer than `pre_ping_after` seconds are validated
+    with SELECT 1 before reuse, and idle connections beyond `min_size` are
+    closed after `idle_timeout` seconds. On release every connection is put
+    back in autocommit mode, any open transaction (including one a script
+    began with BEGIN TRAN) is rolled back and it returns to its login
+    database; its SET options and other session settings are then compared
+    with those it had when opened, and it is closed instead of reused if
+    they differ or if it was marked with discard_on_release().
+    """
+
+    def __init__(self, backend=None, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+                 pre_ping_after=DB_POOL_PRE_PING_AFTER):
+        self.backend = backend or get_backend()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.pre_ping_after = pre_ping_after
+        self._idle = deque()  # (conn, released_at), most recently used last
+        self._home = {}  # id(conn) -> (login database, session_state() when opened)
+        self._dirty = set()  # id(conn) of connections that must not be reused
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _open(self):
+        conn = self.backend.connect()
+        self._home[id(conn)] = (self.backend.current_database(conn), self.backend.session_state(conn))
+        return conn
+
+    def _discard(self, conn):
+        self._home.pop(id(conn), None)
+        self._dirty.discard(id(conn))
+        try:
+            conn.close()
+        except self.backend.errors:
+            pass
+
+    def _evict_idle(self, now):
+        # Oldest idle connections are at the left
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._discard(conn)
+
+    def acquire(self, database=None):
+        deadline = time.monotonic() + self.acquire_timeout
+        conn = None
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if now >= deadline or not self._cond.wait(deadline - now):
+                    raise PoolTimeout(f"No database connection available after {self.acquire_timeout:.0f}s")
+
+        try:
+            if conn is not None and time.monotonic() - released_at > self.pre_ping_after and not self.backend.ping(conn):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._open()
+            if database:
+                self.backend.use_database(conn, database)
+            return conn
+        except Exception:
+            if conn is not None:
+                self._discard(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def discard_on_release(self, conn):
+        """Close `conn` when it is released, for sessions left with state a reset cannot undo."""
+        with self._cond:
+            self._dirty.add(id(conn))
+
+    def release(self, conn):
+        try:
+            home, state = self._home[id(conn)]
+            if not conn.autocommit:
+                conn.rollback()
+                conn.autocommit = True
+            healthy = id(conn) not in self._dirty and self.backend.reset_session(conn, home) == state
+        except self.backend.errors + (KeyError,):
+            healthy = False
+
+        with self._cond:
+            if healthy:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+                self._discard(conn)
+            self._cond.notify()
+
+    def fill(self):
+        """Open connections up to min_size."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    @contextmanager
+    def connection(self, database=None):
+        conn = self.acquire(database)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"open": self._size, "idle": len(self._idle), "max": self.max_size}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool()
+                pool.fill()
+                _pool = pool
+    return _pool
+
+def get_connection(database=None):
+    """
+    Borrow a pooled connection, optionally switched to `database`:
+
+        with get_connection() as conn:
+            ...
+    """
+    return get_pool().connection(database)
+
+def list_databases():
+    """Names of the user databases on the server."""
+    with get_connection() as conn:
+        return get_backend().list_databases(conn)
+
+def reflect_schema(database, tables=None):
+    """Schema memory entries for every table of `database` (or those in `tables`), read from the server's catalog."""
+    with get_connection() as conn:
+        return get_backend().reflect_schema(conn, database, tables)
+
+# Session-scoped objects and settings that outlive a script and are not covered by session_state()
+SESSION_SCOPED_WORDS = {"IDENTITY_INSERT", "CURSOR", "SP_SET_SESSION_CONTEXT", "SP_SETAPPROLE"}
+
+def leaves_session_state(query):
+    """True when a script may create temp tables, cursors or session settings that would leak to the next caller."""
+    return any(
+        kind == "word" and (text.startswith("#") or text.upper() in SESSION_SCOPED_WORDS)
+        for kind, text, _ in iter_tokens(query)
     )
-    return pyodbc.connect(conn_str, autocommit=True)
+
 def split_sql_batches(query):
-    # Step 1: First split by GO
-    raw_batches = re.split(r'^\s*GO\s*$', query, flags=re.IGNORECASE | re.MULTILINE)
-
-    final_batches = []
-    crud_pattern = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
-
-    for batch in raw_batches:
-        lines = batch.strip().splitlines()
-        current_stmt = []
-        for line in lines:
-            if crud_pattern.match(line) and current_stmt:
-                final_batches.append('\n'.join(current_stmt).strip())
-                current_stmt = [line]
-            else:
-                current_stmt.append(line)
-        if current_stmt:
-            final_batches.append('\n'.join(current_stmt).strip())
+    """Split a script into executable statements; batches marked GO <count> are repeated."""
+    return list(iter_statements(query))
 
-    return [stmt for stmt in final_batches if stmt]
+def max_rows_for_role(is_admin):
+    return ADMIN_MAX_ROWS if is_admin else USER_MAX_ROWS
 
-def query_db(query):
-    conn = get_connection()
-    cursor = conn.cursor()
-    # Normalize GO
-    query = re.sub(r'(?<!\n)(?<!\r)\bGO\b', r'\nGO', query, flags=re.IGNORECASE)
-    batches = split_sql_batches(query)
-    batches = [b.strip() for b in batches if b.strip()]
+def query_timeout_for_role(is_admin):
+    return ADMIN_QUERY_TIMEOUT if is_admin else USER_QUERY_TIMEOUT
 
-    results = []
+def cost_limit_for_role(is_admin):
+    """Return (max estimated cost or 0 for none, "reject" | "confirm")."""
+    if is_admin:
+        return ADMIN_MAX_QUERY_COST, ADMIN_QUERY_COST_ACTION
+    return USER_MAX_QUERY_COST, USER_QUERY_COST_ACTION
 
-    try:
-        # Handle initial USE statement
-        if batches and batches[0].lower().startswith("use "):
-            cursor.execute(batches[0])
-            batches = batches[1:]
-
-        for batch in batches:
-            cursor.execute(batch)
-
-            if batch.lower().startswith("select"):
-                rows = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description]
-                clean_rows = [tuple(r) for r in rows]
-                df = pd.DataFrame(clean_rows, columns=columns)
-                results.append(df)
-            else:
+SHOWPLAN_NS = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+SCAN_OPERATORS = {"Table Scan", "Clustered Index Scan", "Index Scan"}
+
+def summarize_plans(plans):
+    """
+    Reduce SHOWPLAN_XML documents to the estimated subtree cost and row count
+    of all statements plus the largest scans.
+    """
+    cost, rows, scans = 0.0, 0.0, []
+    for xml in plans:
+        root = ET.fromstring(xml)
+        for stmt in root.iter(f"{SHOWPLAN_NS}StmtSimple"):
+            cost += float(stmt.get("StatementSubTreeCost", 0))
+            rows += float(stmt.get("StatementEstRows", 0))
+        for op in root.iter(f"{SHOWPLAN_NS}RelOp"):
+            if op.get("PhysicalOp") not in SCAN_OPERATORS:
+                continue
+            obj = op.find(f".//{SHOWPLAN_NS}Object")
+            scans.append({
+                "operator": op.get("PhysicalOp"),
+                "table": obj.get("Table", "").strip("[]") if obj is not None else "",
+                "rows": float(op.get("EstimateRows", 0)),
+                "table_rows": float(op.get("TableCardinality", 0)),
+                "cost": float(op.get("EstimatedTotalSubtreeCost", 0)),
+            })
+    scans.sort(key=lambda scan: scan["cost"], reverse=True)
+    return {"cost": cost, "rows": rows, "scans": scans[:5]}
+
+def estimate_plan(query, database=None):
+    """
+    Compile a script with SET SHOWPLAN_XML ON, which returns the estimated
+    plans without executing anything, and summarize them. Each GO-batch is
+    compiled whole, so variables declared in it are in scope, and counted
+    once per GO repeat. USE statements at the start of the script select the
+    connection's database instead of being sent.
+    """
+    batches = []
+    for batch in iter_script(query):
+        statements = list(batch.statements)
+        while statements and not batches:
+            tokens = list(iter_tokens(statements[0]))
+            if not (len(tokens) > 1 and tokens[0][1].upper() == "USE"):
+                break
+            database = unquote_identifier(tokens[1][0], tokens[1][1])
+            statements.pop(0)
+        if statements:
+            batches.append(("\n".join(statements), batch.count))
+
+    plans = []
+    with get_connection(database) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SET SHOWPLAN_XML ON")
+        try:
+            for text, count in batches:
+                cursor.execute(text)
+                batch_plans = []
+                while True:
+                    if cursor.description:
+                        batch_plans.extend(row[0] for row in cursor.fetchall())
+                    if not cursor.nextset():
+                        break
+                plans.extend(batch_plans * count)
+        finally:
+            cursor.execute("SET SHOWPLAN_XML OFF")
+    return summarize_plans(plans)
+
+def cost_gate(query, max_cost, database=None):
+    """
+    Return (plan summary or None, problem message or None) for a script whose
+    estimated cost must not exceed `max_cost`. A script whose plan cannot be
+    estimated (e.g. it reads a temp table the script itself creates) is
+    reported as a problem too, so it is rejected or confirmed like a costly one.
+    """
+    if not get_backend().estimates_cost:
+        return None, None
+    with span("db.cost_gate", max_cost=max_cost) as current:
+        try:
+            plan = estimate_plan(query, database)
+        except Exception as e:
+            current.set_attribute("plan.error", str(e))
+            return None, f"The cost of this query could not be estimated, so it was not run: {e}"
+        current.set_attributes({"plan.cost": plan["cost"], "plan.rows": plan["rows"]})
+    if plan["cost"] > max_cost:
+        return plan, (f"Estimated cost {plan['cost']:,.1f} (about {plan['rows']:,.0f} rows) "
+                      f"exceeds the limit of {max_cost:,.0f} for your role.")
+    return plan, None
+
+class QueryCancelled(Exception):
+    pass
+
+class QueryHandle:
+    """
+    Lets another thread stop a running query: cancel() records the reason and
+    calls cursor.cancel() on the statement currently executing, and the
+    running iter_query raises QueryCancelled at its next checkpoint.
+    """
+
+    def __init__(self):
+        self.reason = None
+        self._cursor = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def attach(self, cursor):
+        with self._lock:
+            self._cursor = cursor
+        self.check()
+
+    def detach(self):
+        # The connection goes back to the pool; a late cancel must not reach it
+        with self._lock:
+            self._cursor = None
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            cursor = self._cursor
+        if cursor is not None:
+            try:
+                cursor.cancel()
+            except get_backend().errors:
+                pass
+
+    def check(self):
+        if self.reason is not None:
+            raise QueryCancelled(self.reason)
+
+# Statements that never produce a result set, so a batch of these plus one last statement is as cancellable as that statement
+SETUP_STATEMENTS = {"USE", "SET", "DECLARE"}
+
+def _last_statement_only(statements):
+    """True when only the last statement of a batch can produce rows."""
+    for stmt in statements[:-1]:
+        first = next(iter_tokens(stmt), None)
+        if first is None or first[1].upper() not in SETUP_STATEMENTS:
+            return False
+    return True
+
+def prepare_batches(query, mode=QUERY_EXECUTION_MODE):
+    """
+    Lazily produce the units of a script sent to the server as (text,
+    cancel_rest) pairs: whole GO-batches (repeated for GO <count>) in "batch"
+    mode, or individual statements in "statements" mode. `cancel_rest` is set
+    when the rows of the unit's results come from its last statement, so rows
+    beyond the cap can be cancelled instead of streamed to nextset() without
+    skipping later statements.
+    """
+    if mode == "statements":
+        return ((stmt, True) for stmt in iter_statements(query))
+    return (
+        (batch.text, _last_statement_only(batch.statements))
+        for batch in iter_script(query)
+        for _ in range(batch.count)
+    )
+
+def fetch_chunks(cursor, max_rows=None, chunk_size=FETCH_CHUNK_SIZE, cancel_rest=True):
+    """
+    Yield the current result set as DataFrames of at most `chunk_size` rows,
+    stopping after `max_rows` rows. The last chunk has attrs["truncated"] set
+    when rows were left unread; those are cancelled rather than transferred
+    when `cancel_rest` is set, and otherwise left for nextset() to discard.
+    An empty result set is yielded as an empty DataFrame with its columns.
+    """
+    columns = [desc[0] for desc in cursor.description]
+    fetched = 0
+    while True:
+        size = chunk_size if max_rows is None else min(chunk_size, max_rows - fetched)
+        rows = cursor.fetchmany(size)
+        if not rows:
+            if not fetched:
+                df = pd.DataFrame(columns=columns)
+                df.attrs["truncated"] = False
+                yield df
+            return
+        fetched += len(rows)
+
+        capped = max_rows is not None and fetched >= max_rows
+        truncated = capped and cursor.fetchone() is not None
+        if truncated and cancel_rest:
+            cursor.cancel()
+
+        df = pd.DataFrame.from_records([tuple(r) for r in rows], columns=columns)
+        df.attrs["truncated"] = truncated
+        yield df
+
+        if capped or len(rows) < size:
+            return
+
+def iter_query(query, max_rows=None, chunk_size=FETCH_CHUNK_SIZE, handle=None,
+               mode=QUERY_EXECUTION_MODE, transaction=False, rowcounts=None, database=None, params=None):
+    """
+    Run a script and yield (result_index, DataFrame chunk) pairs as rows arrive,
+    so callers can show the first rows before the whole result is read.
+
+    Every result set of every unit is read through nextset(), including those
+    produced inside IF blocks or procedures, each capped at `max_rows` rows.
+    Affected-row counts of other statements are appended to `rowcounts`.
+    With `transaction` the whole script runs in one transaction that is
+    rolled back on failure. Passing a QueryHandle allows the script to be
+    cancelled from another thread. The script starts in `database` if given,
+    else in the login database. `params` are bound to the ? markers of a
+    script that is sent as a single unit.
+    """
+    backend = get_backend()
+    if not backend.batches:
+        mode = "statements"
+    with get_connection(database) as conn:
+        if leaves_session_state(query):
+            get_pool().discard_on_release(conn)
+        cursor = conn.cursor()
+        if handle:
+            handle.attach(cursor)
+        if transaction:
+            conn.autocommit = False
+        result_index = 0
+        try:
+            for unit, cancel_rest in prepare_batches(query, mode):
+                if handle:
+                    handle.check()
+                if params:
+                    cursor.execute(unit, params)
+                else:
+                    cursor.execute(unit)
+
+                while True:
+                    if cursor.description:
+                        # Unless later statements of the batch still have to run, rows beyond the cap are cancelled
+                        for chunk in fetch_chunks(cursor, max_rows, chunk_size, cancel_rest=cancel_rest):
+                            if handle:
+                                handle.check()
+                            yield result_index, chunk
+                        result_index += 1
+                    elif rowcounts is not None and cursor.rowcount >= 0:
+                        rowcounts.append(cursor.rowcount)
+                    if not cursor.nextset():
+                        break
+            if transaction:
                 conn.commit()
+        except Exception as e:
+            if transaction:
+                try:
+                    conn.rollback()
+                except backend.errors:
+                    pass  # The pool rolls back again on release
+            # The driver reports a cancelled statement as an ordinary error
+            if handle and isinstance(e, backend.errors):
+                handle.check()
+            raise
+        finally:
+            if handle:
+                handle.detach()
 
-        if results:
-            return results[0] if len(results) == 1 else results
-        else:
-            return "✅ Query executed successfully."
+def collect_results(chunks, rowcounts=None):
+    """Combine (result_index, chunk) pairs into query_db's return value."""
+    grouped = {}
+    for result_index, chunk in chunks:
+        grouped.setdefault(result_index, []).append(chunk)
+
+    results = []
+    for parts in grouped.values():
+        df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+        df.attrs["truncated"] = parts[-1].attrs.get("truncated", False)
+        results.append(df)
+
+    if results:
+        return results[0] if len(results) == 1 else results
+    elif rowcounts:
+        return f"✅ Query executed successfully. {sum(rowcounts):,} row(s) affected."
+    else:
+        return "✅ Query executed successfully."
+
+def query_db(query, max_rows=None, timeout=None, handle=None, on_chunk=None,
+             mode=QUERY_EXECUTION_MODE, transaction=False, max_cost=None, confirmed=False, database=None,
+             params=None):
+    """
+    Run a script, cancelling it after `timeout` seconds or when `handle` is
+    cancelled, and return a status dict:
+
+        {"status": "ok" | "timeout" | "cancelled" | "error" | "over_cost",
+         "result": DataFrame, list of DataFrames or message (None unless ok),
+         "error": message or None, "elapsed": seconds, "cached": bool,
+         "rowcounts": affected-row counts of non-SELECT statements,
+         "plan": summarize_plans() of the estimated plan, or None}
 
+    See iter_query for `mode`, `transaction`, `database` and `params`.
+    `on_chunk(result_index, chunk)` is called for every chunk as it arrives.
+    Chunks are kept and concatenated into the returned DataFrames, so memory
+    is bounded by `max_rows` per result set (briefly twice that while
+    concatenating), not by the chunk size; use paging.Pager to hold only one page.
+    Read-only scripts are served from result_cache when possible, unless
+    they read a source whose tables cannot be named; scripts that write
+    invalidate the cached results of every table they touch.
+    With `max_cost`, read-only scripts are first estimated with SHOWPLAN and
+    refused with status "over_cost" above that cost unless `confirmed`.
+    """
+    with span("db.query", mode=mode, transaction=transaction, max_rows=max_rows) as current:
+        outcome = _run_query(query, max_rows, timeout, handle, on_chunk, mode, transaction, max_cost, confirmed,
+                             database, params)
+        result = outcome["result"]
+        frames = result if isinstance(result, list) else [result] if isinstance(result, pd.DataFrame) else []
+        current.set_attributes({
+            "db.status": outcome["status"],
+            "db.cached": outcome["cached"],
+            "db.result_sets": len(frames),
+            "db.rows": sum(len(df) for df in frames),
+            "db.rows_affected": sum(outcome["rowcounts"]),
+        })
+        return outcome
+
+def _run_query(query, max_rows, timeout, handle, on_chunk, mode, transaction, max_cost, confirmed, database, params):
+    start = time.monotonic()
+    tables, writes = table_references(query, database)
+    read_only = is_read_only(query, writes)
+    # A read of unknown tables could never be invalidated, so its result is not cached
+    cacheable = read_only and all(table != "*" for _, table in tables)
+    key = None
+    if RESULT_CACHE_ENABLED and cacheable:
+        key = result_cache.make_key(query, database, max_rows, params)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return {"status": "ok", "result": cached, "error": None, "elapsed": time.monotonic() - start,
+                    "cached": True, "rowcounts": [], "plan": None}
+    generation = result_cache.generation
+
+    plan = None
+    if max_cost and read_only and not confirmed:
+        plan, problem = cost_gate(query, max_cost, database)
+        if problem:
+            return {"status": "over_cost", "result": None, "error": problem, "elapsed": time.monotonic() - start,
+                    "cached": False, "rowcounts": [], "plan": plan}
+
+    handle = handle or QueryHandle()
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, handle.cancel, args=("timeout",))
+        timer.daemon = True
+        timer.start()
+
+    chunks = []
+    rowcounts = []
+    status, result, error = "ok", None, None
+    try:
+        with span("db.execute"):
+            for result_index, chunk in iter_query(query, max_rows, handle=handle, mode=mode, transaction=transaction,
+                                                  rowcounts=rowcounts, database=database, params=params):
+                chunks.append((result_index, chunk))
+                if on_chunk:
+                    on_chunk(result_index, chunk)
+        with span("db.build_dataframe", chunks=len(chunks)):
+            result = collect_results(chunks, rowcounts)
     except Exception as e:
-        return str(e)
+        if handle.reason == "timeout":
+            status, error = "timeout", f"Query timed out after {timeout:.0f}s and was cancelled."
+        elif handle.cancelled:
+            status, error = "cancelled", "Query cancelled."
+        else:
+            status, error = "error", str(e)
+    finally:
+        if timer:
+            timer.cancel()
+        if writes:
+            # Invalidate even on failure: earlier statements may already have committed
+            result_cache.invalidate_tables(tables)
+
+    if key and status == "ok" and isinstance(result, (pd.DataFrame, list)):
+        result_cache.put(key, result, tables, generation)
+
+    return {"status": status, "result": result, "error": error, "elapsed": time.monotonic() - start,
+            "cached": False, "rowcounts": rowcounts, "plan": plan}
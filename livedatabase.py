@@ -1,66 +1,73 @@
 import streamlit as st
 import json
-from db import get_connection
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from db import get_connection, list_databases
+from backends import get_backend
+from config import SCHEMA_IMPORT_CONCURRENCY
 from llm import process_query_with_llama
-from memory import load_schema_memory, save_schema_memory, load_global_memory, save_global_memory
+from memory import (
+    load_schema_memory, save_schema_memory, load_global_memory, save_global_memory,
+    load_schema_memory_raw, iter_schema_tables, patch_schema_memory, qualified_table_name,
+)
 from summary import summarize_schema_with_llm
 import re
 def extract_schema_for_database(conn, db_name):
-    cursor = conn.cursor()
-    cursor.execute(f"USE [{db_name}]")
-
-    cursor.execute("""
-        SELECT TABLE_SCHEMA, TABLE_NAME 
-        FROM INFORMATION_SCHEMA.TABLES 
-        WHERE TABLE_TYPE = 'BASE TABLE'
-    """)
-    tables = cursor.fetchall()
-
-    schema = []
-    for schema_name, table_name in tables:
-        cursor.execute(f"""
-            SELECT 
-                c.COLUMN_NAME, 
-                c.DATA_TYPE, 
-                c.IS_NULLABLE,
-                CASE WHEN pk.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END AS IS_PRIMARY_KEY,
-                CASE WHEN fk.COLUMN_NAME IS NOT NULL THEN 1 ELSE 0 END AS IS_FOREIGN_KEY
-            FROM INFORMATION_SCHEMA.COLUMNS c
-            LEFT JOIN (
-                SELECT COLUMN_NAME
-                FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE kcu
-                JOIN INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc 
-                  ON kcu.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
-                WHERE 
-                    tc.TABLE_NAME = '{table_name}'
-                    AND tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
-                    AND tc.TABLE_SCHEMA = '{schema_name}'
-            ) pk ON c.COLUMN_NAME = pk.COLUMN_NAME
-            LEFT JOIN (
-                SELECT kcu.COLUMN_NAME
-                FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE kcu
-                JOIN INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
-                  ON kcu.CONSTRAINT_NAME = tc.CONSTRAINT_NAME
-                WHERE 
-                    tc.TABLE_NAME = '{table_name}'
-                    AND tc.CONSTRAINT_TYPE = 'FOREIGN KEY'
-                    AND tc.TABLE_SCHEMA = '{schema_name}'
-            ) fk ON c.COLUMN_NAME = fk.COLUMN_NAME
-            WHERE c.TABLE_NAME = '{table_name}' AND c.TABLE_SCHEMA = '{schema_name}'
-            ORDER BY c.ORDINAL_POSITION
-        """)
-        columns = cursor.fetchall()
-
-        formatted_columns = [
-            [col[0], col[1], col[2], bool(col[3]), bool(col[4])] for col in columns
-        ]
-
-        schema.append({
-            "database": db_name,
-            "table": table_name,
-            "columns": formatted_columns
-        })
-    return schema
+    return get_backend().reflect_schema(conn, db_name)
+
+
+def _crawl(db_name):
+    start = time.monotonic()
+    with get_connection() as conn:
+        return extract_schema_for_database(conn, db_name), time.monotonic() - start
+
+
+def crawl_databases(db_names, workers=SCHEMA_IMPORT_CONCURRENCY):
+    """
+    Extract several databases concurrently, each worker on its own pooled
+    connection. Yields (database, entries, seconds, error) as each finishes.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="schema-crawl") as executor:
+        futures = {executor.submit(_crawl, db_name): db_name for db_name in db_names}
+        for future in as_completed(futures):
+            try:
+                entries, seconds = future.result()
+                yield futures[future], entries, seconds, None
+            except Exception as e:
+                yield futures[future], None, 0.0, e
+
+
+def import_all_databases(db_names):
+    """
+    Crawl every database in `db_names`, showing progress as each one finishes,
+    then write all of them to schema memory in one go. Tables that no longer
+    exist in a crawled database are removed. Clarification is skipped; a
+    database can still be re-imported on its own to clarify it.
+    """
+    progress = st.progress(0.0, text=f"Crawling {len(db_names)} databases...")
+    log = st.empty()
+    lines = []
+    entries, crawled = [], set()
+    start = time.monotonic()
+    for done, (db_name, schema, seconds, error) in enumerate(crawl_databases(db_names), 1):
+        if error:
+            lines.append(f"❌ `{db_name}`: {error}")
+        else:
+            entries.extend(schema)
+            crawled.add(db_name.lower())
+            lines.append(f"✅ `{db_name}`: {len(schema)} tables in {seconds:.1f}s")
+        progress.progress(done / len(db_names), text=f"{done}/{len(db_names)} databases crawled")
+        log.markdown("\n".join(f"- {line}" for line in lines))
+
+    found = {(entry["database"].lower(), qualified_table_name(entry).lower()) for entry in entries}
+    dropped = {
+        (db, table) for db, table, _ in iter_schema_tables(load_schema_memory_raw())
+        if db.lower() in crawled and (db.lower(), table.lower()) not in found
+    }
+    changed = patch_schema_memory(entries, dropped)
+    progress.empty()
+    st.success(f"✅ Imported {len(crawled)} of {len(db_names)} databases ({len(entries)} tables, "
+               f"{len(changed)} changed) in {time.monotonic() - start:.1f}s.")
 
 
 def import_and_clarify_schema(db_name):
@@ -71,8 +78,8 @@ def import_and_clarify_schema(db_name):
     if "user_reply" not in st.session_state:
         st.session_state.user_reply = ""
     if "schema" not in st.session_state:
-        conn = get_connection()
-        st.session_state.schema = extract_schema_for_database(conn, db_name)
+        with get_connection() as conn:
+            st.session_state.schema = extract_schema_for_database(conn, db_name)
 
         chunks = [
             f"Table: {entry['table']}, Columns: {', '.join([f'{col[0]} ({col[1]})' for col in entry['columns']])}"
@@ -100,7 +107,8 @@ Instructions:
             model_input,
             user_memory=[],
             is_admin=True,
-            is_selecteddatabse=False
+            is_selecteddatabse=False,
+            call_type="clarification"
         )
         st.session_state.last_model_question = st.session_state.model_response.strip()
 
@@ -151,7 +159,8 @@ Instructions:
                     followup_prompt,
                     user_memory=[],
                     is_admin=True,
-                    is_selecteddatabse=False
+                    is_selecteddatabse=False,
+                    call_type="clarification"
                 )
                 st.session_state.last_model_question = st.session_state.model_response.strip()
                 st.session_state.user_reply = ""
@@ -159,15 +168,9 @@ Instructions:
 
 
 def run_live_schema_import():
-    conn = get_connection()
     db_names = []
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT name FROM sys.databases 
-            WHERE name NOT IN ('master', 'tempdb', 'model', 'msdb')
-        """)
-        db_names = [row[0] for row in cursor.fetchall()]
+        db_names = list_databases()
     except Exception as e:
         st.error(f"Error fetching databases: {e}")
         return
@@ -188,6 +191,10 @@ def run_live_schema_import():
         st.sidebar.info("✅ All available databases have been imported.")
         return
 
+    if st.sidebar.button(f"📥 Import all {len(available_dbs)} databases"):
+        import_all_databases(available_dbs)
+        return
+
     st.sidebar.markdown("## Select Database")
     selected_db = st.sidebar.selectbox("Choose a database to import schema", available_dbs)
 
@@ -1,7 +1,37 @@
+import asyncio
+import json
+import re
+import threading
+import time
 import requests
-from config import API_KEY, OLLAMA_API_URL, OLLAMA_MODEL_NAME
-from memory import load_schema_memory, load_global_memory, load_user_memory
+from config import (
+    OLLAMA_MODEL_NAME,
+    OLLAMA_KEEP_ALIVE,
+    PREWARM_INTERVAL,
+    LLM_API_STYLE,
+    LLM_DISABLE_THINKING,
+    LLM_CUTOFF_RETRY_FACTOR,
+    SQL_CANDIDATES,
+    SQL_CANDIDATE_TEMPERATURE,
+    GLOBAL_MEMORY_FILE,
+    ANSWER_CACHE_ENABLED,
+)
+from memory import load_global_memory, load_user_memory, user_memory_path
+from llm_client import AsyncLLMClient, get_llm_client
+from prompt_cache import prompt_prefix_cache
+from singleflight import SingleFlight, payload_key
 from rag import retrieve_context_chunks
+from schema import validate_sql_against_schema
+from schema_retriever import retrieve_schema_tables
+from token_budget import prompt_budget
+from answer_cache import answer_cache, conversation_context
+from tracing import span, start_span, set_attributes
+
+ADMIN_MEMORY_USER_ID = 1
+# Schema memory is retrieved per question, outside the prefix, so it is not a source here
+PREFIX_SOURCE_FILES = (user_memory_path(ADMIN_MEMORY_USER_ID), GLOBAL_MEMORY_FILE)
+
+llm_flight = SingleFlight()
 
 def sanitize_messages(memory_list, name="memory"):
     sanitized = []
@@ -17,20 +47,14 @@ def sanitize_messages(memory_list, name="memory"):
         sanitized.append({"role": role, "content": content})
     return sanitized
 
-def process_query_with_llama(user_input, user_memory, is_admin=False, is_selecteddatabse=False, selected_database=None):
-    admin_memory = sanitize_messages(load_user_memory(1), "admin_memory")
-    schema_memory = sanitize_messages(load_schema_memory(), "schema_memory")
-    global_memory = sanitize_messages(load_global_memory(), "global_memory")
-    retrieved_context = sanitize_messages(retrieve_context_chunks(user_input), "retrieved_context")
-    user_memory = sanitize_messages(user_memory, "user_memory")
-
+def build_system_prompt(is_admin, selected_database=None):
     role_instruction = (
         "You are interacting with an ADMIN. They can perform ALL SQL operations."
         if is_admin else
         "You are interacting with a USER. They can only perform SELECT, INSERT, UPDATE, DELETE."
     )
 
-    system_prompt = f"""
+    return f"""
 You are a SMART and PROFESSIONAL T-SQL assistant specialized in Microsoft SQL Server over ODBC.
 You understand all human languages including English, French, Arabic, and more.
 
@@ -39,7 +63,7 @@ GENERAL BEHAVIOR:
 - NEVER include any explanation, comments, markdown formatting (no ```sql```, no indentation).
 - Do NOT output any text other than the SQL code itself.
 - Always prefix SQL code with:
-  USE {selected_database if is_selecteddatabse and selected_database else "<DatabaseName>"};
+  USE {selected_database or "<DatabaseName>"};
   GO
 - If the SQL you generate already includes a USE statement at the top, do NOT add another.
 - Do NOT mention or repeat the database name elsewhere in the SQL.
@@ -48,7 +72,7 @@ GENERAL RULES:
 - When asked to generate SQL, output ONLY clean, valid, and executable T-SQL code.
 - NEVER include explanations, comments, markdown, or any text other than SQL.
 - Very Important and ALWAYS Every SQL script MUST begin with:
-  USE {selected_database if is_selecteddatabse and selected_database else "<DatabaseName>"};
+  USE {selected_database or "<DatabaseName>"};
   GO
 - If the SQL already includes a USE statement at the top, do NOT add another.
 - Do NOT mention or repeat the database name anywhere else in the SQL.
@@ -99,55 +123,550 @@ IMPORTANT:
 {role_instruction}
 """.strip()
 
-    # Base message list
-    messages = [
-        {"role": "system", "content": system_prompt},
-        *admin_memory,
-        *schema_memory,
-        *global_memory,
-        *retrieved_context,
-        *user_memory,
-    ]
-
-    # Add selected database reminder explicitly
-    if is_selecteddatabse and selected_database:
-        messages.append({
-            "role": "system",
-            "content": f"The selected database for all operations is: {selected_database}."
+
+def build_prompt_sources(is_admin, selected_database=None):
+    """
+    Return the cached static head of every prompt as (sources, breakdown):
+    system prompt, admin memory, global memory and the selected database
+    reminder as named sources, already trimmed to the token budget. It is
+    budgeted once, when built, and then byte-identical between requests for
+    the same role and database, so the backend can reuse its KV cache for it.
+    """
+    def build():
+        database_reminder = []
+        # Add selected database reminder explicitly
+        if selected_database:
+            database_reminder.append({
+                "role": "system",
+                "content": f"The selected database for all operations is: {selected_database}."
+            })
+        return prompt_budget.apply({
+            "system": [{"role": "system", "content": build_system_prompt(is_admin, selected_database)}],
+            "admin_memory": sanitize_messages(load_user_memory(ADMIN_MEMORY_USER_ID), "admin_memory"),
+            "global_memory": sanitize_messages(load_global_memory(), "global_memory"),
+            "database": database_reminder,
         })
 
-    # Add user input last
-    messages.append({"role": "user", "content": user_input})
+    role = "admin" if is_admin else "user"
+    # Memory files are only read when the cached prefix is stale
+    with span("llm.prompt_prefix", role=role):
+        return prompt_prefix_cache.get(role, selected_database, PREFIX_SOURCE_FILES, build)
+
+
+def build_prompt_prefix(is_admin, selected_database=None):
+    sources, _ = build_prompt_sources(is_admin, selected_database)
+    return [msg for messages in sources.values() for msg in messages]
+
+
+_request_state = threading.local()
+
+
+def get_last_token_breakdown():
+    """
+    Token counts per prompt source for the last request built on this thread
+    (one per Streamlit session); None when it was answered from the answer cache.
+    """
+    return getattr(_request_state, "token_breakdown", None)
+
 
+def build_messages(user_input, user_memory, is_admin, database, schema_tables):
+    with span("rag.retrieve"):
+        context = retrieve_context_chunks(user_input)
+    prefix, prefix_breakdown = build_prompt_sources(is_admin, database)
+    # Content that changes from turn to turn, then per-question content, after the static prefix.
+    # Only these are trimmed, against what the prefix leaves of the budget
+    sources = {
+        "user_memory": sanitize_messages(user_memory, "user_memory"),
+        "schema_memory": [{"role": "system", "content": content} for _, _, content in schema_tables],
+        "retrieved_context": sanitize_messages(context, "retrieved_context"),
+        "question": [{"role": "user", "content": user_input}],
+    }
+    with span("llm.token_budget") as current:
+        sources, breakdown = prompt_budget.apply(sources, fixed=prefix_breakdown)
+        current.set_attributes({f"prompt.tokens.{name}": counts["tokens"] for name, counts in breakdown.items()})
+    _request_state.token_breakdown = breakdown
+    return [msg for messages in (*prefix.values(), *sources.values()) for msg in messages]
+
+
+# Output limits and sampling per kind of call
+GENERATION_PROFILES = {
+    "sql": {
+        "max_tokens": 2048,
+        "temperature": 0.1,
+        "top_p": 0.9,
+        "stop": ["\nExplanation", "\nNote:", "\n```\n"],
+    },
+    "clarification": {
+        "max_tokens": 512,
+        "temperature": 0.4,
+        "top_p": 0.95,
+        "stop": [],
+    },
+    "summary": {
+        "max_tokens": 768,
+        "temperature": 0.3,
+        "top_p": 0.95,
+        "stop": [],
+    },
+    "mapping": {
+        "max_tokens": 1024,
+        "temperature": 0.0,
+        "top_p": 1.0,
+        "stop": [],
+    },
+}
+
+
+def build_payload(messages, call_type="sql"):
+    profile = GENERATION_PROFILES[call_type]
     payload = {
         "model": OLLAMA_MODEL_NAME,
         "messages": messages,
-        "temperature": 0.6,
-        "top_p": 0.95,
-        # "top_k": 40,
-        # "repeat_penalty": 1.1
     }
+    if LLM_API_STYLE == "ollama":
+        options = {
+            "temperature": profile["temperature"],
+            "top_p": profile["top_p"],
+            "num_predict": profile["max_tokens"],
+        }
+        if profile["stop"]:
+            options["stop"] = profile["stop"]
+        payload["options"] = options
+        payload["stream"] = False
+        if LLM_DISABLE_THINKING:
+            payload["think"] = False
+    else:
+        payload["temperature"] = profile["temperature"]
+        payload["top_p"] = profile["top_p"]
+        payload["max_tokens"] = profile["max_tokens"]
+        if profile["stop"]:
+            payload["stop"] = profile["stop"]
+    if OLLAMA_KEEP_ALIVE:
+        payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+    return payload
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost",
-        "X-Title": "Chat2DB SQL Assistant"
-    }
 
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+_THINK_BLOCK_RE = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+# The "sql" profile stops at a closing fence, which leaves the opening one behind
+_FENCE_OPEN_RE = re.compile(r"^```[A-Za-z-]*[ \t]*\n?")
+_FENCE_CLOSE_RE = re.compile(r"\n?```\s*$")
+
+# Reply that ran into the output token limit, also yielded as the last piece of a cut-off stream
+CUT_OFF_REPLY = "❌ The model reply was cut off at the output token limit before it was complete."
+
+
+def strip_reasoning(text):
+    """Remove <think> reasoning from a complete reply, including unterminated or unopened blocks."""
+    text = _THINK_BLOCK_RE.sub("", text)
+    lowered = text.lower()
+    if THINK_CLOSE in lowered:
+        # Some chat templates open the block in the prompt, so only the closing tag is generated
+        text = text[lowered.rindex(THINK_CLOSE) + len(THINK_CLOSE):]
+    elif THINK_OPEN in lowered:
+        # Output budget ran out while still reasoning
+        text = text[:lowered.index(THINK_OPEN)]
+    return text.strip()
+
+
+def clean_reply(text):
+    """
+    Final text of a reply: reasoning and a Markdown code fence removed, and a
+    reply that was cut off reduced to CUT_OFF_REPLY so it is never run or cached.
+    """
+    if text.rstrip().endswith(CUT_OFF_REPLY):
+        return CUT_OFF_REPLY
+    text = strip_reasoning(text)
+    if text.startswith("```"):
+        text = _FENCE_CLOSE_RE.sub("", _FENCE_OPEN_RE.sub("", text)).strip()
+    return text
+
+
+def is_cut_off(res_json, content):
+    """True when the reply stopped at the output limit or inside an unterminated <think> block."""
+    choices = res_json.get("choices") or [{}]
+    reason = choices[0].get("finish_reason") or res_json.get("done_reason")
+    if reason == "length":
+        return True
+    lowered = content.lower()
+    return THINK_OPEN in lowered and THINK_CLOSE not in lowered[lowered.rindex(THINK_OPEN):]
+
+
+def retry_payload(payload):
+    """
+    Copy of `payload` for a second attempt after a cut-off reply: a larger
+    output budget and, where the backend supports it, no reasoning output.
+    """
+    retry = dict(payload)
+    if "options" in retry:
+        retry["options"] = {**retry["options"], "num_predict": retry["options"]["num_predict"] * LLM_CUTOFF_RETRY_FACTOR}
+        retry["think"] = False
+    else:
+        retry["max_tokens"] = retry["max_tokens"] * LLM_CUTOFF_RETRY_FACTOR
+    return retry
+
+
+def strip_reasoning_stream(pieces):
+    """
+    Streaming counterpart of strip_reasoning: hold back a leading <think> block,
+    pass the rest through. CUT_OFF_REPLY always passes.
+    """
+    buffer = ""
+    state = "start"
+    for piece in pieces:
+        if piece == CUT_OFF_REPLY:
+            yield piece
+            continue
+        if state == "text":
+            yield piece
+            continue
+        buffer += piece
+
+        if state == "start":
+            head = buffer.lstrip().lower()
+            if head.startswith(THINK_OPEN):
+                state = "think"
+            elif THINK_OPEN.startswith(head):
+                continue
+            else:
+                state = "text"
+                yield buffer
+                buffer = ""
+                continue
+
+        end = buffer.lower().find(THINK_CLOSE)
+        if end != -1:
+            rest = buffer[end + len(THINK_CLOSE):].lstrip()
+            buffer = ""
+            state = "text"
+            if rest:
+                yield rest
+
+    if state == "start" and buffer:
+        yield buffer
+
+
+_prewarmed = {}
+_prewarm_lock = threading.Lock()
+
+
+def prewarm_model(is_admin, selected_database=None):
+    """
+    Ask the backend to load the model and evaluate the static prompt prefix for
+    this role and database in the background, so the first question only pays
+    for its own tokens. Repeated calls within PREWARM_INTERVAL are ignored.
+    """
+    key = ("admin" if is_admin else "user", (selected_database or "").lower())
+    now = time.time()
+    with _prewarm_lock:
+        if now - _prewarmed.get(key, 0) < PREWARM_INTERVAL:
+            return
+        _prewarmed[key] = now
+
+    def run():
+        payload = build_payload(build_prompt_prefix(is_admin, selected_database))
+        if "options" in payload:
+            payload["options"]["num_predict"] = 1
+        else:
+            payload["max_tokens"] = 1
+        try:
+            get_llm_client().post(payload).close()
+        except Exception as e:
+            print(f"Model prewarm failed: {e}")
+
+    threading.Thread(target=run, name="llm-prewarm", daemon=True).start()
+
+
+def extract_content(res_json):
+    if 'choices' in res_json:
+        return res_json['choices'][0]['message']['content']
+    elif 'message' in res_json:
+        return res_json['message'].get('content', '')
+    elif 'result' in res_json:
+        return res_json['result']
+    elif 'completion' in res_json:
+        return res_json['completion']
+    return None
+
+
+def generation_attributes(res_json):
+    """Token counts and, from Ollama, prefill/decode timings of a completion response."""
+    attributes = {}
+    usage = res_json.get("usage") or {}
+    if usage:
+        attributes["llm.prompt_tokens"] = usage.get("prompt_tokens")
+        attributes["llm.completion_tokens"] = usage.get("completion_tokens")
+    if "prompt_eval_count" in res_json or "eval_count" in res_json:
+        attributes["llm.prompt_tokens"] = res_json.get("prompt_eval_count")
+        attributes["llm.completion_tokens"] = res_json.get("eval_count")
+        # Ollama reports durations in nanoseconds
+        for key, name in (("load_duration", "load"), ("prompt_eval_duration", "prefill"), ("eval_duration", "decode")):
+            if key in res_json:
+                attributes[f"llm.{name}_ms"] = res_json[key] / 1e6
+    return {k: v for k, v in attributes.items() if v is not None}
+
+
+def extract_stream_delta(line):
+    """
+    Parse one line of a streamed completion.
+    Handles OpenAI-compatible SSE ("data: {...}") and Ollama's native NDJSON.
+    Returns (text, finish): finish is None until the last chunk, then its
+    finish reason ("stop", "length", ...), or "stop" when the endpoint gives none.
+    """
+    line = line.strip()
+    if not line or line.startswith(":"):
+        return "", None
+    if line.startswith("data:"):
+        line = line[len("data:"):].strip()
+        if line == "[DONE]":
+            return "", "stop"
+
+    chunk = json.loads(line)
+    if "choices" in chunk:
+        choice = chunk["choices"][0] if chunk["choices"] else {}
+        delta = choice.get("delta") or choice.get("message") or {}
+        return delta.get("content") or "", choice.get("finish_reason")
+    finish = (chunk.get("done_reason") or "stop") if chunk.get("done") else None
+    if "message" in chunk:
+        return chunk["message"].get("content") or "", finish
+    if "response" in chunk:
+        return chunk["response"] or "", finish
+    return "", finish
+
+
+def cache_answer(user_input, user_memory, database, is_admin, schema_tables, reply):
+    if not reply.strip() or reply.startswith("❌"):
+        return
+    if ANSWER_CACHE_ENABLED and database and classify_reply(reply, final=True) == "sql":
+        tables = [(db, table) for db, table, _ in schema_tables]
+        answer_cache.put(user_input, database, "admin" if is_admin else "user", tables, reply.strip(),
+                         conversation_context(user_input, user_memory))
+
+
+def cached_answer(user_input, user_memory, database, is_admin):
+    # Reset so a hit does not expose the previous request's prompt breakdown
+    _request_state.token_breakdown = None
+    if ANSWER_CACHE_ENABLED and database:
+        return answer_cache.get(user_input, database, "admin" if is_admin else "user",
+                                conversation_context(user_input, user_memory))
+    return None
+
+
+def complete_payload(payload, retry=True):
+    """
+    Send a payload and return the reply text, or a "❌ ..." error message.
+    A cut-off reply is retried once with retry_payload(), then reported as CUT_OFF_REPLY.
+    """
     try:
-        response = requests.post(OLLAMA_API_URL, headers=headers, json=payload)
+        response = get_llm_client().post(payload)
         if response.ok:
             res_json = response.json()
-            if 'choices' in res_json:
-                return res_json['choices'][0]['message']['content']
-            elif 'result' in res_json:
-                return res_json['result']
-            elif 'completion' in res_json:
-                return res_json['completion']
-            else:
+            set_attributes(generation_attributes(res_json))
+            content = extract_content(res_json)
+            if content is None:
                 return "❌ Unexpected API response structure."
+            if is_cut_off(res_json, content):
+                set_attributes({"llm.cut_off": True})
+                return complete_payload(retry_payload(payload), retry=False) if retry else CUT_OFF_REPLY
+            return clean_reply(content)
         else:
             return f"❌ LLM Error {response.status_code}: {response.text}"
+    except requests.Timeout as e:
+        return f"❌ LLM request timed out: {e}"
     except Exception as e:
         return f"❌ Exception occurred: {e}"
+
+
+def stream_payload(payload):
+    """
+    Send a streaming payload and yield reply text as it arrives; errors are
+    yielded as "❌ ..." text and a reply cut off at the output limit ends with CUT_OFF_REPLY.
+    """
+    try:
+        with get_llm_client().post({**payload, "stream": True}, stream=True) as response:
+            if not response.ok:
+                yield f"❌ LLM Error {response.status_code}: {response.text}"
+                return
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                text, finish = extract_stream_delta(line)
+                if text:
+                    yield text
+                if finish:
+                    if finish == "length":
+                        yield CUT_OFF_REPLY
+                    break
+    except requests.Timeout as e:
+        yield f"❌ LLM request timed out: {e}"
+    except Exception as e:
+        yield f"❌ Exception occurred: {e}"
+
+
+def candidate_payload(payload, index):
+    """Copy of `payload` sampled with more diversity and its own seed."""
+    candidate = dict(payload)
+    if "options" in candidate:
+        candidate["options"] = {**candidate["options"], "temperature": SQL_CANDIDATE_TEMPERATURE, "seed": index}
+    else:
+        candidate["temperature"] = SQL_CANDIDATE_TEMPERATURE
+        candidate["seed"] = index
+    return candidate
+
+
+def retrieve_tables(user_input, database):
+    with span("schema.retrieve", database=database) as current:
+        schema_tables = retrieve_schema_tables(user_input, database)
+        current.set_attribute("schema.tables", len(schema_tables))
+    return schema_tables
+
+
+async def first_valid_candidate(payload, count, database):
+    """
+    Request `count` sampled completions concurrently and return the first SQL
+    reply that only references known tables and columns, cancelling the rest.
+    If none validates, natural-language replies are preferred over invalid SQL.
+    """
+    async with AsyncLLMClient() as client:
+        async def complete(candidate):
+            response = await client.post(candidate)
+            if response.status_code >= 400:
+                return f"❌ LLM Error {response.status_code}: {response.text}"
+            res_json = response.json()
+            content = extract_content(res_json)
+            if content is None:
+                return "❌ Unexpected API response structure."
+            # Candidates are sampled in parallel already, so a cut-off one is not retried
+            return CUT_OFF_REPLY if is_cut_off(res_json, content) else clean_reply(content)
+
+        tasks = [asyncio.ensure_future(complete(candidate_payload(payload, i))) for i in range(count)]
+        texts, invalid_sql, errors = [], [], []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    reply = await next_done
+                except Exception as e:
+                    errors.append(f"❌ Exception occurred: {e}")
+                    continue
+                if reply.startswith("❌"):
+                    errors.append(reply)
+                elif classify_reply(reply, final=True) != "sql":
+                    texts.append(reply)
+                elif validate_sql_against_schema(reply, database):
+                    invalid_sql.append(reply)
+                else:
+                    return reply
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return (texts or invalid_sql or errors)[0]
+
+
+def process_query_with_llama(user_input, user_memory, is_admin=False, is_selecteddatabse=False, selected_database=None,
+                             call_type="sql", candidates=SQL_CANDIDATES):
+    """
+    Send a question to the LLM and return its reply. `call_type` selects the
+    generation profile: "sql", "clarification" or "summary". With a selected
+    database and `candidates` > 1, SQL is sampled several times concurrently
+    and the first candidate that validates against schema memory is returned.
+    """
+    database = selected_database if is_selecteddatabse and selected_database else None
+    with span("llm.process", call_type=call_type, database=database, admin=is_admin) as current:
+        if call_type == "sql":
+            cached = cached_answer(user_input, user_memory, database, is_admin)
+            current.set_attribute("answer_cache.hit", cached is not None)
+            if cached is not None:
+                return cached
+
+        schema_tables = retrieve_tables(user_input, database)
+        messages = build_messages(user_input, user_memory, is_admin, database, schema_tables)
+        payload = build_payload(messages, call_type)
+
+        with span("llm.generate", call_type=call_type, candidates=candidates):
+            # Identical requests already in flight (double clicks, shared dashboards) share one upstream call
+            if call_type == "sql" and database and candidates > 1:
+                content = llm_flight.do(
+                    payload_key({**payload, "candidates": candidates}),
+                    lambda: asyncio.run(first_valid_candidate(payload, candidates, database)),
+                )
+            else:
+                content = llm_flight.do(payload_key(payload), lambda: complete_payload(payload))
+        if call_type == "sql":
+            cache_answer(user_input, user_memory, database, is_admin, schema_tables, content)
+        return content
+
+
+def stream_query_with_llama(user_input, user_memory, is_admin=False, is_selecteddatabse=False, selected_database=None,
+                            call_type="sql"):
+    """
+    Same as process_query_with_llama, but yields the reply text piece by piece
+    as the endpoint produces it. Errors are yielded as a single "❌ ..." piece.
+    """
+    database = selected_database if is_selecteddatabse and selected_database else None
+    if call_type == "sql":
+        cached = cached_answer(user_input, user_memory, database, is_admin)
+        set_attributes({"answer_cache.hit": cached is not None})
+        if cached is not None:
+            yield cached
+            return
+
+    schema_tables = retrieve_tables(user_input, database)
+    messages = build_messages(user_input, user_memory, is_admin, database, schema_tables)
+    payload = build_payload(messages, call_type)
+
+    # Not made current: the consumer runs between yields
+    generation = start_span("llm.generate", call_type=call_type, stream=True)
+    reply = ""
+    try:
+        for piece in llm_flight.stream(payload_key(payload), lambda: strip_reasoning_stream(stream_payload(payload))):
+            if piece == CUT_OFF_REPLY:
+                generation.set_attribute("llm.cut_off", True)
+                if not reply.strip():
+                    # Cut off while still reasoning, nothing shown yet: retry without streaming
+                    retry = retry_payload(payload)
+                    piece = llm_flight.do(payload_key(retry), lambda: complete_payload(retry, retry=False))
+                else:
+                    piece = "\n" + piece
+            if not reply:
+                generation.add_event("first_token")
+            reply += piece
+            yield piece
+        generation.set_attribute("llm.reply_chars", len(reply))
+    finally:
+        generation.end()
+    if call_type == "sql":
+        cache_answer(user_input, user_memory, database, is_admin, schema_tables, clean_reply(reply))
+
+
+SQL_REPLY_KEYWORDS = ("use", "select", "insert", "update", "delete", "create", "drop")
+_FIRST_WORD_RE = re.compile(r"[A-Za-z]+")
+_STATEMENT_END_RE = re.compile(r";|^\s*GO\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def classify_reply(text, final=False):
+    """
+    Decide whether a (possibly partial) reply is SQL or natural language.
+    Returns "sql", "text", or None while a streamed reply is still undecided.
+    A reply counts as SQL once it starts with a SQL keyword and its first
+    statement is complete.
+    """
+    stripped = _FENCE_OPEN_RE.sub("", text.lstrip())
+    if not stripped:
+        return "text" if final else None
+
+    match = _FIRST_WORD_RE.match(stripped)
+    if not match:
+        return "text"
+    word = match.group(0).lower()
+    word_complete = final or match.end() < len(stripped)
+
+    if not word_complete:
+        return None if any(k.startswith(word) for k in SQL_REPLY_KEYWORDS) else "text"
+    if word not in SQL_REPLY_KEYWORDS:
+        return "text"
+    if final or _STATEMENT_END_RE.search(stripped):
+        return "sql"
+    return None
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    API_KEY,
+    OLLAMA_API_URL,
+    LLM_CONNECT_TIMEOUT,
+    LLM_READ_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BACKOFF,
+    LLM_POOL_SIZE,
+)
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+HEADERS = {
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json",
+    "HTTP-Referer": "http://localhost",
+    "X-Title": "Chat2DB SQL Assistant"
+}
+
+
+class LLMClient:
+    """
+    Blocking LLM client over a keep-alive connection pool.
+    Connection errors and 5xx responses are retried with exponential backoff;
+    a read timeout is not retried, since the request may already be generating.
+    """
+
+    def __init__(self, url=OLLAMA_API_URL, headers=None, connect_timeout=LLM_CONNECT_TIMEOUT,
+                 read_timeout=LLM_READ_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                 backoff_factor=LLM_RETRY_BACKOFF, pool_size=LLM_POOL_SIZE):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update(headers or HEADERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, payload, stream=False):
+        return self.session.post(self.url, json=payload, timeout=self.timeout, stream=stream)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncLLMClient:
+    """
+    asyncio counterpart of LLMClient, built on httpx, so several LLM calls can
+    share one event loop. Use it as `async with AsyncLLMClient() as client:`.
+    """
+
+    def __init__(self, url=OLLAMA_API_URL, headers=None, connect_timeout=LLM_CONNECT_TIMEOUT,
+                 read_timeout=LLM_READ_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                 backoff_factor=LLM_RETRY_BACKOFF, pool_size=LLM_POOL_SIZE):
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.client = httpx.AsyncClient(
+            headers=headers or HEADERS,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def _backoff(self, attempt):
+        await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+
+    async def post(self, payload):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.post(self.url, json=payload)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                if attempt == self.max_retries:
+                    raise
+                await self._backoff(attempt)
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                await self._backoff(attempt)
+                continue
+            return response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Return the process-wide LLMClient, shared by every Streamlit session."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
@@ -1,5 +1,7 @@
 import os
 import json
+import tempfile
+import threading
 from config import USERS_FILE, SCHEMA_MEMORY_FILE, GLOBAL_MEMORY_FILE
 
 def load_global_memory():
@@ -22,15 +24,18 @@ def save_users(users):
     with open(USERS_FILE, "w") as f:
         json.dump(users, f, indent=2)
 
+def user_memory_path(user_id):
+    return f"memory_{user_id}.json"
+
 def load_user_memory(user_id):
-    path = f"memory_{user_id}.json"
+    path = user_memory_path(user_id)
     if os.path.exists(path):
         with open(path, "r") as f:
             return json.load(f)
     return []
 
 def save_user_memory(user_id, memory):
-    with open(f"memory_{user_id}.json", "w") as f:
+    with open(user_memory_path(user_id), "w") as f:
         json.dump(memory, f, indent=2)
 
 
@@ -43,13 +48,72 @@ def load_schema_memory_raw():
     except (FileNotFoundError, json.JSONDecodeError):
         return []
 
-def convert_schema_to_messages(schema_json):
-    messages = []
+def file_signature(path):
+    """Return (mtime_ns, size) for a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def format_schema_entry(db, table, columns):
+    cols_formatted_list = []
+    for col in columns:
+        # Support extended info: [name, type, nullability, primary_key, foreign_key]
+        col_name = col[0]
+        col_type = col[1]
+        nullability = "NULL"
+        primary_key = False
+        foreign_key = None
+
+        if len(col) > 2 and col[2] is not None:
+            nullability = col[2]
+        if len(col) > 3 and col[3] is True:
+            primary_key = True
+        if len(col) > 4:
+            foreign_key = col[4]
+
+        col_desc = f"- {col_name} ({col_type}, {nullability}"
+        if primary_key:
+            col_desc += ", PRIMARY KEY"
+        if foreign_key:
+            col_desc += f", FOREIGN KEY to {foreign_key}"
+        col_desc += ")"
+
+        cols_formatted_list.append(col_desc)
+
+    return f"Database '{db}' has table '{table}' with columns:\n" + "\n".join(cols_formatted_list)
+
+DEFAULT_SCHEMA = "dbo"
+
+def qualified_table_name(entry):
+    """
+    The name schema memory knows an entry's table by: the bare table name in
+    the default schema (or for entries without a "schema"), else "schema.table".
+    """
+    schema = (entry.get("schema") or "").strip()
+    table = entry.get("table", "").strip()
+    if not schema or schema.lower() == DEFAULT_SCHEMA:
+        return table
+    return f"{schema}.{table}"
+
+def split_table_name(name):
+    """Return (schema, table) for a name from qualified_table_name()."""
+    schema, _, table = name.rpartition(".")
+    return schema or DEFAULT_SCHEMA, table
+
+def _schema_key(entry):
+    return (entry.get("database", "").lower(), qualified_table_name(entry).lower())
+
+def iter_schema_tables(schema_json):
+    """Yield unique (database, qualified table name, columns) triples from raw schema memory."""
     seen_tables = set()
 
     for entry in schema_json:
+        if not isinstance(entry, dict):
+            continue
         db = entry.get("database", "").strip()
-        table = entry.get("table", "").strip()
+        table = qualified_table_name(entry)
         if not db or not table:
             continue
         key = (db.lower(), table.lower())
@@ -57,69 +121,124 @@ def convert_schema_to_messages(schema_json):
             continue
         seen_tables.add(key)
 
-        columns = entry.get("columns", [])
-        cols_formatted_list = []
-        for col in columns:
-            # Support extended info: [name, type, nullability, primary_key, foreign_key]
-            col_name = col[0]
-            col_type = col[1]
-            nullability = "NULL"
-            primary_key = False
-            foreign_key = None
-
-            if len(col) > 2 and col[2] is not None:
-                nullability = col[2]
-            if len(col) > 3 and col[3] is True:
-                primary_key = True
-            if len(col) > 4:
-                foreign_key = col[4]
-
-            col_desc = f"- {col_name} ({col_type}, {nullability}"
-            if primary_key:
-                col_desc += ", PRIMARY KEY"
-            if foreign_key:
-                col_desc += f", FOREIGN KEY to {foreign_key}"
-            col_desc += ")"
-
-            cols_formatted_list.append(col_desc)
-
-        content = f"Database '{db}' has table '{table}' with columns:\n" + "\n".join(cols_formatted_list)
-        messages.append({"role": "system", "content": content})
+        yield db, table, entry.get("columns", [])
 
+def convert_schema_to_messages(schema_json):
+    messages = []
+    for db, table, columns in iter_schema_tables(schema_json):
+        content = format_schema_entry(db, table, columns)
+        messages.append({"role": "system", "content": content})
     return messages
 
 def load_schema_memory():
     raw_schema = load_schema_memory_raw()
     return convert_schema_to_messages(raw_schema)
 
+_schema_listeners = []
+# Serializes the load/modify/write of schema memory between threads of this process
+_schema_lock = threading.Lock()
+
+def _write_schema_memory(raw_memory):
+    # Written to a unique temporary file first so concurrent readers never see a partial file
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=os.path.dirname(os.path.abspath(SCHEMA_MEMORY_FILE)),
+        prefix=os.path.basename(SCHEMA_MEMORY_FILE) + ".", suffix=".tmp", delete=False,
+    ) as f:
+        json.dump(raw_memory, f, indent=2, ensure_ascii=False)
+    try:
+        os.replace(f.name, SCHEMA_MEMORY_FILE)
+    except OSError:
+        os.remove(f.name)
+        raise
+
+def on_schema_change(callback):
+    """
+    Register callback(changed) to run after schema memory is saved, where
+    `changed` is a set of lowercase (database, table) pairs.
+    """
+    _schema_listeners.append(callback)
+    return callback
+
+def notify_schema_change(changed):
+    # Caches record the tables SQL reads by bare name, so both forms are announced
+    changed = set(changed) | {(db, split_table_name(table)[1]) for db, table in changed}
+    for callback in _schema_listeners:
+        try:
+            callback(changed)
+        except Exception as e:
+            print(f"Schema change listener failed: {e}")
+
 def save_schema_memory(new_entries):
     """
     Saves new schema entries to the schema memory file, avoiding duplicates.
-    Each entry must have a 'database' and 'table' key.
+    Each entry must have a 'database' and 'table' key, and may have a 'schema'.
     """
-    raw_memory = load_schema_memory_raw()
-
     if not isinstance(new_entries, list):
         new_entries = [new_entries]
 
-    # Set of (database, table) to check for duplicates
-    existing_keys = {
-        (entry.get("database", "").lower(), entry.get("table", "").lower())
-        for entry in raw_memory
-    }
+    with _schema_lock:
+        raw_memory = load_schema_memory_raw()
 
-    for entry in new_entries:
-        db = entry.get("database", "").lower()
-        table = entry.get("table", "").lower()
+        # Set of (database, table) to check for duplicates
+        existing_keys = {_schema_key(entry) for entry in raw_memory}
+        changed = set()
 
-        # Optional: normalize columns (sort alphabetically by column name)
-        if "columns" in entry and isinstance(entry["columns"], list):
-            entry["columns"] = sorted(entry["columns"], key=lambda col: col[0].lower())
+        for entry in new_entries:
+            db, table = _schema_key(entry)
 
-        if (db, table) not in existing_keys:
-            raw_memory.append(entry)
-            existing_keys.add((db, table))
+            # Optional: normalize columns (sort alphabetically by column name)
+            if "columns" in entry and isinstance(entry["columns"], list):
+                entry["columns"] = sorted(entry["columns"], key=lambda col: col[0].lower())
 
-    # Save back to file
-    with open(SCHEMA_MEMORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(raw_memory, f, indent=2, ensure_ascii=False)
+            if (db, table) not in existing_keys:
+                raw_memory.append(entry)
+                existing_keys.add((db, table))
+                if db and table:
+                    changed.add((db, table))
+
+        # Save back to file
+        _write_schema_memory(raw_memory)
+
+    if changed:
+        notify_schema_change(changed)
+
+def patch_schema_memory(entries, dropped=()):
+    """
+    Replace the schema memory entries of the (database, table) pairs in
+    `entries`, add the new ones and remove the pairs in `dropped`, whose
+    table is a qualified_table_name(), leaving
+    every other entry untouched. The file is written once, and listeners
+    notified, only when a table actually changed. Returns the set of changed
+    lowercase (database, table) pairs.
+    """
+    updates = {}
+    for entry in entries:
+        columns = sorted(entry.get("columns", []), key=lambda col: col[0].lower())
+        updates[_schema_key(entry)] = {**entry, "columns": columns}
+    dropped = {(db.lower(), table.lower()) for db, table in dropped}
+
+    with _schema_lock:
+        patched, changed = [], set()
+        for entry in load_schema_memory_raw():
+            key = None
+            if isinstance(entry, dict) and "table" in entry:
+                key = _schema_key(entry)
+            if key in dropped:
+                changed.add(key)
+            elif key in updates:
+                new_entry = updates.pop(key)
+                if new_entry["columns"] != entry.get("columns"):
+                    changed.add(key)
+                patched.append(new_entry)
+            else:
+                patched.append(entry)
+        for key, entry in updates.items():
+            patched.append(entry)
+            changed.add(key)
+
+        if changed:
+            _write_schema_memory(patched)
+
+    if changed:
+        notify_schema_change(changed)
+    return changed
@@ -0,0 +1,212 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from config import RESULT_PAGE_SIZE
+from db import query_db, quote_identifier
+from memory import DEFAULT_SCHEMA
+from schema import load_primary_keys
+from tsql_lexer import NAME_KINDS, iter_statements, iter_tokens, table_references, unquote_identifier
+
+# A SELECT using any of these at the top level is run as written instead of paged
+UNPAGEABLE = {"UNION", "INTERSECT", "EXCEPT", "INTO", "TOP", "OFFSET", "FOR", "OPTION"}
+# Keyset paging needs one row per primary key of a single table
+KEYSET_BLOCKERS = {"JOIN", "APPLY", "GROUP", "HAVING", "DISTINCT"}
+
+# `select` is the statement without its ORDER BY; `keys` is set for keyset plans
+PagePlan = namedtuple("PagePlan", ["database", "select", "order_by", "keys"])
+
+_prefetcher = ThreadPoolExecutor(max_workers=4, thread_name_prefix="page-prefetch")
+
+
+def _analyze_select(sql):
+    """Collect the top-level facts plan_paging needs from a single SELECT statement."""
+    info = {"words": set(), "order_at": None, "star": False, "columns": set(), "order": [],
+            "descending": False, "from_comma": False, "source": []}
+    depth = 0
+    clause = None
+    prev = None
+    for kind, text, start in iter_tokens(sql):
+        word = text.upper() if kind == "word" else text
+        if word == "(":
+            depth += 1
+        elif word == ")":
+            depth -= 1
+        elif depth == 0:
+            info["words"].add(word)
+            if word in ("SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER"):
+                clause = word
+                if word == "ORDER":
+                    info["order_at"] = start
+            elif clause == "SELECT":
+                if word == "*":
+                    info["star"] = True
+                elif kind in NAME_KINDS:
+                    info["columns"].add(unquote_identifier(kind, text).lower())
+            elif clause == "FROM" and word == ",":
+                info["from_comma"] = True
+            elif clause == "FROM" and kind in NAME_KINDS and (not info["source"] or prev == "."):
+                # Name parts of the first FROM source
+                info["source"].append(unquote_identifier(kind, text).lower())
+            elif clause == "ORDER" and word != "BY":
+                if word == "DESC":
+                    info["descending"] = True
+                elif kind in NAME_KINDS and word != "ASC":
+                    name = unquote_identifier(kind, text).lower()
+                    if prev == ".":
+                        info["order"][-1] = name
+                    else:
+                        info["order"].append(name)
+        prev = word
+    return info
+
+
+def plan_paging(script, database=None):
+    """
+    Return a PagePlan for a script made of USE statements and one SELECT from
+    a single table with a primary key in schema memory, or None when it
+    should run as written. SELECTs whose output includes the key and that are
+    not ordered by anything else get keyset pages; others get OFFSET/FETCH
+    pages in their own ORDER BY followed by the key, so that rows with equal
+    sort values keep one order from page to page.
+    """
+    statements = list(iter_statements(script))
+    if not statements:
+        return None
+    *prefix, select = statements
+    for stmt in prefix:
+        tokens = list(iter_tokens(stmt))
+        if not tokens or tokens[0][1].upper() != "USE" or len(tokens) < 2:
+            return None
+        database = unquote_identifier(tokens[1][0], tokens[1][1])
+
+    select = select.strip().rstrip(";").rstrip()
+    if select[:6].upper() != "SELECT":
+        return None
+    info = _analyze_select(select)
+    if info["words"] & UNPAGEABLE:
+        return None
+
+    order_by = None
+    if info["order_at"] is not None:
+        order_by = select[info["order_at"]:]
+        select = select[:info["order_at"]].rstrip()
+
+    tables, writes = table_references(select, database)
+    if writes or len(tables) != 1 or info["words"] & KEYSET_BLOCKERS or info["from_comma"]:
+        return None
+    source = info["source"]
+    if len(source) > 1 and source[-2] not in ("", DEFAULT_SCHEMA):
+        table = f"{source[-2]}.{source[-1]}"
+    else:
+        table = source[-1]
+    keys = load_primary_keys(database).get(table)
+    if not keys:
+        return None
+    if info["star"] or all(k.lower() in info["columns"] for k in keys):
+        ordered_by_key = info["order"] == [k.lower() for k in keys] and not info["descending"]
+        if order_by is None or ordered_by_key:
+            return PagePlan(database, select, None, keys)
+
+    return PagePlan(database, select, _order_with_key(order_by, keys), None)
+
+
+def _order_with_key(order_by, keys):
+    key = ", ".join(quote_identifier(k) for k in keys)
+    return f"{order_by}, {key}" if order_by else f"ORDER BY {key}"
+
+
+def page_query(plan, size, after=None, offset=0):
+    """SQL and parameters for `size` rows after the key `after` (keyset) or at `offset`."""
+    if plan.keys:
+        columns = [quote_identifier(k) for k in plan.keys]
+        sql = f"SELECT TOP (?) * FROM (\n{plan.select}\n) AS page_src"
+        params = [size]
+        if after is not None:
+            # (k1 > ?) OR (k1 = ? AND k2 > ?) OR ...
+            clauses = []
+            for i, column in enumerate(columns):
+                clauses.append("(" + " AND ".join([f"{c} = ?" for c in columns[:i]] + [f"{column} > ?"]) + ")")
+                params.extend(after[:i + 1])
+            sql += "\nWHERE " + " OR ".join(clauses)
+        return sql + "\nORDER BY " + ", ".join(columns), params
+
+    return f"{plan.select}\n{plan.order_by}\nOFFSET ? ROWS FETCH NEXT ? ROWS ONLY", [offset, size]
+
+
+class Pager:
+    """
+    Browses a SELECT one page at a time, holding only the visible page and a
+    prefetch of the next one. Keyset plans remember the key of the last row
+    before each visited page, so moving back is an index seek as well.
+    Pages are read through query_db, so they are capped, cached, traced and
+    cancelled on timeout like any other query.
+    """
+
+    def __init__(self, plan, page_size=RESULT_PAGE_SIZE, timeout=None):
+        self.plan = plan
+        self.page_size = page_size
+        self.timeout = timeout
+        self.index = 0
+        self.starts = [None]  # keyset: key of the last row before page i
+        self.page = None  # (DataFrame, has_more)
+        self._next = None  # (index, Future)
+
+    def _fetch(self, index):
+        # One extra row tells whether another page exists
+        after = self.starts[index] if self.plan.keys else None
+        sql, params = page_query(self.plan, self.page_size + 1, after, index * self.page_size)
+        outcome = query_db(sql, self.page_size + 1, self.timeout, database=self.plan.database, params=params)
+        if outcome["status"] != "ok":
+            raise RuntimeError(outcome["error"])
+        df = outcome["result"]
+        return df.iloc[:self.page_size].reset_index(drop=True), len(df) > self.page_size
+
+    def _last_key(self, df):
+        by_name = {str(c).lower(): c for c in df.columns}
+        values = [df[by_name[k.lower()]].iloc[-1] for k in self.plan.keys]
+        # numpy scalars cannot be bound as parameters
+        return [value.item() if hasattr(value, "item") else value for value in values]
+
+    def _load(self, index):
+        if self._next and self._next[0] == index:
+            future = self._next[1]
+            self._next = None
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"Page prefetch failed, fetching again: {e}")
+
+        try:
+            page = self._fetch(index)
+            if self.plan.keys and page[0].shape[0]:
+                self._last_key(page[0])  # KeyError when the key columns are not in the output
+            return page
+        except Exception as e:
+            if not self.plan.keys or index:
+                raise
+            # e.g. the PK was aliased away or the derived table has unnamed columns
+            print(f"Keyset paging failed, falling back to OFFSET/FETCH: {e}")
+            self.plan = self.plan._replace(keys=None, order_by=_order_with_key(None, self.plan.keys))
+            return self._fetch(index)
+
+    def current(self):
+        """Return (DataFrame, has_more) for the current page, prefetching the next one."""
+        if self.page is None:
+            self.page = self._load(self.index)
+            df, has_more = self.page
+            if self.plan.keys and has_more and len(self.starts) == self.index + 1:
+                self.starts.append(self._last_key(df))
+            if has_more:
+                self._next = (self.index + 1, _prefetcher.submit(self._fetch, self.index + 1))
+        return self.page
+
+    def next(self):
+        if self.page is not None and self.page[1]:
+            self.index += 1
+            self.page = None
+
+    def prev(self):
+        if self.index > 0:
+            self.index -= 1
+            self.page = None
+            self._next = None
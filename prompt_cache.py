@@ -0,0 +1,47 @@
+import threading
+
+from memory import file_signature
+
+
+class PromptPrefixCache:
+    """
+    Process-wide cache of assembled prompt prefixes.
+
+    Entries are stored per (role, database) together with the signatures of the
+    files they were built from, so an entry is rebuilt only when one of those
+    files changes on disk. Module globals are shared by every Streamlit session,
+    so callers must treat cached values as read-only.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, role, database, files, builder):
+        # Exact name: the prefix embeds the database name as the caller spelled it
+        key = (role, database or None)
+        signatures = tuple(file_signature(path) for path in files)
+
+        entry = self._entries.get(key)
+        if entry and entry[0] == signatures:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        prefix = builder()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (signatures, prefix)
+        return prefix
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+prompt_prefix_cache = PromptPrefixCache()
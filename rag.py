@@ -6,6 +6,7 @@ from langchain.document_loaders import PyMuPDFLoader
 from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from config import VECTOR_DB_FOLDER
+from tracing import span
 from transformers import AutoTokenizer
 
 tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
@@ -65,24 +66,29 @@ def retrieve_context_chunks(query, max_tokens=1000):
         return []
 
     try:
-        # Increase k to 30 for more candidates
-        results = vectorstore.similarity_search(query, k=30)
+        with span("rag.embed"):
+            query_vector = embedding.embed_query(query)
+        with span("rag.search", k=30):
+            # Increase k to 30 for more candidates
+            results = vectorstore.similarity_search_by_vector(query_vector, k=30)
+
         context_chunks = []
         total_tokens = 0
+        with span("rag.tokenize", candidates=len(results)) as current:
+            for r in results:
+                chunk_text = r.page_content
+                chunk_tokens = len(tokenizer.encode(chunk_text, add_special_tokens=False))
 
-        for r in results:
-            chunk_text = r.page_content
-            chunk_tokens = len(tokenizer.encode(chunk_text, add_special_tokens=False))
-
-            if total_tokens + chunk_tokens > max_tokens:
-                # Skip this chunk, but continue to see if smaller chunks are ahead
-                continue
+                if total_tokens + chunk_tokens > max_tokens:
+                    # Skip this chunk, but continue to see if smaller chunks are ahead
+                    continue
 
-            context_chunks.append({"role": "system", "content": chunk_text})
-            total_tokens += chunk_tokens
+                context_chunks.append({"role": "system", "content": chunk_text})
+                total_tokens += chunk_tokens
 
-            if total_tokens >= max_tokens:
-                break
+                if total_tokens >= max_tokens:
+                    break
+            current.set_attributes({"rag.chunks": len(context_chunks), "rag.tokens": total_tokens})
 
         print(f"Retrieved {len(context_chunks)} chunks, total tokens: {total_tokens}")
         return context_chunks
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from config import (
+    RESULT_CACHE_MAX_MB,
+    RESULT_CACHE_TTL,
+    RESULT_CACHE_COMPRESSION,
+)
+from memory import on_schema_change
+from tsql_lexer import iter_statements, normalize_sql
+
+# A script is only cached when every statement starts with one of these and it writes nothing
+READ_ONLY_STARTS = ("SELECT", "WITH", "USE", "SET", "DECLARE", ";")
+
+
+def is_read_only(script, writes):
+    if writes:
+        return False
+    return all(stmt.lstrip(";").lstrip().upper().startswith(READ_ONLY_STARTS) for stmt in iter_statements(script))
+
+
+def _tables_match(a, b):
+    # A script without USE runs on the login database, recorded as ""
+    (db_a, table_a), (db_b, table_b) = a, b
+    return (table_a == table_b or "*" in (table_a, table_b)) and (db_a == db_b or not db_a or not db_b)
+
+
+class ResultCache:
+    """
+    In-process cache of SELECT results keyed by normalized SQL, database,
+    row cap and parameters. Each entry remembers the tables its query read; writes executed
+    through query_db and schema memory changes drop the entries that read one
+    of the touched tables. Entries expire after RESULT_CACHE_TTL seconds to
+    bound staleness from writes made outside the app, and the least recently
+    used ones are evicted once the cache exceeds RESULT_CACHE_MAX_MB. With
+    pyarrow installed, results are stored as compressed Arrow IPC buffers.
+    """
+
+    def __init__(self, max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024), ttl=RESULT_CACHE_TTL,
+                 compression=RESULT_CACHE_COMPRESSION):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compression = compression if pa is not None and compression != "none" else None
+        self.entries = OrderedDict()  # key -> (frames, tables, nbytes, created)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Bumped on every invalidation; a result read before a concurrent write is not stored
+        self.generation = 0
+
+    @staticmethod
+    def make_key(script, database=None, max_rows=None, params=None):
+        return (database or "").lower(), max_rows, normalize_sql(script), tuple(params or ())
+
+    def _pack(self, df):
+        if self.compression:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            options = pa.ipc.IpcWriteOptions(compression=self.compression)
+            with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+            buffer = sink.getvalue()
+            return (buffer, dict(df.attrs)), buffer.size
+        return (df.copy(), dict(df.attrs)), int(df.memory_usage(deep=True).sum())
+
+    def _unpack(self, packed):
+        data, attrs = packed
+        if self.compression:
+            df = pa.ipc.open_stream(data).read_all().to_pandas()
+        else:
+            df = data.copy()
+        df.attrs.update(attrs)
+        return df
+
+    def _drop(self, key):
+        _, _, nbytes, _ = self.entries.pop(key)
+        self.size -= nbytes
+
+    def get(self, key):
+        """Return the cached result for `key` (a DataFrame or a list of them), or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[3] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            frames = entry[0]
+        results = [self._unpack(packed) for packed in frames]
+        return results if len(results) > 1 else results[0]
+
+    def put(self, key, result, tables, generation):
+        """
+        Cache a query_db result read from the (database, table) pairs in
+        `tables`; `generation` is the value of self.generation when the query
+        started.
+        """
+        frames = result if isinstance(result, list) else [result]
+        packed = [self._pack(df) for df in frames]
+        nbytes = sum(size for _, size in packed)
+        if nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if generation != self.generation:
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = ([p for p, _ in packed], frozenset(tables), nbytes, time.time())
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def invalidate_tables(self, changed):
+        """Drop every entry that read one of the (database, table) pairs in `changed`."""
+        changed = [(db.lower(), table.lower()) for db, table in changed]
+        with self.lock:
+            self.generation += 1
+            stale = [
+                key for key, entry in self.entries.items()
+                if any(_tables_match(read, written) for read in entry[1] for written in changed)
+            ]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "mb": round(self.size / 1024 / 1024, 2),
+            "invalidations": self.invalidations,
+            "arrow": bool(self.compression),
+        }
+
+
+result_cache = ResultCache()
+on_schema_change(result_cache.invalidate_tables)
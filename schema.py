@@ -1,4 +1,7 @@
 import re
+from config import SCHEMA_MEMORY_FILE
+from memory import DEFAULT_SCHEMA, load_schema_memory_raw, iter_schema_tables, file_signature
+from tsql_lexer import NAME_KINDS, iter_tokens, unquote_identifier
 
 def extract_database_name(sql):
     """
@@ -118,3 +121,173 @@ def extract_drops_from_sql(sql_text):
         drops["databases"].append(db)
 
     return drops
+
+
+_known_schema = {"signature": None, "tables": {}, "keys": {}}
+
+def _refresh_known_schema():
+    signature = file_signature(SCHEMA_MEMORY_FILE)
+    if _known_schema["signature"] != signature or signature is None:
+        tables, keys = {}, {}
+        for db, table, columns in iter_schema_tables(load_schema_memory_raw()):
+            # Tables outside dbo are known as "schema.table", as iter_schema_tables names them
+            tables.setdefault(db.lower(), {}).setdefault(table.lower(), set()).update(col[0].lower() for col in columns)
+            keys.setdefault(db.lower(), {})[table.lower()] = [col[0] for col in columns if len(col) > 3 and col[3]]
+        _known_schema["signature"] = signature
+        _known_schema["tables"] = tables
+        _known_schema["keys"] = keys
+    return _known_schema
+
+def load_known_tables(database):
+    """
+    Return {qualified table name, lowercase: set(column_lower)} for `database` from schema memory,
+    re-reading the file only when it has changed.
+    """
+    return _refresh_known_schema()["tables"].get((database or "").lower(), {})
+
+def load_primary_keys(database):
+    """Return {table_lower: [primary key column, ...]} for `database` from schema memory."""
+    return _refresh_known_schema()["keys"].get((database or "").lower(), {})
+
+
+TABLE_REF_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN|INTO|UPDATE)\s+((?:\[[^\]]+\]|[#@\w]+)(?:\s*\.\s*(?:\[[^\]]+\]|\w+))*)"
+    r"(?:\s+(?:AS\s+)?(\[[^\]]+\]|\w+))?",
+    re.IGNORECASE
+)
+COLUMN_REF_PATTERN = re.compile(r"(\[[^\]]+\]|\b[A-Za-z_]\w*)\.(\[[^\]]+\]|[A-Za-z_]\w*|\*)")
+CTE_PATTERN = re.compile(r"(?:\bWITH|,)\s*(\[[^\]]+\]|\w+)\s*(?:\(([^)]*)\))?\s*AS\s*\(", re.IGNORECASE)
+ALIAS_STOPWORDS = {
+    "where", "on", "join", "inner", "left", "right", "full", "outer", "cross", "group", "order",
+    "having", "union", "set", "values", "select", "with", "output", "go", "when", "then", "else",
+}
+
+# Clauses whose bare identifiers are column references
+COLUMN_CLAUSES = {"SELECT", "WHERE", "GROUP", "HAVING", "ORDER", "PARTITION"}
+CLAUSE_KEYWORDS = COLUMN_CLAUSES | {"FROM", "JOIN", "APPLY", "INTO", "UPDATE", "SET", "DELETE", "INSERT", "VALUES", "USE", "ON", "OPTION", "OFFSET"}
+# Words that can stand where a column could, but never name one
+SQL_KEYWORDS = CLAUSE_KEYWORDS | {
+    "ALL", "AND", "ANY", "AS", "ASC", "BETWEEN", "BY", "CASE", "COLLATE", "CROSS", "CURRENT", "CURRENT_DATE",
+    "CURRENT_TIMESTAMP", "CURRENT_USER", "DESC", "DISTINCT", "ELSE", "END", "ESCAPE", "EXCEPT", "EXISTS", "FETCH",
+    "FIRST", "FOLLOWING", "FOR", "FULL", "GO", "IN", "INNER", "INTERSECT", "IS", "JSON", "LEFT", "LIKE", "NEXT",
+    "NOT", "NULL", "ONLY", "OR", "OUTER", "OVER", "PATH", "PERCENT", "PRECEDING", "RANGE", "RIGHT", "ROW", "ROWS",
+    "SOME", "THEN", "TIES", "TOP", "UNBOUNDED", "UNION", "WHEN", "WITH", "WITHIN", "XML", "AUTO", "RAW",
+    # Type names, e.g. CONVERT(INT, ...)
+    "BIGINT", "BINARY", "BIT", "CHAR", "DATE", "DATETIME", "DATETIME2", "DATETIMEOFFSET", "DECIMAL", "FLOAT",
+    "INT", "MAX", "MONEY", "NCHAR", "NTEXT", "NUMERIC", "NVARCHAR", "REAL", "SMALLINT", "TEXT", "TIME", "TINYINT",
+    "UNIQUEIDENTIFIER", "VARBINARY", "VARCHAR",
+}
+# Functions whose first argument is a date part (year, mm, ...), not a column
+DATEPART_FUNCTIONS = {"DATEADD", "DATEDIFF", "DATEDIFF_BIG", "DATENAME", "DATEPART", "DATETRUNC"}
+
+def _unquote(name):
+    return name.strip().strip("[]").lower()
+
+def _scan_columns(sql):
+    """
+    Walk the tokens of `sql` once. Returns (references, declared, comma_join):
+    lowercase unqualified identifiers used in the select list, WHERE, GROUP BY,
+    HAVING, ORDER BY and PARTITION BY; the names the script declares itself
+    (column aliases, CTE column lists); and whether a FROM clause lists tables
+    with commas. Keywords, variables, function names and date parts are skipped.
+    """
+    tokens = list(iter_tokens(sql))
+    words = [text.upper() if kind == "word" else text for kind, text, _ in tokens]
+    clause = None
+    stack = []  # (clause, word before the parenthesis) of each enclosing parenthesis
+    closed_after = None  # word before the parenthesis that was closed last
+    references, declared = [], set()
+    comma_join = False
+
+    for i, (kind, text, _) in enumerate(tokens):
+        word = words[i]
+        prev = words[i - 1] if i else None
+        before = tokens[i - 1][0] if i else None
+        following = words[i + 1] if i + 1 < len(words) else None
+
+        if word == "(":
+            stack.append((clause, prev))
+            continue
+        if word == ")":
+            clause, closed_after = stack.pop() if stack else (None, None)
+            continue
+        if word == "," and clause == "FROM":
+            comma_join = True
+            continue
+        if kind == "word" and word in CLAUSE_KEYWORDS:
+            clause = word
+            continue
+        if kind not in NAME_KINDS or (kind == "word" and (word in SQL_KEYWORDS or text.startswith(("@", "#")))):
+            continue
+        if prev == "." or following == ".":
+            # Part of a qualified name, checked separately
+            continue
+
+        name = unquote_identifier(kind, text).lower()
+        # expr AS alias, alias = expr, and expr alias after a name, literal, ")" or END
+        if (prev == "AS"
+                or (clause == "SELECT" and following == "=" and prev in ("SELECT", ",", "DISTINCT"))
+                or prev == "END"
+                or (prev == ")" and closed_after != "TOP")
+                or before in ("bracket", "quoted", "string")
+                or (before == "word" and prev not in SQL_KEYWORDS and not prev.startswith("@"))
+                or (before == "number" and i > 1 and words[i - 2] != "TOP")):
+            declared.add(name)
+            continue
+        if following == "(" or (prev == "(" and i > 1 and words[i - 2] in DATEPART_FUNCTIONS):
+            continue
+        if clause in COLUMN_CLAUSES:
+            references.append(name)
+
+    for _, column_list in CTE_PATTERN.findall(sql):
+        declared.update(_unquote(column) for column in column_list.split(",") if column.strip())
+    return references, declared, comma_join
+
+def validate_sql_against_schema(sql, database):
+    """
+    Check the tables and columns referenced by `sql` against schema memory.
+    Returns a list of problems; an empty list means nothing unknown was referenced.
+    Qualified columns are checked against their table. Unqualified ones are
+    checked against the columns of all referenced tables, unless the script
+    also reads something whose columns schema memory does not know (temp
+    tables, table variables, catalog views, comma joins).
+    """
+    known = load_known_tables(database)
+    if not known:
+        return []
+
+    ctes = {_unquote(name) for name, _ in CTE_PATTERN.findall(sql)}
+    aliases = {}
+    problems = []
+    references, declared, opaque = _scan_columns(sql)
+
+    for ref, alias in TABLE_REF_PATTERN.findall(sql):
+        parts = [_unquote(p) for p in ref.split(".")]
+        name = parts[-1]
+        if name in ctes:
+            continue
+        if name.startswith(("#", "@")) or (len(parts) > 1 and parts[-2] in ("sys", "information_schema")):
+            opaque = True
+            continue
+        table = f"{parts[-2]}.{name}" if len(parts) > 1 and parts[-2] not in ("", DEFAULT_SCHEMA) else name
+        if table not in known:
+            problems.append(f"Unknown table '{table}'")
+            continue
+        aliases[table] = aliases[name] = table
+        if alias and _unquote(alias) not in ALIAS_STOPWORDS:
+            aliases[_unquote(alias)] = table
+
+    for qualifier, column in COLUMN_REF_PATTERN.findall(sql):
+        table = aliases.get(_unquote(qualifier))
+        if table is None or column == "*":
+            continue
+        if _unquote(column) not in known[table]:
+            problems.append(f"Unknown column '{_unquote(column)}' in table '{table}'")
+
+    if aliases and not opaque and not problems:
+        columns = set().union(*(known[table] for table in set(aliases.values())))
+        for name in dict.fromkeys(references):
+            if name not in columns and name not in declared:
+                problems.append(f"Unknown column '{name}'")
+
+    return problems
@@ -0,0 +1,210 @@
+import hashlib
+import math
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+from config import (
+    SCHEMA_MEMORY_FILE,
+    SCHEMA_RETRIEVAL_TOP_K,
+    SCHEMA_RETRIEVAL_MAX_TOKENS,
+    SCHEMA_RETRIEVAL_USE_EMBEDDINGS,
+)
+from memory import load_schema_memory_raw, iter_schema_tables, format_schema_entry, file_signature
+
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 1.0
+EMBEDDING_WEIGHT = 2.0
+
+# Question words that never identify a table on their own
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "with", "and", "or", "all", "each",
+    "every", "from", "me", "show", "list", "get", "give", "what", "which", "who", "how", "many",
+    "is", "are", "top", "per", "their", "its", "find", "select",
+}
+
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def split_identifier(name):
+    """
+    Split an identifier or free text into lowercase search terms, so that
+    'OrderDetails', 'order_details' and 'order details' share the same terms.
+    """
+    terms = []
+    for word in _WORD_RE.findall(name or ""):
+        parts = _CAMEL_RE.findall(word) or [word]
+        for part in parts:
+            part = part.lower()
+            terms.append(part)
+            # Cheap plural folding so "customers" matches "Customer"
+            if len(part) > 3 and part.endswith("s"):
+                terms.append(part[:-1])
+        if len(parts) > 1:
+            terms.append(word.lower())
+    return terms
+
+
+class SchemaIndex:
+    """
+    Lexical index over the tables of one database (or all of them), with
+    optional embedding re-ranking. The lexical scores are a few vector adds
+    per question term; with embeddings on, every question not yet in the
+    embed_question cache is also encoded by the sentence transformer, which
+    dominates the lookup (see benchmarks/bench_schema_retrieval.py).
+    """
+
+    def __init__(self, tables, use_embeddings=SCHEMA_RETRIEVAL_USE_EMBEDDINGS):
+        self.tables = tables
+        self.contents = [format_schema_entry(db, table, columns) for db, table, columns in tables]
+        self.token_counts = [None] * len(tables)
+        self.positions = {(db.lower(), table.lower()): idx for idx, (db, table, _) in enumerate(tables)}
+        postings = defaultdict(list)
+
+        for idx, (_, table, columns) in enumerate(tables):
+            weights = {}
+            for term in split_identifier(table):
+                weights[term] = max(weights.get(term, 0.0), TABLE_NAME_WEIGHT)
+            for col in columns:
+                for term in split_identifier(col[0]):
+                    weights[term] = max(weights.get(term, 0.0), COLUMN_NAME_WEIGHT)
+            for term, weight in weights.items():
+                postings[term].append((idx, weight))
+
+        # Postings as (indices, weights * idf) arrays so scoring is one vector add per term
+        n = max(len(tables), 1)
+        self.postings = {}
+        for term, posting in postings.items():
+            idf = math.log(1 + n / len(posting))
+            indices = np.fromiter((i for i, _ in posting), dtype=np.int64, count=len(posting))
+            weights = np.fromiter((w * idf for _, w in posting), dtype=np.float32, count=len(posting))
+            self.postings[term] = (indices, weights)
+
+        self.vectors = None
+        if use_embeddings and tables:
+            try:
+                from rag import embedding
+                docs = [
+                    f"{table}: " + ", ".join(col[0] for col in columns)
+                    for _, table, columns in tables
+                ]
+                self.vectors = _normalize(np.asarray(embedding.embed_documents(docs), dtype=np.float32))
+            except Exception as e:
+                print(f"Schema embeddings unavailable, using names only: {e}")
+
+    def score(self, question):
+        scores = np.zeros(len(self.tables), dtype=np.float32)
+        for term in set(split_identifier(question)):
+            if term in STOPWORDS or term.isdigit():
+                continue
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+
+        if scores.max(initial=0.0) > 0:
+            scores /= scores.max()
+
+        if self.vectors is not None:
+            query_vector = embed_question(question)
+            if query_vector is not None:
+                scores += EMBEDDING_WEIGHT * (self.vectors @ query_vector)
+        return scores
+
+    def search(self, question, top_k):
+        if len(self.tables) <= top_k:
+            return list(range(len(self.tables)))
+        scores = self.score(question)
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        return sorted(candidates.tolist(), key=lambda i: -scores[i])
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+@lru_cache(maxsize=256)
+def embed_question(question):
+    """Normalized embedding of a question, cached so callers can share it."""
+    try:
+        from rag import embedding
+        return _normalize(np.asarray(embedding.embed_query(question), dtype=np.float32))
+    except Exception as e:
+        print(f"Error embedding question for schema retrieval: {e}")
+        return None
+
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def get_schema_index(database=None):
+    """
+    Return the index for `database` (or for every database when None),
+    rebuilding it only when schema_memory.json has changed on disk.
+    """
+    key = database.lower() if database else None
+    signature = file_signature(SCHEMA_MEMORY_FILE)
+
+    cached = _indexes.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    with _index_lock:
+        cached = _indexes.get(key)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        tables = [
+            (db, table, columns)
+            for db, table, columns in iter_schema_tables(load_schema_memory_raw())
+            if key is None or db.lower() == key
+        ]
+        index = SchemaIndex(tables)
+        _indexes[key] = (signature, index)
+        return index
+
+
+def retrieve_schema_tables(question, database=None, top_k=SCHEMA_RETRIEVAL_TOP_K, max_tokens=SCHEMA_RETRIEVAL_MAX_TOKENS):
+    """
+    Return (database, table, content) for the tables most relevant to `question`,
+    scoped to `database` and limited to `top_k` tables and `max_tokens` tokens.
+    """
+    index = get_schema_index(database)
+    if not index.tables:
+        return []
+    from rag import tokenizer
+
+    selected = []
+    total_tokens = 0
+    for idx in index.search(question, top_k):
+        content = index.contents[idx]
+        tokens = index.token_counts[idx]
+        if tokens is None:
+            tokens = len(tokenizer.encode(content, add_special_tokens=False))
+            index.token_counts[idx] = tokens
+        if total_tokens + tokens > max_tokens:
+            continue
+        db, table, _ = index.tables[idx]
+        selected.append((db, table, content))
+        total_tokens += tokens
+    return selected
+
+
+def schema_fingerprint(tables):
+    """
+    Hash the current schema memory content of the given (database, table) pairs.
+    Tables that are no longer in schema memory hash as missing.
+    """
+    digest = hashlib.sha256()
+    for db, table in sorted((db.lower(), table.lower()) for db, table in tables):
+        index = get_schema_index(db)
+        idx = index.positions.get((db, table))
+        content = index.contents[idx] if idx is not None else "<missing>"
+        digest.update(f"{db}.{table}\n{content}\n".encode("utf-8"))
+    return digest.hexdigest()
@@ -0,0 +1,125 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from backends import get_backend
+from config import SCHEMA_SYNC_INTERVAL, SCHEMA_SYNC_STATE_FILE
+from db import get_connection
+from memory import load_schema_memory_raw, iter_schema_tables, patch_schema_memory, qualified_table_name
+
+
+class SchemaSync:
+    """
+    Keeps schema memory in step with the server without re-importing whole
+    databases. Each refresh reads one (modify_date, column checksum) signature
+    per table, compares them with the signatures recorded by the previous
+    refresh and re-extracts only the tables that were added or changed.
+    Dropped tables are removed. patch_schema_memory then rewrites
+    schema_memory.json only if a table really differs and notifies the caches
+    that depend on it. A database's first refresh has no signatures to compare
+    with, so all of its tables are extracted once.
+    """
+
+    def __init__(self, state_file=SCHEMA_SYNC_STATE_FILE):
+        self.state_file = state_file
+        self.state = self._load_state()  # database -> {qualified table name: [modify_date, checksum]}, all lowercase
+        self.lock = threading.Lock()
+        self.last = {}  # database -> stats of its latest refresh
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self):
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=os.path.dirname(os.path.abspath(self.state_file)),
+            prefix=os.path.basename(self.state_file) + ".", suffix=".tmp", delete=False,
+        ) as f:
+            json.dump(self.state, f)
+        try:
+            os.replace(f.name, self.state_file)
+        except OSError:
+            os.remove(f.name)
+            raise
+
+    def refresh(self, database):
+        """Sync one database; returns {"changed", "dropped", "extracted", "seconds"}."""
+        with self.lock:
+            start = time.perf_counter()
+            backend = get_backend()
+            with get_connection() as conn:
+                signatures = {}
+                for (schema, table), (modified, checksum) in backend.table_signatures(conn, database).items():
+                    name = qualified_table_name({"schema": schema, "table": table})
+                    signatures[name.lower()] = (name, [modified, checksum])
+                known = self.state.get(database.lower())
+                if known is None:
+                    # Nothing to compare with yet: compare against schema memory instead
+                    stale = [table for table, _ in signatures.values()]
+                    dropped = {
+                        table.lower() for db, table, _ in iter_schema_tables(load_schema_memory_raw())
+                        if db.lower() == database.lower() and table.lower() not in signatures
+                    }
+                else:
+                    stale = [table for key, (table, signature) in signatures.items() if known.get(key) != signature]
+                    dropped = {key for key in known if key not in signatures}
+                entries = backend.reflect_schema(conn, database, stale) if stale else []
+
+            changed = set()
+            if entries or dropped:
+                changed = patch_schema_memory(entries, {(database, table) for table in dropped})
+            new_state = {key: signature for key, (_, signature) in signatures.items()}
+            if new_state != known:
+                self.state[database.lower()] = new_state
+                self._save_state()
+
+            stats = {
+                "changed": len(changed),
+                "dropped": len(dropped),
+                "extracted": len(stale),
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+            self.last[database] = stats
+            return stats
+
+    def refresh_all(self):
+        """Sync every database that has tables in schema memory."""
+        databases = {db for db, _, _ in iter_schema_tables(load_schema_memory_raw())}
+        results = {}
+        for database in sorted(databases):
+            try:
+                results[database] = self.refresh(database)
+            except Exception as e:
+                print(f"Schema sync of {database} failed: {e}")
+        return results
+
+    def stats(self):
+        return dict(self.last)
+
+
+schema_sync = SchemaSync()
+_started = False
+_start_lock = threading.Lock()
+
+
+def _run(interval):
+    while True:
+        schema_sync.refresh_all()
+        time.sleep(interval)
+
+
+def start_schema_sync(interval=SCHEMA_SYNC_INTERVAL):
+    """Start the background sync thread once per process; interval 0 disables it."""
+    global _started
+    if not interval:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_run, args=(interval,), daemon=True, name="schema-sync").start()
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import threading
+
+
+def payload_key(payload):
+    """Stable hash of a JSON request payload."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class LeaderAbandoned(Exception):
+    """The leading caller stopped consuming a stream before it was complete."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: while a call for a key is in flight,
+    other callers with the same key wait for it and share its result instead
+    of starting their own. Nothing is cached once the call has finished.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            self.calls += 1
+            return call, True
+
+    def _finish(self, key, call):
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    @staticmethod
+    def _wait(call):
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key, fn):
+        call, leader = self._join(key)
+        if not leader:
+            return self._wait(call)
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+
+    def stream(self, key, fn):
+        """
+        Generator version of do() for streamed text: the first caller yields
+        pieces from fn() as they arrive; callers that join while it is running
+        receive the complete text as a single piece once it has finished. If
+        the first caller stops consuming early, the text is incomplete, so
+        the others start over (one of them leading) instead of receiving it.
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            call.done.wait()
+            if not isinstance(call.error, LeaderAbandoned):
+                yield self._wait(call)
+                return
+        pieces = []
+        try:
+            for piece in fn():
+                pieces.append(piece)
+                yield piece
+            call.result = "".join(pieces)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            if call.result is None and call.error is None:
+                call.error = LeaderAbandoned(f"Stream abandoned after {len(pieces)} pieces")
+            self._finish(key, call)
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
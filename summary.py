@@ -1,13 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import streamlit as st
 import chromadb
 from chromadb.utils import embedding_functions
-from db import get_connection  # Your DB connection module
+from db import list_databases, reflect_schema  # Your DB connection module
 from llm import process_query_with_llama  # Your LLM query function
+from memory import qualified_table_name
+from token_budget import count_tokens
+from config import SUMMARY_CONCURRENCY, SUMMARY_BATCH_TOKENS, SUMMARY_REDUCE_TOKENS
 
 # Constants
 CHUNK_COLLECTION_NAME = "schema_chunks"
 EMBED_MODEL = "all-MiniLM-L6-v2"
-BATCH_SIZE = 25  # Number of tables to summarize per batch
 
 # Initialize ChromaDB client
 chroma_client = chromadb.Client()
@@ -15,36 +18,17 @@ embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_na
 collection = chroma_client.get_or_create_collection(name=CHUNK_COLLECTION_NAME, embedding_function=embedding_fn)
 
 
-def extract_schema_for_database(conn, db_name):
-    cursor = conn.cursor()
-    cursor.execute(f"USE [{db_name}]")
-    cursor.execute("""
-        SELECT TABLE_SCHEMA, TABLE_NAME 
-        FROM INFORMATION_SCHEMA.TABLES 
-        WHERE TABLE_TYPE = 'BASE TABLE'
-    """)
-    tables = cursor.fetchall()
-
-    schema = []
-    for schema_name, table_name in tables:
-        cursor.execute(f"""
-            SELECT COLUMN_NAME, DATA_TYPE 
-            FROM INFORMATION_SCHEMA.COLUMNS 
-            WHERE TABLE_NAME = '{table_name}' AND TABLE_SCHEMA = '{schema_name}'
-        """)
-        columns = cursor.fetchall()
-        schema.append({
-            "database": db_name,
-            "table": table_name,
-            "columns": [[col[0], col[1]] for col in columns]
-        })
-    return schema
+def extract_schema_for_database(db_name):
+    return [
+        {**entry, "columns": [col[:2] for col in entry["columns"]]}
+        for entry in reflect_schema(db_name)
+    ]
 
 
 def chunk_schema(schema, db_name):
     chunks = []
     for entry in schema:
-        table = entry["table"]
+        table = qualified_table_name(entry)
         column_str = ", ".join([f"{col[0]} ({col[1]})" for col in entry["columns"]])
         text = f"Database: {db_name}\nTable: {table}\nColumns: {column_str}"
         chunks.append(text)
@@ -77,19 +61,43 @@ def retrieve_chunks(db_name, top_k=30):
     return []
 
 
-def batch_chunks(chunks, batch_size=BATCH_SIZE):
-    for i in range(0, len(chunks), batch_size):
-        yield chunks[i:i+batch_size]
-
-
-def summarize_schema_with_llm(chunks, db_name):
-    batch_summaries = []
-
-    for batch_num, batch in enumerate(batch_chunks(chunks), 1):
-        st.info(f"🔄 Summarizing batch {batch_num} with {len(batch)} tables...")
-        batch_text = "\n\n".join(batch)
-
-        prompt = f"""
+def batch_chunks(chunks, max_tokens=SUMMARY_BATCH_TOKENS):
+    """Group chunks into batches of at most `max_tokens` tokens (a single oversized chunk gets its own batch)."""
+    batch, batch_tokens = [], 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk)
+        if batch and batch_tokens + tokens > max_tokens:
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(chunk)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def run_concurrently(prompts, label):
+    """
+    Send prompts to the LLM with at most SUMMARY_CONCURRENCY in flight,
+    updating a progress bar as each one finishes. Results keep prompt order.
+    """
+    results = [None] * len(prompts)
+    progress = st.progress(0.0, text=f"🔄 {label}: 0/{len(prompts)}")
+
+    with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(process_query_with_llama, prompt, user_memory=[], is_admin=True, is_selecteddatabse=False, call_type="summary"): i
+            for i, prompt in enumerate(prompts)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            progress.progress(done / len(prompts), text=f"🔄 {label}: {done}/{len(prompts)}")
+
+    progress.empty()
+    return results
+
+
+def batch_prompt(db_name, batch_text):
+    return f"""
 You are a professional database expert.
 
 Below are the columns for several tables in the `{db_name}` database:
@@ -100,13 +108,22 @@ Summarize what these tables likely store based ONLY on the column names and type
 Return only the summary.
 """.strip()
 
-        summary = process_query_with_llama(prompt, user_memory=[], is_admin=True, is_selecteddatabse=False)
-        batch_summaries.append(summary)
 
-    # Combine batch summaries for a final overview
-    combined_summaries = "\n".join(batch_summaries)
+def reduce_prompt(db_name, combined_summaries):
+    return f"""
+You are a professional database expert.
+
+Here are summaries of groups of tables in the `{db_name}` database:
+
+{combined_summaries}
 
-    final_prompt = f"""
+Merge them into one summary of these tables, keeping every important table and relationship.
+Return only the summary.
+""".strip()
+
+
+def final_prompt(db_name, combined_summaries):
+    return f"""
 You are a professional database expert.
 
 Here are summaries of batches of tables in the `{db_name}` database:
@@ -117,7 +134,32 @@ Write a concise overall summary of what this database is for, its key components
 Limit to 200 words. Return only the summary.
 """.strip()
 
-    final_summary = process_query_with_llama(final_prompt, user_memory=[], is_admin=True, is_selecteddatabse=False)
+
+def summarize_schema_with_llm(chunks, db_name):
+    # Map: summarize token-sized batches concurrently
+    batches = list(batch_chunks(chunks))
+    st.info(f"🔄 Summarizing {len(chunks)} tables in {len(batches)} batches...")
+    summaries = run_concurrently(
+        [batch_prompt(db_name, "\n\n".join(batch)) for batch in batches],
+        "Summarizing batches",
+    )
+
+    # Reduce: merge groups of summaries until they fit in one final prompt
+    level = 1
+    while len(summaries) > 1 and count_tokens("\n".join(summaries)) > SUMMARY_REDUCE_TOKENS:
+        groups = list(batch_chunks(summaries, SUMMARY_REDUCE_TOKENS))
+        if len(groups) == len(summaries):
+            # Every summary is already as large as the limit; pair them up so the reduce still converges
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        summaries = run_concurrently(
+            [reduce_prompt(db_name, "\n\n".join(group)) for group in groups],
+            f"Merging summaries (level {level})",
+        )
+        level += 1
+
+    # Combine batch summaries for a final overview
+    combined_summaries = "\n".join(summaries)
+    final_summary = process_query_with_llama(final_prompt(db_name, combined_summaries), user_memory=[], is_admin=True, is_selecteddatabse=False, call_type="summary")
     return final_summary
 
 
@@ -125,18 +167,12 @@ def run_summary_app():
     st.title("📘 Schema Summary & Embedding")
 
     # Step 1: Select DB
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT name FROM sys.databases 
-        WHERE name NOT IN ('master', 'tempdb', 'model', 'msdb')
-    """)
-    db_names = [row[0] for row in cursor.fetchall()]
+    db_names = list_databases()
     db_name = st.selectbox("Select a database", db_names)
 
     if st.button("🔍 Extract, Embed & Summarize Schema"):
         # Step 2: Extract
-        schema = extract_schema_for_database(conn, db_name)
+        schema = extract_schema_for_database(db_name)
         st.success("✅ Schema extracted")
 
         # Step 3: Chunk
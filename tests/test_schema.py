@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import schema  # noqa: E402
+
+KNOWN = {
+    "orders": {"id", "customerid", "region", "revenue", "orderdate"},
+    "customers": {"id", "name", "region"},
+}
+
+
+def validate(sql, monkeypatch):
+    monkeypatch.setattr(schema, "load_known_tables", lambda database: KNOWN)
+    return schema.validate_sql_against_schema(sql, "Sales")
+
+
+def test_misspelled_unqualified_column_is_rejected(monkeypatch):
+    problems = validate("USE Sales;\nGO\nSELECT Region, SUM(Revenu) AS Total FROM Orders GROUP BY Region;", monkeypatch)
+    assert problems == ["Unknown column 'revenu'"]
+
+
+def test_unqualified_columns_of_joined_tables_are_accepted(monkeypatch):
+    sql = """
+        SELECT Name, SUM(Revenue) AS Total, DATEPART(year, OrderDate) y
+        FROM Orders o JOIN Customers c ON o.CustomerId = c.Id
+        WHERE Revenue > @min
+        GROUP BY Name, DATEPART(year, OrderDate)
+        ORDER BY Total DESC
+    """
+    assert validate(sql, monkeypatch) == []
+
+
+def test_cte_columns_and_aliases_are_not_columns(monkeypatch):
+    sql = "WITH t (r, s) AS (SELECT Region, SUM(Revenue) FROM Orders GROUP BY Region) SELECT r, s FROM t ORDER BY s"
+    assert validate(sql, monkeypatch) == []
+
+
+
+def test_tables_outside_dbo_are_checked_by_schema(monkeypatch):
+    monkeypatch.setitem(KNOWN, "archive.orders", {"id", "archivedat"})
+    assert validate("SELECT o.ArchivedAt FROM archive.Orders o", monkeypatch) == []
+    assert validate("SELECT o.ArchivedAt FROM Orders o", monkeypatch) == ["Unknown column 'archivedat' in table 'orders'"]
+    assert validate("SELECT Id FROM sales.Orders", monkeypatch) == ["Unknown table 'sales.orders'"]
@@ -0,0 +1,137 @@
+import threading
+from functools import lru_cache
+
+from config import LLM_TOKENIZER, PROMPT_TOKEN_BUDGET
+
+# Sources that are never trimmed
+REQUIRED_SOURCES = ("system", "database", "question")
+
+# Higher priority is kept longer; the lowest priority source is trimmed first.
+# admin_memory and global_memory belong to the cached prompt prefix and are only
+# trimmed against each other, when the prefix is built
+DEFAULT_PRIORITIES = {
+    "schema_memory": 5,
+    "admin_memory": 4,
+    "user_memory": 3,
+    "global_memory": 2,
+    "retrieved_context": 1,
+}
+
+# Per-source token caps, applied before the total budget
+DEFAULT_CAPS = {
+    "schema_memory": 2000,
+    "admin_memory": 1000,
+    "user_memory": 1000,
+    "global_memory": 1000,
+    "retrieved_context": 1000,
+}
+
+# Chat histories keep their most recent messages; ranked sources keep their best ones
+KEEP_NEWEST = {"admin_memory", "user_memory", "global_memory"}
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """Load the tokenizer of the target model once; None if it is unavailable."""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(LLM_TOKENIZER)
+                except Exception as e:
+                    print(f"Tokenizer '{LLM_TOKENIZER}' unavailable, estimating tokens from length: {e}")
+                    _tokenizer = False
+    return _tokenizer or None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        # Roughly four characters per token for English text and SQL identifiers
+        return max(1, len(text) // 4)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _fit(messages, limit, keep_newest):
+    """Keep whole messages within `limit` tokens. Returns (kept, kept_tokens)."""
+    ordered = list(reversed(messages)) if keep_newest else list(messages)
+    kept, used = [], 0
+    for msg in ordered:
+        tokens = count_tokens(msg["content"])
+        if used + tokens > limit:
+            # A history stops at the first message that no longer fits; ranked sources try smaller ones
+            if keep_newest:
+                break
+            continue
+        kept.append(msg)
+        used += tokens
+    if keep_newest:
+        kept.reverse()
+    return kept, used
+
+
+class TokenBudget:
+    """
+    Enforce a total prompt token budget across named message sources.
+
+    Each trimmable source is first cut to its cap. If the prompt is still over
+    budget, sources are trimmed in ascending priority order until it fits.
+    Sources budgeted earlier (the cached prompt prefix) can be passed as
+    `fixed`: they count against the total but are never trimmed again.
+    """
+
+    def __init__(self, total=PROMPT_TOKEN_BUDGET, caps=None, priorities=None):
+        self.total = total
+        self.caps = {**DEFAULT_CAPS, **(caps or {})}
+        self.priorities = {**DEFAULT_PRIORITIES, **(priorities or {})}
+
+    def apply(self, sources, fixed=None):
+        """
+        `sources` maps source name -> list of messages, in prompt order.
+        `fixed` is the breakdown returned for sources that were budgeted before.
+        Returns (trimmed sources, breakdown), where breakdown maps each source,
+        fixed ones included, to its kept/dropped token and message counts, plus
+        a "total" entry.
+        """
+        fixed = {name: counts for name, counts in (fixed or {}).items() if name != "total"}
+        reserved = sum(counts["tokens"] for counts in fixed.values())
+        kept = {}
+        tokens = {}
+        for name, messages in sources.items():
+            if name in REQUIRED_SOURCES or name not in self.priorities:
+                kept[name] = list(messages)
+                tokens[name] = sum(count_tokens(m["content"]) for m in messages)
+            else:
+                kept[name], tokens[name] = _fit(messages, self.caps.get(name, self.total), name in KEEP_NEWEST)
+
+        overflow = reserved + sum(tokens.values()) - self.total
+        trimmable = sorted(
+            (name for name in sources if name in self.priorities and name not in REQUIRED_SOURCES),
+            key=lambda name: self.priorities[name],
+        )
+        for name in trimmable:
+            if overflow <= 0:
+                break
+            limit = max(0, tokens[name] - overflow)
+            kept[name], new_tokens = _fit(kept[name], limit, name in KEEP_NEWEST)
+            overflow -= tokens[name] - new_tokens
+            tokens[name] = new_tokens
+
+        breakdown = dict(fixed)
+        for name, messages in sources.items():
+            breakdown[name] = {
+                "tokens": tokens[name],
+                "messages": len(kept[name]),
+                "dropped_messages": len(messages) - len(kept[name]),
+                "dropped_tokens": sum(count_tokens(m["content"]) for m in messages) - tokens[name],
+            }
+        breakdown["total"] = {"tokens": reserved + sum(tokens.values()), "budget": self.total}
+        return kept, breakdown
+
+
+prompt_budget = TokenBudget()
@@ -0,0 +1,99 @@
+import atexit
+import contextlib
+import os
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+except ImportError:
+    trace = None
+
+from config import TRACING_EXPORTER, TRACING_FILE, TRACING_OTLP_ENDPOINT, TRACING_SERVICE_NAME
+
+
+class _NoSpan:
+    """Stands in for a span when tracing is off or opentelemetry is not installed."""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+    def end(self):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def _exporter():
+    if TRACING_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    if TRACING_EXPORTER == "file":
+        # One JSON span per line, appended as spans finish
+        out = open(TRACING_FILE, "a", encoding="utf-8")
+        atexit.register(out.close)
+        return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + os.linesep)
+    if TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter(endpoint=TRACING_OTLP_ENDPOINT) if TRACING_OTLP_ENDPOINT else OTLPSpanExporter()
+    raise ValueError(f"Unknown TRACING_EXPORTER: {TRACING_EXPORTER}")
+
+
+def setup_tracing():
+    """Install a tracer provider for TRACING_EXPORTER; returns the tracer, or None when tracing is off."""
+    if trace is None or TRACING_EXPORTER == "none":
+        return None
+    try:
+        provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+                                  shutdown_on_exit=False)
+        processor = SimpleSpanProcessor if TRACING_EXPORTER in ("console", "file") else BatchSpanProcessor
+        provider.add_span_processor(processor(_exporter()))
+        trace.set_tracer_provider(provider)
+        # Registered here rather than by the provider (shutdown_on_exit) so that, atexit running
+        # handlers in reverse order, pending spans are flushed before the trace file is closed
+        atexit.register(provider.shutdown)
+    except Exception as e:
+        print(f"Tracing disabled: {e}")
+        return None
+    return trace.get_tracer("chat2db")
+
+
+tracer = setup_tracing()
+
+
+def _clean(attributes):
+    # OpenTelemetry only accepts str, bool, int, float and sequences of them
+    return {k: v if isinstance(v, (str, bool, int, float)) else str(v) for k, v in attributes.items() if v is not None}
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Run the block in a child span of the current one; exceptions are recorded on it."""
+    if tracer is None:
+        yield _NO_SPAN
+        return
+    with tracer.start_as_current_span(name, attributes=_clean(attributes)) as current:
+        yield current
+
+
+def start_span(name, **attributes):
+    """
+    Start a span without making it current, for work spread over a generator's
+    yields (streamed replies). The caller must end() it.
+    """
+    if tracer is None:
+        return _NO_SPAN
+    return tracer.start_span(name, attributes=_clean(attributes))
+
+
+def set_attributes(attributes):
+    """Add a dict of attributes to the current span."""
+    if tracer is not None:
+        trace.get_current_span().set_attributes(_clean(attributes))
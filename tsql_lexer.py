@@ -0,0 +1,365 @@
+import re
+from collections import namedtuple
+
+# One alternative per token kind; every character of the script is consumed exactly once
+TOKEN_RE = re.compile(r"""
+     (?P<newline>\n)
+    |(?P<space>[ \t\r\f\v]+)
+    |(?P<line_comment>--[^\n]*)
+    |(?P<block_comment>/\*)
+    |(?P<string>[Nn]?'[^']*(?:''[^']*)*'?)
+    |(?P<bracket>\[[^\]]*(?:\]\][^\]]*)*\]?)
+    |(?P<quoted>"[^"]*(?:""[^"]*)*"?)
+    |(?P<word>[^\W\d][\w@#$]*|[@#][\w@#$]*)
+    |(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+    |(?P<symbol>.)
+""", re.VERBOSE | re.DOTALL)
+
+# Inside parentheses only nesting, quoting, comments, variables and line breaks matter,
+# so runs of anything else (typically INSERT ... VALUES data) are skipped in one step
+NESTED_SKIP_RE = re.compile(r"(?:[^'\"\[\]()/\-@#\n]+|[Nn]?'[^']*(?:''[^']*)*')+")
+BLOCK_COMMENT_RE = re.compile(r"/\*|\*/")
+GO_COUNT_RE = re.compile(r"[ \t]+(\d+)")
+
+# Keywords that start a new statement when they begin a line at the top level
+STATEMENT_STARTERS = {
+    "SELECT", "INSERT", "UPDATE", "DELETE", "MERGE", "CREATE", "DROP", "ALTER", "TRUNCATE",
+    "USE", "IF", "WHILE", "EXEC", "EXECUTE", "BEGIN", "COMMIT", "ROLLBACK", "PRINT", "GRANT",
+    "REVOKE", "DENY",
+}
+# A starter right after one of these continues the current statement
+CONTINUATIONS = {
+    "UNION", "ALL", "EXCEPT", "INTERSECT", "AS", "(", ",", "=", "THEN", "ELSE", "FOR",
+    "ON", "NOT", "EXISTS", "IN", "AND", "OR", "RETURN", "INTO",
+}
+# CREATE/ALTER of these take the rest of the batch as their body
+MODULE_OBJECTS = {"VIEW", "PROC", "PROCEDURE", "FUNCTION", "TRIGGER"}
+TRANSACTION_WORDS = {"TRAN", "TRANSACTION", "DISTRIBUTED", "DIALOG", "CONVERSATION"}
+
+Batch = namedtuple("Batch", ["text", "count", "statements"])
+
+
+def _skip_block_comment(script, pos):
+    """Return the position after the (possibly nested) block comment starting at `pos`."""
+    depth = 0
+    for match in BLOCK_COMMENT_RE.finditer(script, pos):
+        depth += 1 if match.group() == "/*" else -1
+        if depth == 0:
+            return match.end()
+    return len(script)
+
+
+class _StatementSplitter:
+    """
+    Tracks just enough T-SQL structure to find statement boundaries inside a
+    batch: parentheses, BEGIN/END and CASE/END nesting, IF/WHILE/ELSE bodies,
+    CTEs, INSERT ... SELECT, MERGE and module bodies (CREATE PROC/VIEW/...).
+    """
+
+    def __init__(self, start):
+        self.splits = [start]
+        self.depth = 0
+        self.blocks = 0
+        self.cases = 0
+        self.uses_variables = False
+        self.module_body = False
+        self._new_statement()
+
+    def _new_statement(self):
+        self.head = []
+        self.prev = None
+        self.terminated = False
+        self.pending_body = False
+        self.cte_pending = False
+        self.insert_needs_source = False
+        self.begin_pending = False
+
+    def _split(self, pos):
+        self.splits.append(pos)
+        self._new_statement()
+
+    def feed(self, word, start, line_start):
+        """Process one significant token (uppercased word or symbol) starting at `start`."""
+        top_level = self.depth == 0 and self.blocks == 0 and self.cases == 0 and not self.module_body
+
+        if self.begin_pending:
+            self.begin_pending = False
+            if word not in TRANSACTION_WORDS:
+                self.blocks += 1
+                top_level = False
+
+        if self.terminated and top_level and word not in ("ELSE", ";"):
+            self._split(start)
+        elif top_level and word in STATEMENT_STARTERS and self.head:
+            if self.pending_body:
+                self.pending_body = False
+            elif self.cte_pending:
+                self.cte_pending = False
+            elif self.insert_needs_source and word in ("SELECT", "EXEC", "EXECUTE"):
+                self.insert_needs_source = False
+            elif self.head[0] == "MERGE" or self.prev in CONTINUATIONS:
+                pass
+            elif line_start:
+                self._split(start)
+        self.terminated = False
+
+        if word != ";" and len(self.head) < 4:
+            self.head.append(word)
+            if len(self.head) == 1:
+                self.cte_pending = word == "WITH"
+            elif self.head[0] in ("CREATE", "ALTER") and word in MODULE_OBJECTS:
+                # CREATE [OR ALTER] PROC/VIEW/...: the rest of the batch is its body
+                self.module_body = True
+
+        if word == "(":
+            self.depth += 1
+        elif word == ")":
+            self.depth = max(0, self.depth - 1)
+        elif word == ";":
+            if self.head and self.depth == 0 and self.blocks == 0 and self.cases == 0:
+                self.terminated = True
+        elif word == "CASE":
+            self.cases += 1
+        elif word == "END":
+            if self.cases:
+                self.cases -= 1
+            elif self.blocks:
+                self.blocks -= 1
+        elif word == "BEGIN":
+            self.pending_body = False
+            self.begin_pending = True
+        elif word in ("IF", "WHILE", "ELSE"):
+            if self.depth == 0 and self.cases == 0:
+                self.pending_body = True
+        elif word == "INSERT":
+            self.insert_needs_source = True
+        elif word in ("VALUES", "DEFAULT") and self.insert_needs_source:
+            self.insert_needs_source = False
+        elif word.startswith("@"):
+            self.uses_variables = True
+
+        self.prev = word
+
+    def statements(self, script, end):
+        if self.uses_variables:
+            # Variables are scoped to the batch, so it cannot be split
+            bounds = [(self.splits[0], end)]
+        else:
+            bounds = zip(self.splits, self.splits[1:] + [end])
+        return [stmt for stmt in (script[a:b].strip() for a, b in bounds) if stmt]
+
+
+def iter_script(script):
+    """
+    Lex a T-SQL script once and yield a Batch(text, count, statements) for each
+    GO-separated batch, where `count` is the GO repeat count. GO separates
+    batches when it starts a line or directly follows a ';' on the same line;
+    GO inside strings, bracketed/quoted identifiers and comments is ignored.
+    """
+    pos = 0
+    end = len(script)
+    batch_start = 0
+    splitter = _StatementSplitter(0)
+    line_start = True
+    prev = None
+
+    while pos < end:
+        if splitter.depth and not line_start:
+            skipped = NESTED_SKIP_RE.match(script, pos)
+            if skipped:
+                pos = skipped.end()
+                prev = None
+                continue
+
+        match = TOKEN_RE.match(script, pos)
+        kind = match.lastgroup
+        start, pos = match.start(), match.end()
+
+        if kind == "newline":
+            line_start = True
+            continue
+        if kind in ("space", "line_comment"):
+            continue
+        if kind == "block_comment":
+            pos = _skip_block_comment(script, start)
+            continue
+
+        if kind == "word":
+            word = match.group().upper()
+        elif kind == "symbol":
+            word = match.group()
+        else:
+            word = kind
+
+        if word == "GO" and (line_start or prev == ";"):
+            count = 1
+            count_match = GO_COUNT_RE.match(script, pos)
+            if count_match:
+                count = max(1, int(count_match.group(1)))
+                pos = count_match.end()
+            text = script[batch_start:start].strip()
+            if text:
+                yield Batch(text, count, splitter.statements(script, start))
+            batch_start = pos
+            splitter = _StatementSplitter(pos)
+            line_start = False
+            prev = None
+            continue
+
+        splitter.feed(word, start, line_start)
+        line_start = False
+        prev = word
+
+    text = script[batch_start:].strip()
+    if text:
+        yield Batch(text, 1, splitter.statements(script, end))
+
+
+def iter_batches(script):
+    """Yield (batch_text, count) for each GO-separated batch."""
+    for batch in iter_script(script):
+        yield batch.text, batch.count
+
+
+def iter_statements(script):
+    """Yield the individual statements of a script, repeating batches marked GO <count>."""
+    for batch in iter_script(script):
+        for _ in range(batch.count):
+            yield from batch.statements
+
+
+def iter_tokens(script):
+    """Yield (kind, text, start) for every token that is not whitespace or a comment."""
+    pos = 0
+    end = len(script)
+    while pos < end:
+        match = TOKEN_RE.match(script, pos)
+        kind = match.lastgroup
+        pos = match.end()
+        if kind == "block_comment":
+            pos = _skip_block_comment(script, match.start())
+        elif kind not in ("newline", "space", "line_comment"):
+            yield kind, match.group(), match.start()
+
+
+def normalize_sql(script):
+    """
+    Canonical form of a script for cache keys: comments dropped, whitespace
+    collapsed and keywords/unquoted identifiers uppercased. Literals and
+    quoted identifiers are kept exactly.
+    """
+    return " ".join(text.upper() if kind == "word" else text for kind, text, _ in iter_tokens(script)).rstrip(" ;")
+
+
+def unquote_identifier(kind, text):
+    if kind == "bracket":
+        return text[1:-1].replace("]]", "]")
+    if kind == "quoted":
+        return text[1:-1].replace('""', '"')
+    return text
+
+
+NAME_KINDS = ("word", "bracket", "quoted")
+# Keywords whose following object name is written to
+_WRITE_TARGETS = {"INSERT", "UPDATE", "DELETE", "MERGE", "INTO", "TRUNCATE"}
+_NAME_PREFIXES = {"INTO", "FROM", "TABLE", "IF", "EXISTS", "OR", "ALTER"}
+# Keywords that end a FROM clause, after which a "," no longer introduces another source
+_FROM_CLAUSE_END = {
+    "WHERE", "GROUP", "HAVING", "ORDER", "UNION", "EXCEPT", "INTERSECT", "SELECT", "INSERT", "UPDATE",
+    "DELETE", "MERGE", "SET", "OPTION", "FOR", "WINDOW", "GO", ";",
+}
+
+
+def table_references(script, database=None):
+    """
+    Return (tables, writes): lowercase (database, table) pairs the script
+    references and the subset it modifies. The database comes from a
+    three-part name, else the latest USE, else `database`. A pair with table
+    "*" means the whole database may change (EXEC, DDL on anything other
+    than a table) or, among reads, that the script reads something whose
+    tables cannot be named (a table-valued function, OPENQUERY, ...). Every
+    source of a FROM clause is a read, including those after "," and APPLY.
+    Tokens are streamed, so large scripts are not held twice.
+    """
+    current = (database or "").lower()
+    tables, writes = set(), set()
+    mode = None  # meaning of the next object name: use, read, write, ddl, ddl_table or database
+    parts = []
+    more = False  # a "." was seen and another name part is expected
+    depth = 0
+    from_depths = []  # parenthesis depths of the FROM clauses being read
+
+    def finish(called):
+        nonlocal current
+        if mode == "use":
+            current = parts[-1]
+        elif mode == "database":
+            writes.add((parts[-1], "*"))
+        elif mode == "read" and called:
+            # A function or rowset source: what it reads is unknown
+            tables.add((parts[-3] if len(parts) >= 3 else current, "*"))
+        elif not parts[-1].startswith(("#", "@")):
+            ref = (parts[-3] if len(parts) >= 3 else current, parts[-1])
+            tables.add(ref)
+            if mode in ("write", "ddl_table"):
+                writes.add(ref)
+
+    for kind, text, _ in iter_tokens(script):
+        word = text.upper() if kind == "word" else text
+
+        if parts:
+            if word == ".":
+                more = True
+                continue
+            if more and kind in NAME_KINDS:
+                parts.append(unquote_identifier(kind, text).lower())
+                more = False
+                continue
+            finish(word == "(")
+            parts, mode = [], None
+        elif mode:
+            if word in _NAME_PREFIXES:
+                if word == "TABLE" and mode == "ddl":
+                    mode = "ddl_table"
+                continue
+            if word == "DATABASE" and mode == "ddl":
+                mode = "database"
+                continue
+            if mode == "ddl":
+                # Views, procedures, indexes...: result shapes may change anywhere in the database
+                writes.add((current, "*"))
+                mode = None
+                continue
+            if kind in NAME_KINDS:
+                parts = [unquote_identifier(kind, text).lower()]
+                continue
+            mode = None
+
+        if word == "(":
+            depth += 1
+        elif word == ")":
+            depth = max(0, depth - 1)
+            while from_depths and from_depths[-1] > depth:
+                from_depths.pop()
+        elif word in _FROM_CLAUSE_END:
+            while from_depths and from_depths[-1] >= depth:
+                from_depths.pop()
+
+        if word == "USE":
+            mode = "use"
+        elif word in ("EXEC", "EXECUTE"):
+            writes.add((current, "*"))
+        elif word in ("FROM", "JOIN", "APPLY"):
+            mode = "read"
+            if word == "FROM" and (not from_depths or from_depths[-1] < depth):
+                from_depths.append(depth)
+        elif word == "," and from_depths and from_depths[-1] == depth:
+            mode = "read"
+        elif word in _WRITE_TARGETS:
+            mode = "write"
+        elif word in ("CREATE", "ALTER", "DROP"):
+            mode = "ddl"
+
+    if parts:
+        finish(False)
+    return tables | writes, writes